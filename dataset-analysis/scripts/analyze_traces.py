@@ -14,15 +14,15 @@ data_source = os.environ.get('SB_DATA_SOURCE', None) or 'lg12'
 default_data_path = root_dir / 'data' / data_source / 'raw'
 apps_path = os.environ.get('SB_DATA_DIR', None) or default_data_path
 
-# Force reanalysis (e.g., after updates to analyzer)
+# Force reanalysis of all traces. Otherwise, the analyzer skips unchanged
+# traces.json files and only analyzes new traces appended to traces.json files
+# based on the trace_breakdown_manifest.json. Updates to the analyzer trigger
+# a reanalysis if they increment the ANALYZER_VERSION.
 always_analyze = False
 
 print(f"Analyze new traces.json files in {apps_path}")
 traces = list(apps_path.glob('**/traces.json'))
 sb = Sb()
 for trace in traces:
-	log_dir = trace.parent
-	trace_breakdown = log_dir / 'trace_breakdown.csv'
-	if always_analyze or not trace_breakdown.is_file():
-		print(trace)
-		sb.analyze_traces(trace)
+	print(trace)
+	sb.analyze_traces(trace, force=always_analyze)
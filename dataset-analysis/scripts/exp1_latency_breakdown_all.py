@@ -172,7 +172,7 @@ for app_name, app_source in apps.items():
             # plot_latency_by_load_level(trace_breakdown_both_groups, app_name, iteration)
             # Append full URL to trace_breakdown from k6_invocations
             trace_breakdown_merged = pd.merge(trace_breakdown, k6_invocations, how='left', on=['trace_id'])
-            trace_breakdown_merged['request_type'] = trace_breakdown_merged.apply(lambda row: request_type(app_name, row['url_y'], row['method'], row['longest_path_names']), axis=1)
+            trace_breakdown_merged = add_request_type(trace_breakdown_merged, app_name)
             # Group all 4 different data sources
             ips_dfs = [workload_rates, workload_options, k6_invocations_grouped, trace_breakdown_grouped]
             df_long = merge_by_relative_time(ips_dfs)
@@ -41,7 +41,7 @@ def read_all_apps() -> pd.DataFrame:
                 # # plot_latency_by_load_level(trace_breakdown_both_groups, app_name, iteration)
                 # # Append full URL to trace_breakdown from k6_invocations
                 trace_breakdown_merged = pd.merge(trace_breakdown, k6_invocations, how='left', on=['trace_id'])
-                trace_breakdown_merged['request_type'] = trace_breakdown_merged.apply(lambda row: request_type(app_name, row['url_y'], row['method'], row['longest_path_names']), axis=1)
+                trace_breakdown_merged = add_request_type(trace_breakdown_merged, app_name)
                 # Save iteration with an appropriate label
                 workload_label = get_workload_label(app_config)
                 trace_breakdown_dfs[workload_label] = trace_breakdown_merged
@@ -182,13 +182,38 @@ def read_sb_app_config(execution):
     return app_config, app_name
 
 def read_trace_breakdown(execution) -> pd.DataFrame:
+    """Returns a pandas dataframe with the parsed trace_breakdown.parquet if available
+    (sb analyze_traces --output_format=parquet) or otherwise trace_breakdown.csv"""
+    if (execution / 'trace_breakdown.parquet').is_file():
+        trace_breakdown = read_trace_breakdown_parquet(execution)
+    else:
+        trace_breakdown = read_trace_breakdown_csv(execution)
+    trace_breakdown = add_longest_path_names(execution, trace_breakdown)
+    trace_breakdown['start_time_ts'] = pd.to_datetime(trace_breakdown['start_time'], unit='s')
+    # start_time in epoc time (millisecond precision with 3 digits after the period dot)
+    start = trace_breakdown['start_time'].min()
+    # Identify start and end times
+    trace_breakdown['relative_time'] = trace_breakdown['start_time'] - start
+    trace_breakdown = trace_breakdown.sort_values(by=['relative_time'])
+    return trace_breakdown
+
+def read_trace_breakdown_parquet(execution) -> pd.DataFrame:
+    """Returns a pandas dataframe with the trace_breakdown.parquet.
+    The columnar format requires no parsing because it stores durations as timedelta64[ns],
+    lists as list columns, and repetitive strings (e.g., url) as categories."""
+    trace_breakdown_path = execution / 'trace_breakdown.parquet'
+    return pd.read_parquet(trace_breakdown_path, engine='pyarrow')
+
+def read_trace_breakdown_csv(execution) -> pd.DataFrame:
     """Returns a pandas dataframe with the parsed trace_breakdown.csv"""
     trace_breakdown_path = execution / 'trace_breakdown.csv'
     converters = {
         # Parsing list of strings through json
         'longest_path_names': lambda x: ast.literal_eval(x)
     }
-    trace_breakdown = pd.read_csv(trace_breakdown_path, converters=converters)
+    # Hex digests of path ids can look like numbers (e.g., 0123456789012345 or 1234e56789012345)
+    dtype = {'path_id': str}
+    trace_breakdown = pd.read_csv(trace_breakdown_path, converters=converters, dtype=dtype)
 
     # See categories in sb code under aws_trace_analyzer.py:CSV_FIELDS
     timedelta_columns = [
@@ -205,12 +230,27 @@ def read_trace_breakdown(execution) -> pd.DataFrame:
     ]
     # Parse timedelta and datetime fields
     trace_breakdown[timedelta_columns] = trace_breakdown[timedelta_columns].apply(pd.to_timedelta)
-    trace_breakdown['start_time_ts'] = pd.to_datetime(trace_breakdown['start_time'], unit='s')
-    # start_time in epoc time (millisecond precision with 3 digits after the period dot)
-    start = trace_breakdown['start_time'].min()
-    # Identify start and end times
-    trace_breakdown['relative_time'] = trace_breakdown['start_time'] - start
-    trace_breakdown = trace_breakdown.sort_values(by=['relative_time'])
+    return trace_breakdown
+
+def read_trace_paths(execution) -> dict:
+    """Returns a dictionary of path_id => list of span names along the longest path
+    without Initialization segments from the path dictionary trace_paths.json."""
+    with open(execution / 'trace_paths.json') as f:
+        trace_paths = json.load(f)
+    return {path_id: path['names'] for path_id, path in trace_paths['paths'].items()}
+
+def add_longest_path_names(execution, trace_breakdown) -> pd.DataFrame:
+    """Ensures both the path_id and longest_path_names columns.
+    Newer analyzer versions only write the path_id per trace and the span names per
+    unique path into trace_paths.json. Hence, traces of the same path share the same list.
+    Older trace breakdowns only contain the longest_path_names and get
+    the JSON-encoded span names without Initialization segments as path_id."""
+    if 'longest_path_names' not in trace_breakdown.columns:
+        trace_paths = read_trace_paths(execution)
+        trace_breakdown['longest_path_names'] = trace_breakdown['path_id'].map(trace_paths)
+    elif 'path_id' not in trace_breakdown.columns:
+        trace_breakdown['path_id'] = trace_breakdown['longest_path_names'].map(
+            lambda names: json.dumps([n for n in names if n != 'Initialization']))
     return trace_breakdown
 
 def read_invalid_traces(execution) -> pd.DataFrame:
@@ -218,6 +258,42 @@ def read_invalid_traces(execution) -> pd.DataFrame:
     invalid_traces = pd.read_csv(invalid_traces_path)
     return invalid_traces
 
+def read_breakdown_sketches(execution):
+    """Returns the BreakdownSketches from breakdown_sketches.json (see sb analyze_traces).
+    Requires a Python environment with sb installed."""
+    from sb.breakdown_sketches import BreakdownSketches
+    return BreakdownSketches.load(execution / 'breakdown_sketches.json')
+
+def merge_breakdown_sketches(executions):
+    """Returns the merged BreakdownSketches of many executions.
+    Merging sketches avoids loading the trace breakdown of every execution."""
+    from sb.breakdown_sketches import BreakdownSketches
+    merged = BreakdownSketches()
+    for execution in executions:
+        if (execution / 'breakdown_sketches.json').is_file():
+            merged.merge(read_breakdown_sketches(execution))
+        else:
+            logging.warning(f"Skipping missing breakdown sketches {execution}")
+    return merged
+
+def sketch_percentiles(sketches, quantiles=[0.5, 0.99]) -> pd.DataFrame:
+    """Returns a dataframe with the count, mean, and percentile latencies (e.g., p50_latency)
+    per url, coldstart, and variable (i.e., duration or time category).
+    Percentiles are accurate within the relative accuracy of the sketches (1% by default)."""
+    rows = []
+    for (url, coldstart, variable), sketch in sketches.sketches.items():
+        row = {
+            'url': url,
+            'coldstart': coldstart,
+            'variable': variable,
+            'count': sketch.count,
+            'mean_latency': pd.Timedelta(microseconds=sketch.mean())
+        }
+        for q in quantiles:
+            row[f"p{round(q * 100)}_latency"] = pd.Timedelta(microseconds=sketch.quantile(q))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
 def remove_starting_zero_ips(df, ips_col) -> pd.DataFrame:
     """Remove 0 ips targets at the start because we assume that t=0 seconds matches with the first request"""
     if df is None:
@@ -621,6 +697,16 @@ def app_request_type_label(app, request_type) -> str:
     """Format a label based on the application name and request type."""
     return f"{app}\n({request_type})"
 
+def add_request_type(trace_breakdown, app, url_column='url_y') -> pd.DataFrame:
+    """Adds the request_type column (see request_type) to a trace breakdown merged with k6 invocations.
+    Classifies every unique combination of url, method, and path_id only once instead of every trace."""
+    key_columns = [url_column, 'method', 'path_id']
+    if 'request_type' in trace_breakdown.columns:
+        trace_breakdown = trace_breakdown.drop(columns=['request_type'])
+    unique_requests = trace_breakdown.drop_duplicates(subset=key_columns)[key_columns + ['longest_path_names']].copy()
+    unique_requests['request_type'] = unique_requests.apply(lambda row: request_type(app, row[url_column], row['method'], row['longest_path_names']), axis=1)
+    return pd.merge(trace_breakdown, unique_requests[key_columns + ['request_type']], on=key_columns, how='left')
+
 def request_type(app, url, method, longest_path_names):
     """Mapping method with heuristics to identify different request types for common sb apps.
     """
@@ -0,0 +1,30 @@
+import csv
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'scripts'))
+from sb_importer import add_longest_path_names, read_trace_breakdown_csv  # noqa: E402
+
+TIMEDELTA_COLUMNS = ['duration', 'orchestration', 'trigger', 'container_initialization',
+                     'runtime_initialization', 'computation', 'queing', 'overhead',
+                     'external_service', 'unclassified']
+# Path ids that look like an integer, a float overflowing to inf, and a regular hex digest
+PATHS = {
+    '0123456789012345': ['AWS::Lambda', 'Invocation'],
+    '1234e56789012345': ['AWS::ApiGateway::Stage', 'Lambda'],
+    '9f86d081884c7d65': ['AWS::Lambda', 'Overhead'],
+}
+
+
+def test_numeric_looking_path_ids(tmp_path):
+    with open(tmp_path / 'trace_breakdown.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['trace_id', *TIMEDELTA_COLUMNS, 'path_id'])
+        for i, path_id in enumerate(PATHS):
+            writer.writerow([f"1-{i}", *['0:00:00.001000'] * len(TIMEDELTA_COLUMNS), path_id])
+    paths = {path_id: {'names': names, 'num_traces': 1} for path_id, names in PATHS.items()}
+    (tmp_path / 'trace_paths.json').write_text(json.dumps({'version': 1, 'paths': paths}))
+    trace_breakdown = add_longest_path_names(tmp_path, read_trace_breakdown_csv(tmp_path))
+    assert trace_breakdown['path_id'].tolist() == list(PATHS)
+    assert trace_breakdown['longest_path_names'].tolist() == list(PATHS.values())
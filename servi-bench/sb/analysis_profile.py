@@ -0,0 +1,133 @@
+"""Per-stage profiling of the trace analyzers.
+
+Profiling is off by default. The StageProfiler temporarily replaces the module-level
+functions of an analyzer (e.g., loads, add_global_stats, longest_path) with timed wrappers
+while profiling is enabled. Hence, the analysis runs the unmodified functions without
+any overhead when profiling is disabled.
+Stage times are exclusive: the time of a stage excludes the time spent in nested stages
+(e.g., add_global_stats excludes longest_path). With multiple workers, the stage times
+are summed up across all workers and can therefore exceed the total wall time.
+"""
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+import json
+import sys
+import time
+import traceback
+
+PROFILE_FILE = 'analysis_profile.json'
+
+
+def exception_site(exception) -> str:
+    """Returns the file, line, and function where the exception was raised."""
+    frames = traceback.extract_tb(exception.__traceback__)
+    if not frames:
+        return 'unknown'
+    frame = frames[-1]
+    return f"{Path(frame.filename).name}:{frame.lineno} ({frame.name})"
+
+
+class TimedWriter:
+    """Times the writerow method of a writer (e.g., csv.writer) as stage 'writerow'."""
+
+    def __init__(self, profiler, writer) -> None:
+        self.writerow = profiler.timed('writerow', writer.writerow)
+
+
+class StageProfiler:
+    """Accumulates wall time and call counts per stage and
+    counts invalid traces by the site where their exception was raised."""
+
+    def __init__(self) -> None:
+        # Dictionary: stage name (str) => [calls (int), seconds (float)]
+        self.stages = dict()
+        # Dictionary: exception site (str) => number of invalid traces (int)
+        self.invalid_sites = Counter()
+        # Dictionary: exception site (str) => first exception message (str)
+        self.invalid_examples = dict()
+        # Stack with the accumulated time of nested stages for every active stage
+        self.stack = []
+
+    def timed(self, name, func):
+        """Returns a wrapper of func that accumulates its exclusive time as stage name."""
+        stage = self.stages.setdefault(name, [0, 0.0])
+        stack = self.stack
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = stack.pop()
+                stage[0] += 1
+                stage[1] += elapsed - nested
+                if stack:
+                    stack[-1] += elapsed
+        return wrapper
+
+    @contextmanager
+    def instrument(self, module_name, names):
+        """Replaces the given functions of a module with timed wrappers
+        and restores the original functions on exit."""
+        module = sys.modules[module_name]
+        originals = {name: getattr(module, name) for name in names}
+        try:
+            for name, func in originals.items():
+                setattr(module, name, self.timed(name, func))
+            yield self
+        finally:
+            for name, func in originals.items():
+                setattr(module, name, func)
+
+    def writer(self, writer) -> TimedWriter:
+        return TimedWriter(self, writer)
+
+    def count_invalid(self, exception):
+        site = exception_site(exception)
+        self.invalid_sites[site] += 1
+        self.invalid_examples.setdefault(site, str(exception))
+
+    def to_dict(self) -> dict:
+        return {
+            'stages': {name: {'calls': calls, 'seconds': seconds}
+                       for name, (calls, seconds) in self.stages.items()},
+            'invalid_sites': {site: {'count': count, 'example': self.invalid_examples[site]}
+                              for site, count in self.invalid_sites.most_common()}
+        }
+
+    def merge(self, profile):
+        """Adds the results of another profile (see to_dict), for example, from a worker."""
+        for name, stage in profile['stages'].items():
+            calls, seconds = self.stages.setdefault(name, [0, 0.0])
+            self.stages[name] = [calls + stage['calls'], seconds + stage['seconds']]
+        for site, invalid in profile['invalid_sites'].items():
+            self.invalid_sites[site] += invalid['count']
+            self.invalid_examples.setdefault(site, invalid['example'])
+
+    def save(self, profile_file, analyzer, total_seconds, num_valid_traces, num_invalid_traces):
+        """Writes the profile as JSON with stages sorted by descending time."""
+        profile = self.to_dict()
+        stages = sorted(profile['stages'].items(), key=lambda s: s[1]['seconds'], reverse=True)
+        for _, stage in stages:
+            stage['share'] = round(stage['seconds'] / total_seconds, 4) if total_seconds else 0
+        with open(profile_file, 'w') as f:
+            json.dump({
+                'analyzer': analyzer,
+                'total_seconds': total_seconds,
+                'num_valid_traces': num_valid_traces,
+                'num_invalid_traces': num_invalid_traces,
+                'stages': dict(stages),
+                'invalid_sites': profile['invalid_sites']
+            }, f, indent=2)
+
+
+def profiling(profiler, module_name, names):
+    """Instruments the functions of a module if the profiler is not None."""
+    if profiler is None:
+        return nullcontext()
+    return profiler.instrument(module_name, names)
@@ -1,10 +1,27 @@
 import logging
 import json
+import math
+import hashlib
+import os
 from pathlib import Path
 import csv
+import queue
+import shutil
+import threading
+import time
+from io import StringIO
+from tempfile import TemporaryDirectory
+from contextlib import nullcontext
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import networkx as nx
 from more_itertools import peekable
+from sb.span_tree import SpanTree
+from sb.analysis_profile import PROFILE_FILE, StageProfiler, profiling
+from sb.breakdown_sketches import SKETCHES_FILE, BreakdownSketches
+from sb.trace_paths import PATHS_FILE, TracePaths, path_signature
+from sb.trace_decoder import loads
 
 
 """
@@ -25,9 +42,44 @@ For example, 1-61bc3f1b-114c0cc33b4e39a3c3fb34ab from the realworld_app
 has a 3ms difference between the end time of AWS::Lambda and AWS::Lambda::Function.
 """
 # Allow for a small margin of clock inaccuracy
-TIMESTAMP_MARGIN = timedelta(microseconds=1_001)
+TIMESTAMP_MARGIN_US = 1_001
+TIMESTAMP_MARGIN = timedelta(microseconds=TIMESTAMP_MARGIN_US)
 # Throw exception if extreme time shifts occur in the latency breakdown extraction
 TIMESTAMP_THRESHOLD = timedelta(microseconds=10_000)
+# Increment whenever the analysis output changes to invalidate previous results
+ANALYZER_VERSION = 2
+# Records the analyzed input next to the outputs for incremental re-analysis
+MANIFEST_FILE = 'trace_breakdown_manifest.json'
+# Supported output formats for the trace breakdown
+OUTPUT_FORMATS = ['csv', 'parquet']
+# Detail levels of the trace analysis:
+# * summary: only the trace breakdown fields (see CSV_FIELDS)
+# * paths: additionally the longest path and critical path details in the graph attributes
+# * full: additionally saves the critical path of every trace into CRITICAL_PATHS_FILE
+DETAIL_LEVELS = ['summary', 'paths', 'full']
+CRITICAL_PATHS_FILE = 'critical_paths.jsonl'
+# Maximum number of unique trace topologies kept in the CriticalPathCache
+CRITICAL_PATH_CACHE_SIZE = 1024
+# Maximum number of trace batches buffered between the downloader and the analysis pipeline
+PIPELINE_QUEUE_SIZE = 64
+# Maximum number of traces per batch analyzed by the analysis pipeline
+TRACE_BATCH_SIZE = 200
+# Module-level functions timed as stages when profiling is enabled
+PROFILED_STAGES = [
+    'loads',
+    'create_span_graph',
+    'add_subsegments',
+    'add_global_stats',
+    'call_stack',
+    'longest_path',
+    'topology_key',
+    'calculate_breakdown',
+    'add_breakdown',
+    'add_categories',
+    'critical_path_record',
+    'add_to_sketches',
+    'trace_breakdown_row'
+]
 
 
 def t(epoch) -> datetime:
@@ -42,22 +94,56 @@ def timediff(start_time, end_time) -> timedelta:
     return t(end_time) - t(start_time)
 
 
-def create_span_graph(trace):
+"""Internal time representation in integer microseconds (µs).
+Durations within the analyzer are calculated and summed as integers
+and only converted to timedelta for the output (see extract_trace_breakdown).
+This avoids constructing datetime objects for every timestamp.
+"""
+
+
+def us(epoch) -> int:
+    """Converts an epoch timestamp in seconds into integer microseconds.
+    Uses the same rounding (i.e., round half to even of the fractional part)
+    as datetime.fromtimestamp such that us_diff matches timediff exactly."""
+    fraction, seconds = math.modf(epoch)
+    return int(seconds) * 1_000_000 + round(fraction * 1e6)
+
+
+def us_diff(start_time, end_time) -> int:
+    """Returns the time difference in integer microseconds."""
+    return us(end_time) - us(start_time)
+
+
+def td(microseconds) -> timedelta:
+    """Converts integer microseconds into a timedelta."""
+    return timedelta(microseconds=microseconds)
+
+
+def create_span_graph(trace, span_tree=False, critical_path=True):
     """Returns a Networkx graph representing a single trace where
     each node represents a span (or trace segment in XRay terminology) and
     each edge represents a casual relationship.
+    The span_tree flag uses the compact SpanTree instead of a Networkx graph,
+    which supports the same subset of graph operations used in this module.
+    Setting critical_path=False skips the longest path analysis
+    (e.g., if the CriticalPathCache replays it).
     """
     # Detect missing trace duration
     if 'Duration' not in trace:
         raise Exception('Missing trace duration.')
     # Parse double JSON-encoded XRay segments
     segments = parse_trace_segments(trace)
+    trace_duration = timedelta(seconds=trace['Duration'])
     graph_attr = {
         'trace_id': trace['Id'],
-        'duration': timedelta(seconds=trace['Duration']),
+        'duration': trace_duration,
+        'duration_us': trace_duration // timedelta(microseconds=1),
         'limit_exceeded': trace['LimitExceeded']
     }
-    G = nx.DiGraph(**graph_attr)
+    if span_tree:
+        G = SpanTree(**graph_attr)
+    else:
+        G = nx.DiGraph(**graph_attr)
     for segment in segments:
         # Optionally skip inferred segments because they are duplicates of their parents
         # if 'inferred' in segment and segment['inferred']:
@@ -67,7 +153,7 @@ def create_span_graph(trace):
             raise Exception(f"Segment {segment['id']} in progress.")
         node_attr = {
             'doc': segment,
-            'duration': duration(segment)
+            'duration': duration_us(segment)
         }
         G.add_node(segment['id'], **node_attr)
         if 'parent_id' in segment:
@@ -77,9 +163,10 @@ def create_span_graph(trace):
         else:
             # Special case of missing root: the segment with the root might be missing.
             G.graph['start'] = segment['id']
-        add_subsegments_recursive(G, segment)
+        add_subsegments(G, segment)
 
-    add_global_stats(G)
+    add_global_stats(G, critical_path)
+    add_categories(G)
     return G
 
 
@@ -88,7 +175,7 @@ def parse_trace_segments(trace) -> list:
 
 
 def parse_segment_json(segment_wrapper):
-    return json.loads(segment_wrapper['Document'])
+    return loads(segment_wrapper['Document'])
 
 
 def invocation_type(parent_doc, child_doc) -> str:
@@ -120,20 +207,31 @@ def is_async_call(parent_doc, child_doc) -> bool:
     return parent_doc['end_time'] - child_doc['end_time'] + TIMESTAMP_MARGIN.total_seconds() < 0
 
 
-def add_subsegments_recursive(G, segment):
-    if 'subsegments' in segment:
-        for subsegment in segment['subsegments']:
-            # Trace is not completed and hence some end_time is missing
-            if subsegment.get('in_progress', False):
-                raise Exception(f"Subsegment {subsegment['id']} in progress.")
-            attr = {
-                'doc': subsegment,
-                'duration': duration(subsegment),
-                'subsegment': True
-            }
-            G.add_node(subsegment['id'], **attr)
-            G.add_edge(segment['id'], subsegment['id'])
-            add_subsegments_recursive(G, subsegment)
+def add_subsegments(G, segment):
+    """Adds all nested subsegments of a segment in depth-first pre-order.
+    Uses an explicit stack of subsegment iterators instead of recursion
+    to support arbitrarily deep nesting."""
+    if 'subsegments' not in segment:
+        return G
+    stack = [(segment['id'], iter(segment['subsegments']))]
+    while stack:
+        parent_id, subsegments = stack[-1]
+        subsegment = next(subsegments, None)
+        if subsegment is None:
+            stack.pop()
+            continue
+        # Trace is not completed and hence some end_time is missing
+        if subsegment.get('in_progress', False):
+            raise Exception(f"Subsegment {subsegment['id']} in progress.")
+        attr = {
+            'doc': subsegment,
+            'duration': duration_us(subsegment),
+            'subsegment': True
+        }
+        G.add_node(subsegment['id'], **attr)
+        G.add_edge(parent_id, subsegment['id'])
+        if 'subsegments' in subsegment:
+            stack.append((subsegment['id'], iter(subsegment['subsegments'])))
     return G
 
 
@@ -141,9 +239,14 @@ def duration(segment):
     return timediff(segment['start_time'], segment['end_time'])
 
 
-def add_global_stats(G):
+def duration_us(segment) -> int:
+    return us_diff(segment['start_time'], segment['end_time'])
+
+
+def add_global_stats(G, critical_path=True):
     """Enriches the span graph of a trace with additional metrics
-    that can be accessed via G.graph[METRIC_NAME]."""
+    that can be accessed via G.graph[METRIC_NAME].
+    Setting critical_path=False skips the call stack and longest path."""
     # id of earliest time (i.e., start of trace)
     start = None
     start_time = None
@@ -218,10 +321,10 @@ def add_global_stats(G):
         )
         raise Exception(msg)
     # Validate trace duration against calculated trace duration but allowing for small margin
-    if abs(G.graph['duration'] - timediff(start_time, end_time)) > TIMESTAMP_MARGIN:
+    if abs(G.graph['duration_us'] - us_diff(start_time, end_time)) > TIMESTAMP_MARGIN_US:
         msg = (
             f"Trace duration {G.graph['duration']}"
-            f" does not match the calculated trace duration {timediff(start_time, end_time)}"
+            f" does not match the calculated trace duration {td(us_diff(start_time, end_time))}"
             ' based on start and end times.'
             ' Ensure that the trace is fully connected and there are no clock issues.'
         )
@@ -235,22 +338,31 @@ def add_global_stats(G):
     G.graph['throttles'] = len(throttles)
 
     # Critical path
-    G.graph['call_stack'] = call_stack(G, end)
-    G.graph['longest_path'] = longest_path(G, start)
+    if critical_path:
+        add_longest_path(G)
+    return G
+
+
+def add_longest_path(G):
+    """Adds the asynchronous call stack and the longest path from the start node."""
+    G.graph['call_stack'] = call_stack(G, G.graph['end'])
+    G.graph['longest_path'] = longest_path(G, G.graph['start'])
     return G
 
 
 def call_stack(G, end):
     """Returns an asynchronous call stack without the root"""
     stack = []
+    visited = set()
     node = end
     while node:
-        if node in stack:
+        if node in visited:
             loop_start_index = stack.index(node)
             loop = stack[loop_start_index:]
             logging.debug(f"Infinite loop: {loop}")
             raise Exception(f"Detected infinite loop starting from node {node}")
         stack.append(node)
+        visited.add(node)
         node = next(G.predecessors(node), None)
     # Could indicate missing connection
     # assert node == G.graph['start']
@@ -270,39 +382,59 @@ def longest_path(G, node):
     https://gitlab.engr.illinois.edu/DEPEND/firm/-/blob/master/metrics/analysis/cpa-training-features.py#L111
     Their actual implementation uses a while loop instead of recursion and
     assumes ordered child_nodes.
+
+    This implementation replaces the recursion with an explicit stack of frames
+    [node, sorted_children, next_child_index] to support arbitrarily deep traces.
+    Every recursive call corresponds to descending into a child and the path of a
+    recursive call is always a suffix of the overall path. Hence, `path[-1]` is
+    identical to the last element of the path within the recursive call.
     """
+    call_stack = G.graph['call_stack']
+    max_depth = len(G.nodes)
     path = []
-    path.append(node)
-    if G.out_degree(node) == 0:
-        return path
-    # Remove node from call stack if present
-    if len(G.graph['call_stack']) > 0 and G.graph['call_stack'][-1] == node:
-        G.graph['call_stack'].pop()
-    sorted_children = get_sorted_children(G, node)
-    last_returning_child = sorted_children[-1]
-    for child in sorted_children:
-        if happens_before(G, child, last_returning_child):
-            last_doc = G.nodes[path[-1]]['doc']
-            parent_doc = G.nodes[node]['doc']
-            # Only recurse into synchronous calls if there is not already
-            # a longer asynchronous call present
-            if last_doc['end_time'] <= parent_doc['end_time']:
-                path.extend(longest_path(G, child))
-    # Conditionally recurse into last_returning_child
-    parent_doc = G.nodes[node]['doc']
-    child_doc = G.nodes[last_returning_child]['doc']
-    if is_async_call(parent_doc, child_doc):
-        # Check against call stack for asynchronous calls by only following calls that are
-        # connected to the end node with the latest timestamp
-        if len(G.graph['call_stack']) > 0 and G.graph['call_stack'][-1] == last_returning_child:
-            path.extend(longest_path(G, last_returning_child))
-    else:
-        # Only recurse into synchronous calls if there is not already
-        # a longer asynchronous call present
-        last_doc = G.nodes[path[-1]]['doc']
-        if last_doc['end_time'] <= parent_doc['end_time']:
-            path.extend(longest_path(G, last_returning_child))
-
+    frames = []
+    while node is not None:
+        # Enter node (i.e., start of a recursive call)
+        path.append(node)
+        if G.out_degree(node) > 0:
+            # Remove node from call stack if present
+            if len(call_stack) > 0 and call_stack[-1] == node:
+                call_stack.pop()
+            frames.append([node, get_sorted_children(G, node), 0])
+            if len(frames) > max_depth:
+                raise Exception(f"Detected infinite loop starting from node {node}")
+        # Find the next child to descend into or return from completed frames
+        node = None
+        while frames and node is None:
+            frame = frames[-1]
+            parent, sorted_children, index = frame
+            frame[2] += 1
+            parent_doc = G.nodes[parent]['doc']
+            last_returning_child = sorted_children[-1]
+            if index < len(sorted_children):
+                child = sorted_children[index]
+                if happens_before(G, child, last_returning_child):
+                    last_doc = G.nodes[path[-1]]['doc']
+                    # Only recurse into synchronous calls if there is not already
+                    # a longer asynchronous call present
+                    if last_doc['end_time'] <= parent_doc['end_time']:
+                        node = child
+            elif index == len(sorted_children):
+                # Conditionally recurse into last_returning_child
+                child_doc = G.nodes[last_returning_child]['doc']
+                if is_async_call(parent_doc, child_doc):
+                    # Check against call stack for asynchronous calls by only following calls
+                    # that are connected to the end node with the latest timestamp
+                    if len(call_stack) > 0 and call_stack[-1] == last_returning_child:
+                        node = last_returning_child
+                else:
+                    # Only recurse into synchronous calls if there is not already
+                    # a longer asynchronous call present
+                    last_doc = G.nodes[path[-1]]['doc']
+                    if last_doc['end_time'] <= parent_doc['end_time']:
+                        node = last_returning_child
+            else:
+                frames.pop()
     return path
 
 
@@ -314,6 +446,8 @@ def get_sorted_children(G, node):
     but one happens earlier indicated by an earlier start_time.
     Example timeline: start1<end1=start2=end2
     """
+    if isinstance(G, SpanTree):
+        return G.sorted_children(node)
     succ_ids = G.successors(node)
     sorted_ids = sorted(succ_ids, key=lambda id: (G.nodes[id]['doc']['end_time'], G.nodes[id]['doc']['start_time']))  # noqa: E501
     return sorted_ids
@@ -326,7 +460,11 @@ def happens_before(G, first, second):
     return first_doc['end_time'] <= second_doc['start_time']
 
 
-def calculate_breakdown(G):
+def calculate_breakdown(G, detail='paths'):
+    """Calculates the latency breakdown along the critical path of the span graph G.
+    The detail level 'summary' only calculates the trace breakdown fields (see CSV_FIELDS)
+    whereas 'paths' and 'full' additionally add the longest path details and
+    human-readable critical path details to the graph attributes."""
     # Initialize cold start counter along critical path, updated along the way
     G.graph['num_cold_starts'] = 0
     longest_path = G.graph['longest_path']
@@ -344,10 +482,10 @@ def calculate_breakdown(G):
             critical_path.append({
                 'start_time': doc['start_time'],
                 'end_time': doc['end_time'],
-                'duration': timediff(doc['start_time'], doc['end_time']),
+                'duration': us_diff(doc['start_time'], doc['end_time']),
                 'resource': doc['id'],
                 'type': 'span',
-                'category': category_for_doc(G, doc)
+                'category': node_category(G, doc)
             })
             # potential sync transition back to parent
             critical_path.extend(add_sync_return(G, doc))
@@ -367,44 +505,35 @@ def calculate_breakdown(G):
             #     #        if exists ?! or from parent
             #             'category': 'sync-back'  # parent_doc['origin']
             #         })
+    return add_breakdown(G, critical_path, detail)
+
 
+def add_breakdown(G, critical_path, detail='paths'):
+    """Sums up the time categories along the critical path of the span graph G
+    and validates the critical path against the trace duration."""
+    longest_path = G.graph['longest_path']
     # Identify unique paths
     # NOTE: currently treats cold-start as a different path.
     # We might need some heuristic to identify services (alike in the XRay service map)
-    G.graph['longest_path_arns'] = []
-    G.graph['longest_path_names'] = []
-    G.graph['longest_path_details'] = []
-    for n in longest_path:
-        doc = G.nodes[n]['doc']
-        G.graph['longest_path_details'].append(
-            {'id': doc['id'],
-             'name': doc['name'],
-             'start_time': doc['start_time'],
-             'end_time': doc['end_time'],
-             'origin': doc.get('origin', None),
-             'invocation_type': G.nodes[n].get('invocation_type', None)}
-        )
-        G.graph['longest_path_names'].append(doc['name'])
-        if 'resource_arn' in doc:
-            G.graph['longest_path_arns'].append(doc['resource_arn'])
-        else:
-            pass
+    G.graph['longest_path_names'] = [G.nodes[n]['doc']['name'] for n in longest_path]
+    G.graph['path_id'] = path_signature(tuple(G.graph['longest_path_names']))
+    if detail != 'summary':
+        add_longest_path_details(G)
     # List critical path:
-    critical_path_details = []
-    curr_duration = timedelta()
+    curr_duration = 0
     start = G.graph['start_time']
-    G.graph['unclassified'] = timedelta()
+    G.graph['unclassified'] = 0
     for e in critical_path:
         if e['category'] in G.graph:
             G.graph[e['category']] += e['duration']
         else:
             G.graph[e['category']] = e['duration']
-        critical_path_details.append(f"{e['duration']} {e['type']}:{e['category']} \t{e['resource']}:{G.nodes[e['resource']]['doc']['name'] if e['resource'] else ''} \t{e.get('source', '')}=>{e.get('target', '')}")  # noqa: E501
         # Validation
         curr_duration += e['duration']
-        assert curr_duration == timediff(start, e['end_time']), f"Summed duration {curr_duration} does not match difference to trace start_time."  # noqa: E501
+        assert curr_duration == us_diff(start, e['end_time']), f"Summed duration {td(curr_duration)} does not match difference to trace start_time."  # noqa: E501
     G.graph['critical_path'] = critical_path
-    G.graph['critical_path_details'] = critical_path_details
+    if detail != 'summary':
+        G.graph['critical_path_details'] = critical_path_details(G)
     # Checks
     cp_last_target = G.graph['critical_path'][-1]['target']
     # Raise exception if the segment with the latest end time does not match the last target
@@ -425,7 +554,7 @@ def calculate_breakdown(G):
     if cp_last_target != G.graph['end'] and cp_last_target != G.graph['start'] and G.nodes[cp_last_target]['doc']['end_time'] != G.graph['end_time']:  # noqa: E501
         msg = f"Segment with latest end time ({G.graph['end']}) does not match last target ({cp_last_target}) of critical path."  # noqa: E501
         raise Exception(msg)
-    assert abs(G.graph['duration'] - curr_duration) < TIMESTAMP_MARGIN, f"Trace duration {G.graph['duration']} does not match latency breakdown {curr_duration} within margin {TIMESTAMP_MARGIN}."  # noqa: E501
+    assert abs(G.graph['duration_us'] - curr_duration) < TIMESTAMP_MARGIN_US, f"Trace duration {G.graph['duration']} does not match latency breakdown {td(curr_duration)} within margin {TIMESTAMP_MARGIN}."  # noqa: E501
     # NOTE: Possible false positive if custom instrumentation uses the name 'Initialization'
     # Checking the origin for AWS::Lambda::Function and only looking at the first subsegment
     # could make this more robust if needed
@@ -435,24 +564,65 @@ def calculate_breakdown(G):
     return G
 
 
+def add_longest_path_details(G):
+    """Adds the details and resource ARNs of all spans along the longest path."""
+    G.graph['longest_path_arns'] = []
+    G.graph['longest_path_details'] = []
+    for n in G.graph['longest_path']:
+        doc = G.nodes[n]['doc']
+        G.graph['longest_path_details'].append(
+            {'id': doc['id'],
+             'name': doc['name'],
+             'start_time': doc['start_time'],
+             'end_time': doc['end_time'],
+             'origin': doc.get('origin', None),
+             'invocation_type': G.nodes[n].get('invocation_type', None)}
+        )
+        if 'resource_arn' in doc:
+            G.graph['longest_path_arns'].append(doc['resource_arn'])
+
+
+def critical_path_details(G) -> list:
+    """Returns a human-readable line for every element of the critical path."""
+    return [f"{td(e['duration'])} {e['type']}:{e['category']} \t{e['resource']}:{G.nodes[e['resource']]['doc']['name'] if e['resource'] else ''} \t{e.get('source', '')}=>{e.get('target', '')}"  # noqa: E501
+            for e in G.graph['critical_path']]
+
+
+def critical_path_record(G) -> dict:
+    """Returns the longest path and critical path of a trace for drill-down analysis.
+    Durations of critical path elements are in integer microseconds."""
+    return {
+        'trace_id': G.graph['trace_id'],
+        'longest_path': G.graph['longest_path_details'],
+        'critical_path': G.graph['critical_path']
+    }
+
+
 def add_sync_return(G, doc):
+    """Returns the critical path of synchronously returning calls
+    by following the parents of the given doc until an asynchronous call."""
     critical_path = []
+    max_steps = len(G.nodes)
     parent_doc_id = next(G.predecessors(doc['id']), None)
-    if parent_doc_id is not None:
+    while parent_doc_id is not None:
         parent_doc = G.nodes[parent_doc_id]['doc']
         child = G.nodes[doc['id']]
-        if child['invocation_type'] == 'sync':
-            critical_path.append({
-                'start_time': doc['end_time'],
-                'end_time': parent_doc['end_time'],
-                'duration': timediff(doc['end_time'], parent_doc['end_time']),
-                'resource': parent_doc['id'],
-                'source': doc['id'],
-                'target': parent_doc['id'],
-                'type': 'sync-receive',
-                'category': category_for_doc(G, parent_doc)
-            })
-            critical_path.extend(add_sync_return(G, parent_doc))
+        if child['invocation_type'] != 'sync':
+            break
+        critical_path.append({
+            'start_time': doc['end_time'],
+            'end_time': parent_doc['end_time'],
+            'duration': us_diff(doc['end_time'], parent_doc['end_time']),
+            'resource': parent_doc['id'],
+            'source': doc['id'],
+            'target': parent_doc['id'],
+            'type': 'sync-receive',
+            'category': node_category(G, parent_doc)
+        })
+        if len(critical_path) > max_steps:
+            raise Exception(f"Detected infinite loop starting from node {doc['id']}")
+        doc = parent_doc
+        parent_doc_id = next(G.predecessors(doc['id']), None)
     return critical_path
 
 
@@ -474,7 +644,7 @@ def pair_path(G, peek_iter, node, next_node):
         critical_path.append({
             'start_time': doc['start_time'],
             'end_time': init_doc['start_time'],
-            'duration': timediff(doc['start_time'], init_doc['start_time']),
+            'duration': us_diff(doc['start_time'], init_doc['start_time']),
             'resource': doc['id'],
             'type': 'span-parent',
             'category': 'container_initialization'
@@ -483,7 +653,7 @@ def pair_path(G, peek_iter, node, next_node):
         critical_path.append({
             'start_time': init_doc['start_time'],
             'end_time': init_doc['end_time'],
-            'duration': timediff(init_doc['start_time'], init_doc['end_time']),
+            'duration': us_diff(init_doc['start_time'], init_doc['end_time']),
             'resource': init_doc['id'],
             'type': 'span',
             'category': 'runtime_initialization'
@@ -492,12 +662,12 @@ def pair_path(G, peek_iter, node, next_node):
         critical_path.append({
             'start_time': init_doc['end_time'],
             'end_time': next_doc['start_time'],
-            'duration': timediff(init_doc['end_time'], next_doc['start_time']),
+            'duration': us_diff(init_doc['end_time'], next_doc['start_time']),
             'resource': doc['id'],
             'source': init_doc['id'],
             'target': next_doc['id'],
             'type': 'span-parent',
-            'category': category_for_doc(G, doc)
+            'category': node_category(G, doc)
         })
         # skip two next spans being handled here as special case
         _ = next(peek_iter)  # function_id
@@ -513,10 +683,10 @@ def pair_path(G, peek_iter, node, next_node):
             critical_path.append({
                 'start_time': next_doc['start_time'],
                 'end_time': next_doc['end_time'],
-                'duration': timediff(next_doc['start_time'], next_doc['end_time']),
+                'duration': us_diff(next_doc['start_time'], next_doc['end_time']),
                 'resource': next_doc['id'],
                 'type': 'span',
-                'category': category_for_doc(G, next_doc)
+                'category': node_category(G, next_doc)
             })
             # b) time-based (alternative): current span end time <= end time of trace
             current_doc = next_doc
@@ -528,12 +698,12 @@ def pair_path(G, peek_iter, node, next_node):
                 critical_path.append({
                     'start_time': current_doc['end_time'],
                     'end_time': parent_doc['end_time'],
-                    'duration': timediff(current_doc['end_time'], parent_doc['end_time']),
+                    'duration': us_diff(current_doc['end_time'], parent_doc['end_time']),
                     'resource': parent_doc['id'],
                     'source': current_doc['id'],
                     'target': parent_doc['id'],
                     'type': 'sync-receive',
-                    'category': category_for_doc(G, parent_doc)
+                    'category': node_category(G, parent_doc)
                 })
                 current_doc = parent_doc
                 # Follow predecessor of current_doc (i.e., parent)
@@ -552,10 +722,10 @@ def pair_path(G, peek_iter, node, next_node):
         critical_path.append({
             'start_time': latest_start,
             'end_time': early_end,
-            'duration': timediff(latest_start, early_end),
+            'duration': us_diff(latest_start, early_end),
             'resource': doc['id'],
             'type': 'span',
-            'category': category_for_doc(G, doc)
+            'category': node_category(G, doc)
         })
 
         # Invalidate trace if detecting extreme time shifts,
@@ -569,7 +739,7 @@ def pair_path(G, peek_iter, node, next_node):
         critical_path.append({
             'start_time': early_end,
             'end_time': next_doc['start_time'],
-            'duration': timediff(early_end, next_doc['start_time']),
+            'duration': us_diff(early_end, next_doc['start_time']),
             'resource': None,
             'source': doc['id'],
             'target': next_doc['id'],
@@ -583,22 +753,22 @@ def pair_path(G, peek_iter, node, next_node):
             critical_path.append({
                 'start_time': doc['start_time'],
                 'end_time': next_doc['start_time'],
-                'duration': timediff(doc['start_time'], next_doc['start_time']),
+                'duration': us_diff(doc['start_time'], next_doc['start_time']),
                 'resource': doc['id'],
                 'source': doc['id'],
                 'target': next_doc['id'],
                 'type': 'sync-send',
-                'category': category_for_doc(G, doc)
+                'category': node_category(G, doc)
             })
         else:
             # span itself
             critical_path.append({
                 'start_time': doc['start_time'],
                 'end_time': doc['end_time'],
-                'duration': timediff(doc['start_time'], doc['end_time']),
+                'duration': us_diff(doc['start_time'], doc['end_time']),
                 'resource': doc['id'],
                 'type': 'span',
-                'category': category_for_doc(G, doc)
+                'category': node_category(G, doc)
             })
             # Returning synchronous call
             # critical_path.extend(add_sync_return(G, doc))
@@ -630,12 +800,12 @@ def pair_path(G, peek_iter, node, next_node):
                 critical_path.append({
                     'start_time': current_doc['end_time'],
                     'end_time': parent_doc['end_time'],
-                    'duration': timediff(current_doc['end_time'], parent_doc['end_time']),
+                    'duration': us_diff(current_doc['end_time'], parent_doc['end_time']),
                     'resource': parent_doc['id'],
                     'source': current_doc['id'],
                     'target': parent_doc['id'],
                     'type': 'sync-receive',
-                    'category': category_for_doc(G, parent_doc)
+                    'category': node_category(G, parent_doc)
                 })
                 current_doc = parent_doc
                 # Follow predecessor of current_doc (i.e., parent)
@@ -648,12 +818,12 @@ def pair_path(G, peek_iter, node, next_node):
             critical_path.append({
                 'start_time': current_doc['end_time'],
                 'end_time': next_doc['start_time'],
-                'duration': timediff(current_doc['end_time'], next_doc['start_time']),
+                'duration': us_diff(current_doc['end_time'], next_doc['start_time']),
                 'resource': parent_id,
                 'source': current_doc['id'],
                 'target': next_doc['id'],
                 'type': 'span-parent',
-                'category': category_for_doc(G, parent_doc)
+                'category': node_category(G, parent_doc)
             })
 
     return critical_path
@@ -684,55 +854,131 @@ def init_lambda_segment(G, lambda_function_doc):
     return next(init_subsegments, None)
 
 
-def category_for_doc(G, doc) -> str:
+def add_categories(G):
+    """Assigns the time category of every node reachable from the start node
+    in a single top-down pass as node attribute 'category'.
+    A node inherits the category of its parent unless it has an origin or
+    is a special Lambda subsegment (see child_category), which is equivalent to
+    walking up the parents in category_for_doc for every node.
+    Nodes whose category cannot be determined (e.g., no origin up to the root)
+    get the category None and fall back to category_for_doc in node_category."""
+    start = G.graph['start']
+    start_doc = G.nodes[start]['doc']
+    G.nodes[start]['category'] = CATEGORY_MAPPINGS.get(start_doc['origin'], 'unclassified') \
+        if 'origin' in start_doc else None
+    # Iterative depth-first traversal supports arbitrarily deep traces
+    stack = [start]
+    visited = {start}
+    while stack:
+        parent = stack.pop()
+        parent_attr = G.nodes[parent]
+        parent_doc = parent_attr['doc']
+        for child in G.successors(parent):
+            # Follow only the first parent of a child like category_for_doc
+            if child in visited or next(G.predecessors(child)) != parent:
+                continue
+            visited.add(child)
+            child_attr = G.nodes[child]
+            child_attr['category'] = child_category(child_attr['doc'], parent_doc,
+                                                    parent_attr['category'])
+            stack.append(child)
+
+
+def child_category(doc, parent_doc, parent_category) -> str:
+    """Returns the time category of a doc given its parent doc and the category of its parent."""
     if 'origin' in doc:
-        return category_for_origin(doc['origin'])
+        return CATEGORY_MAPPINGS.get(doc['origin'], 'unclassified')
+    parent_origin = parent_doc.get('origin')
+    # special Lambda cases
+    if parent_origin == 'AWS::Lambda::Function':
+        return LAMBDA_MAPPINGS.get(doc['name'], 'unclassified')
+    if parent_origin == 'AWS::Lambda' and doc['name'] == 'Dwell Time':
+        return 'queing'
+    return parent_category
 
-    parent_id = next(G.predecessors(doc['id']))
-    parent_doc = G.nodes[parent_id]['doc']
 
-    # special case for AWS::Lambda::Function
-    # special Lambda cases
-    if 'origin' in parent_doc:
-        if parent_doc['origin'] == 'AWS::Lambda::Function':
-            lambda_mappings = {
-                'Overhead': 'overhead',
-                'Invocation': 'computation',
-                'Initialization': 'runtime_initialization',
-                # AWS::Lambda
-                'Dwell Time': 'queing'
-            }
-            return lambda_mappings.get(doc['name'], 'unclassified')
-        if parent_doc['origin'] == 'AWS::Lambda' and doc['name'] == 'Dwell Time':
-            return 'queing'
-
-    # Use origin mapping of parent assuming that every valid trace segment has an origin field.
-    return category_for_doc(G, parent_doc)
+def node_category(G, doc) -> str:
+    """Returns the time category of a doc assigned by add_categories
+    or otherwise determined by category_for_doc."""
+    category = G.nodes[doc['id']].get('category')
+    if category is None:
+        return category_for_doc(G, doc)
+    return category
+
+
+def category_for_doc(G, doc) -> str:
+    """Returns the time category of a doc based on its origin or
+    by walking up its parents until a doc with an origin is found."""
+    max_steps = len(G.nodes)
+    for _ in range(max_steps):
+        if 'origin' in doc:
+            return category_for_origin(doc['origin'])
+
+        parent_id = next(G.predecessors(doc['id']))
+        parent_doc = G.nodes[parent_id]['doc']
+
+        # special case for AWS::Lambda::Function
+        # special Lambda cases
+        if 'origin' in parent_doc:
+            if parent_doc['origin'] == 'AWS::Lambda::Function':
+                return LAMBDA_MAPPINGS.get(doc['name'], 'unclassified')
+            if parent_doc['origin'] == 'AWS::Lambda' and doc['name'] == 'Dwell Time':
+                return 'queing'
+
+        # Use origin mapping of parent assuming that every valid trace segment has an origin field.
+        doc = parent_doc
+    raise Exception(f"Detected infinite loop starting from node {doc['id']}")
+
+
+# Time categories of subsegments of AWS::Lambda::Function segments
+LAMBDA_MAPPINGS = {
+    'Overhead': 'overhead',
+    'Invocation': 'computation',
+    'Initialization': 'runtime_initialization',
+    # AWS::Lambda
+    'Dwell Time': 'queing'
+}
+
+
+# List of AWS resource types:
+# https://docs.aws.amazon.com/config/latest/developerguide/resource-config-reference.html
+CATEGORY_MAPPINGS = {
+    # Triggers
+    'AWS::ApiGateway::Stage': 'orchestration',
+    'AWS::StepFunctions::StateMachine': 'orchestration',
+    'AWS::stepfunctions': 'orchestration',
+    'AWS::STEPFUNCTIONS': 'orchestration',
+    # AWS Lambda
+    'AWS::Lambda': 'orchestration',
+    'AWS::Lambda::Function': 'computation',
+    # External services
+    'AWS::S3::Bucket': 'external_service',
+    'AWS::S3': 'external_service',
+    'AWS::DynamoDB::Table': 'external_service',
+    'AWS::SQS::Queue': 'external_service',
+    'AWS::SNS': 'external_service',
+    'Database::SQL': 'external_service',
+    'AWS::Kinesis': 'external_service',
+    'AWS::rekognition': 'external_service'
+}
 
 
 def category_for_origin(origin) -> str:
-    # List of AWS resource types:
-    # https://docs.aws.amazon.com/config/latest/developerguide/resource-config-reference.html
-    category_mappings = {
-        # Triggers
-        'AWS::ApiGateway::Stage': 'orchestration',
-        'AWS::StepFunctions::StateMachine': 'orchestration',
-        'AWS::stepfunctions': 'orchestration',
-        'AWS::STEPFUNCTIONS': 'orchestration',
-        # AWS Lambda
-        'AWS::Lambda': 'orchestration',
-        'AWS::Lambda::Function': 'computation',
-        # External services
-        'AWS::S3::Bucket': 'external_service',
-        'AWS::S3': 'external_service',
-        'AWS::DynamoDB::Table': 'external_service',
-        'AWS::SQS::Queue': 'external_service',
-        'AWS::SNS': 'external_service',
-        'Database::SQL': 'external_service',
-        'AWS::Kinesis': 'external_service',
-        'AWS::rekognition': 'external_service'
-    }
-    return category_mappings.get(origin, 'unclassified')
+    return CATEGORY_MAPPINGS.get(origin, 'unclassified')
+
+
+# Time categories of the latency breakdown summed in integer microseconds
+TIME_CATEGORIES = [
+    'orchestration',
+    'trigger',
+    'container_initialization',
+    'runtime_initialization',
+    'computation',
+    'queing',
+    'overhead',
+    'external_service',
+    'unclassified'
+]
 
 
 CSV_FIELDS = [
@@ -748,66 +994,846 @@ CSV_FIELDS = [
     'services',
     'longest_path_names',
     # categories:
-    'orchestration',
-    'trigger',
-    'container_initialization',
-    'runtime_initialization',
-    'computation',
-    'queing',
-    'overhead',
-    'external_service',
-    'unclassified'
+    *TIME_CATEGORIES
 ]
+# Fields of the trace breakdown output files where the path_id refers to
+# the span names of the longest path in the path dictionary (see sb.trace_paths)
+BREAKDOWN_FIELDS = ['path_id' if field == 'longest_path_names' else field
+                    for field in CSV_FIELDS]
+
+
+def span_arrays(G):
+    """Returns a tuple (ids, attrs, parents, sibling_ranks) of lists indexed in node order
+    where parents contains the index of the parent (-1 for roots) and sibling_ranks
+    the position of a node among the successors of its parent.
+    Returns None if any node has multiple parents."""
+    if isinstance(G, SpanTree):
+        ids, attrs, parents = G.ids, G.attrs, G.parent
+        sibling_ranks = [0] * len(ids)
+        num_edges = 0
+        for children in G.children:
+            num_edges += len(children)
+            for rank, c in enumerate(children):
+                sibling_ranks[c] = rank
+        if num_edges != len(ids) - parents.count(-1):
+            return None
+        return ids, attrs, parents, sibling_ranks
+    ids = list(G.nodes)
+    attrs = [G.nodes[id] for id in ids]
+    index = {id: i for i, id in enumerate(ids)}
+    parents = [-1] * len(ids)
+    sibling_ranks = [0] * len(ids)
+    for i, id in enumerate(ids):
+        for rank, child in enumerate(G.successors(id)):
+            c = index[child]
+            if parents[c] != -1:
+                return None
+            parents[c] = i
+            sibling_ranks[c] = rank
+    return ids, attrs, parents, sibling_ranks
+
+
+def topology_key(G):
+    """Returns a tuple (key, ids, timestamps) where the key is a canonical signature
+    of the topology and timestamp order of the span graph G or None if G has
+    nodes with multiple parents. The key consists of a tuple per node in canonical order
+    (i.e., by start_time, end_time, and position among its siblings) with the name,
+    origin, parent position, invocation type, and ranks of the start and end time
+    within all timestamps of the trace, followed by the positions of the start and end node.
+    The ids list the node ids in canonical order and the timestamps list the
+    start and end time of every node in canonical order (i.e., start of node p at 2p
+    and end of node p at 2p+1)."""
+    arrays = span_arrays(G)
+    if arrays is None:
+        return None
+    ids, attrs, parents, sibling_ranks = arrays
+    docs = [attr['doc'] for attr in attrs]
+    start_times = [doc['start_time'] for doc in docs]
+    end_times = [doc['end_time'] for doc in docs]
+    # The sibling rank keeps the order of children with identical timestamps
+    # consistent with the stable sort in get_sorted_children
+    order = [i for *_, i in sorted(zip(start_times, end_times, sibling_ranks, range(len(ids))))]
+    positions = [0] * (len(ids) + 1)
+    # Roots have the parent index -1 and hence the parent position -1
+    positions[-1] = -1
+    for position, i in enumerate(order):
+        positions[i] = position
+    time_ranks = {t: rank for rank, t in enumerate(sorted({*start_times, *end_times}))}
+    nodes = []
+    timestamps = []
+    for i in order:
+        doc = docs[i]
+        start_time = start_times[i]
+        end_time = end_times[i]
+        nodes.append((doc.get('name'), 'origin' in doc, doc.get('origin'),
+                      positions[parents[i]], attrs[i].get('invocation_type'),
+                      time_ranks[start_time], time_ranks[end_time]))
+        timestamps.append(start_time)
+        timestamps.append(end_time)
+    ordered_ids = [ids[i] for i in order]
+    start = ordered_ids.index(G.graph['start'])
+    end = ordered_ids.index(G.graph['end'])
+    return (tuple(nodes), start, end), ordered_ids, timestamps
+
+
+class CriticalPathCache:
+    """LRU cache of critical paths keyed by the topology_key of a trace.
+    Many traces of the same app share the same topology and order of timestamps.
+    Because every decision of longest_path and pair_path only depends on the topology,
+    the invocation types, and comparisons between timestamps, traces with the same
+    topology_key yield the same longest path and critical path structure.
+    On a hit, the cache replays the cached critical path with the timestamps of
+    the new trace and only recalculates the durations and validations (see add_breakdown).
+    Traces with any different timestamp order (even between unrelated spans) miss
+    the cache and fall back to the full analysis, which is conservative but exact.
+    The cached critical path refers to nodes by their canonical position and
+    to timestamps by their index in the timestamps of topology_key.
+    Computing the topology_key only pays off if enough traces hit the cache.
+    Hence, the cache disables itself if the hit rate after the first warmup traces
+    is below min_hit_rate (e.g., for apps with many concurrent spans).
+    """
+
+    def __init__(self, maxsize=CRITICAL_PATH_CACHE_SIZE, min_hit_rate=0.4, warmup=1000) -> None:
+        self.maxsize = maxsize
+        self.min_hit_rate = min_hit_rate
+        self.warmup = warmup
+        # Dictionary: topology key (tuple) => critical path plan (tuple, see plan)
+        # or None if the topology has been seen only once
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.enabled = True
+
+    def calculate_breakdown(self, G, detail='paths'):
+        """Calculates the latency breakdown like calculate_breakdown for a span graph G
+        created with critical_path=False."""
+        lookups = self.hits + self.misses
+        if self.enabled and lookups >= self.warmup and self.hits < self.min_hit_rate * lookups:
+            logging.debug(f"Disable critical path cache after {self.hits} hits in {lookups} traces.")  # noqa: E501
+            self.enabled = False
+            self.plans.clear()
+        if not self.enabled:
+            add_longest_path(G)
+            return calculate_breakdown(G, detail)
+        topology = topology_key(G)
+        if topology is not None:
+            key, ids, timestamps = topology
+            plan = self.plans.get(key)
+            if plan is not None and self.replay(G, plan, ids, timestamps, detail):
+                self.plans.move_to_end(key)
+                self.hits += 1
+                return G
+        self.misses += 1
+        add_longest_path(G)
+        calculate_breakdown(G, detail)
+        if topology is not None:
+            # Only keep the critical path of topologies that occur at least twice
+            # to avoid the overhead of creating plans for unique topologies
+            self.plans[key] = self.plan(G, ids, timestamps) if key in self.plans else None
+            self.plans.move_to_end(key)
+            if len(self.plans) > self.maxsize:
+                self.plans.popitem(last=False)
+        return G
+
+    @staticmethod
+    def plan(G, ids, timestamps):
+        """Returns a tuple (longest_path, num_cold_starts, critical_path, async_checks)
+        with node positions and timestamp indices instead of ids and timestamps
+        or None if the critical path cannot be expressed in terms of the topology."""
+        positions = {id: position for position, id in enumerate(ids)}
+        # Timestamps with identical values have identical ranks in the topology key.
+        # Hence, any index of an identical value refers to the same value on a hit.
+        time_indices = dict()
+        for index, t in enumerate(timestamps):
+            time_indices.setdefault(t, index)
+        critical_path = []
+        async_checks = []
+        for e in G.graph['critical_path']:
+            start = time_indices.get(e['start_time'])
+            end = time_indices.get(e['end_time'])
+            if start is None or end is None or \
+                    e['duration'] != us_diff(e['start_time'], e['end_time']):
+                return None
+            resource = positions[e['resource']] if e['resource'] is not None else None
+            if 'source' in e:
+                source = positions[e['source']]
+                target = positions[e['target']]
+                if e['type'] == 'async-send':
+                    async_checks.append((2 * source, 2 * target))
+            else:
+                source = target = None
+            critical_path.append((start, end, resource, source, target, e['type'], e['category']))
+        longest_path = [positions[id] for id in G.graph['longest_path']]
+        return longest_path, G.graph['num_cold_starts'], critical_path, async_checks
+
+    @staticmethod
+    def replay(G, plan, ids, timestamps, detail='paths') -> bool:
+        """Adds the cached critical path with the ids and timestamps of G and
+        calculates the breakdown. Returns False without modifying G if the trace
+        needs the full analysis because pair_path would detect an extreme time shift."""
+        longest_path, num_cold_starts, cached_path, async_checks = plan
+        threshold = TIMESTAMP_THRESHOLD.total_seconds()
+        for source_start, target_start in async_checks:
+            if timestamps[target_start] - timestamps[source_start] + threshold < 0:
+                return False
+        critical_path = []
+        for start, end, resource, source, target, type, category in cached_path:
+            start_time = timestamps[start]
+            end_time = timestamps[end]
+            if source is None:
+                critical_path.append({
+                    'start_time': start_time,
+                    'end_time': end_time,
+                    'duration': us_diff(start_time, end_time),
+                    'resource': ids[resource],
+                    'type': type,
+                    'category': category
+                })
+            else:
+                critical_path.append({
+                    'start_time': start_time,
+                    'end_time': end_time,
+                    'duration': us_diff(start_time, end_time),
+                    'resource': ids[resource] if resource is not None else None,
+                    'source': ids[source],
+                    'target': ids[target],
+                    'type': type,
+                    'category': category
+                })
+        G.graph['num_cold_starts'] = num_cold_starts
+        G.graph['longest_path'] = [ids[position] for position in longest_path]
+        add_breakdown(G, critical_path, detail)
+        return True
+
+
+def analyze_trace_graph(trace, span_tree=False, detail='summary', cache=None):
+    """Returns the span graph of a trace with the latency breakdown in its graph attributes.
+    An optional CriticalPathCache reuses the critical path of traces with the same topology."""
+    if cache is None:
+        G = create_span_graph(trace, span_tree)
+        return calculate_breakdown(G, detail)
+    G = create_span_graph(trace, span_tree, critical_path=False)
+    return cache.calculate_breakdown(G, detail)
 
 
-def extract_trace_breakdown(trace, fields=CSV_FIELDS):
-    G = create_span_graph(trace)
-    G = calculate_breakdown(G)
+def trace_breakdown_row(G, fields=CSV_FIELDS) -> list:
+    """Returns the values of the given fields from the graph attributes."""
     trace_breakdown = []
     for field in fields:
-        trace_breakdown.append(G.graph.get(field, None))
+        value = G.graph.get(field, None)
+        # Convert integer microseconds into timedelta
+        if value is not None and field in TIME_CATEGORIES:
+            value = td(value)
+        trace_breakdown.append(value)
     return trace_breakdown
 
 
+def add_to_sketches(sketches, G):
+    """Adds the end-to-end duration and the time categories of a trace in microseconds
+    to the sketches keyed by url and cold/warm status.
+    Missing time categories count as zero."""
+    values = {'duration': G.graph['duration_us']}
+    for category in TIME_CATEGORIES:
+        values[category] = G.graph.get(category) or 0
+    sketches.add(G.graph['url'], G.graph['num_cold_starts'] > 0, values)
+
+
+def extract_trace_breakdown(trace, fields=CSV_FIELDS, span_tree=False, detail='summary'):
+    G = analyze_trace_graph(trace, span_tree, detail)
+    return trace_breakdown_row(G, fields)
+
+
+def analyze_trace_lines(lines, trace_writer, invalid_writer, fields=CSV_FIELDS,
+                        span_tree=False, detail='summary', paths_file=None, profiler=None,
+                        sketches=None, trace_paths=None, cache=None):
+    """Writes the trace breakdown of every trace line to the trace_writer
+    or an error message to the invalid_writer if the trace is invalid.
+    The detail level 'full' additionally writes the critical path of every
+    valid trace as JSON line into the paths_file.
+    Optional BreakdownSketches and TracePaths are updated with every valid trace.
+    An optional StageProfiler times the trace_writer and counts invalid traces.
+    An optional CriticalPathCache reuses the critical path of traces with the same topology.
+    Returns a tuple with the number of valid and invalid traces."""
+    if profiler is not None:
+        trace_writer = profiler.writer(trace_writer)
+    num_valid_traces = 0
+    num_invalid_traces = 0
+    for line in lines:
+        trace = None
+        try:
+            trace = loads(line)
+            G = analyze_trace_graph(trace, span_tree, detail, cache)
+            trace_writer.writerow(trace_breakdown_row(G, fields))
+            if detail == 'full':
+                paths_file.write(json.dumps(critical_path_record(G)) + '\n')
+            if sketches is not None:
+                add_to_sketches(sketches, G)
+            if trace_paths is not None:
+                trace_paths.add(G.graph['path_id'], G.graph['longest_path_names'])
+            num_valid_traces += 1
+        except Exception as e:
+            trace_id = trace.get('Id') if isinstance(trace, dict) else None
+            message = str(e)
+            invalid_writer.writerow([trace_id, message])
+            logging.debug(f"Skip invalid trace {trace_id}. {message}")
+            num_invalid_traces += 1
+            if profiler is not None:
+                profiler.count_invalid(e)
+    if cache is not None:
+        logging.debug(f"Critical path cache: {cache.hits} hits and {cache.misses} misses.")
+    return num_valid_traces, num_invalid_traces
+
+
+def shard_offsets(file, num_shards, start=0, end=None) -> list:
+    """Splits the byte range [start, end) of a file with one trace per line
+    into at most num_shards contiguous (start, end) byte ranges.
+    Shard boundaries are aligned to the next line start such that
+    every line belongs to exactly one shard."""
+    if end is None:
+        end = Path(file).stat().st_size
+    shard_size = max((end - start) // num_shards, 1)
+    offsets = []
+    with open(file, 'rb') as f:
+        shard_start = start
+        while shard_start < end:
+            f.seek(min(shard_start + shard_size, end))
+            # Move to the beginning of the next line unless already at the end
+            if f.tell() < end:
+                f.readline()
+            shard_end = min(f.tell(), end)
+            offsets.append((shard_start, shard_end))
+            shard_start = shard_end
+    return offsets
+
+
+def complete_lines_end(file, end=None, chunk_size=1 << 16) -> int:
+    """Returns the byte offset after the last newline-terminated line within
+    the first end bytes of a file. A partial last line (e.g., while the file is
+    still being written) is hence excluded from the analysis until it is complete."""
+    if end is None:
+        end = Path(file).stat().st_size
+    with open(file, 'rb') as f:
+        position = end
+        while position > 0:
+            chunk_start = max(position - chunk_size, 0)
+            f.seek(chunk_start)
+            index = f.read(position - chunk_start).rfind(b'\n')
+            if index >= 0:
+                return chunk_start + index + 1
+            position = chunk_start
+    return 0
+
+
+def read_lines(file, start, end):
+    """Yields the lines within the byte range [start, end) of a file.
+    The start offset must point to the beginning of a line."""
+    with open(file, 'rb') as f:
+        f.seek(start)
+        position = start
+        for line in f:
+            if position >= end:
+                break
+            position += len(line)
+            yield line
+
+
+def open_breakdown(breakdown_file, output_format='csv', append=False):
+    """Opens the trace breakdown output for writing.
+    Returns a file for csv and a ParquetTraceWriter for parquet."""
+    if output_format == 'parquet':
+        # Optional dependency: pyarrow
+        from sb.parquet_writer import ParquetTraceWriter
+        return ParquetTraceWriter(breakdown_file, BREAKDOWN_FIELDS, append=append)
+    return open(breakdown_file, 'a' if append else 'w')
+
+
+def breakdown_writer(breakdown_out, output_format='csv'):
+    """Returns a writer with the writerow interface of csv.writer."""
+    if output_format == 'parquet':
+        return breakdown_out
+    return csv.writer(breakdown_out, quoting=csv.QUOTE_MINIMAL)
+
+
+def open_paths(paths_file, detail='summary', mode='w'):
+    """Opens the critical paths output for the detail level 'full'."""
+    if detail == 'full':
+        return open(paths_file, mode)
+    return nullcontext()
+
+
+def analyze_shard(file, start, end, breakdown_file, invalid_file, span_tree=False,
+                  output_format='csv', detail='summary', paths_file=None, profile=False,
+                  path_cache=False):
+    """Analyzes the traces within the byte range [start, end) of the file
+    and writes the results without headers into the given shard output files.
+    Runs in a separate worker process for parallel trace analysis.
+    Returns a tuple with the number of valid and invalid traces, the BreakdownSketches,
+    the TracePaths, and the profile of the shard (see StageProfiler.to_dict)
+    or None if profile=False."""
+    profiler = StageProfiler() if profile else None
+    sketches = BreakdownSketches()
+    trace_paths = TracePaths()
+    cache = CriticalPathCache() if path_cache else None
+    with open_breakdown(breakdown_file, output_format) as breakdown_out, \
+         open(invalid_file, 'w') as invalid_csv, \
+         open_paths(paths_file, detail) as paths_out, \
+         profiling(profiler, __name__, PROFILED_STAGES):
+        trace_writer = breakdown_writer(breakdown_out, output_format)
+        invalid_writer = csv.writer(invalid_csv, quoting=csv.QUOTE_MINIMAL)
+        lines = read_lines(file, start, end)
+        num_valid, num_invalid = analyze_trace_lines(
+            lines, trace_writer, invalid_writer, BREAKDOWN_FIELDS, span_tree, detail,
+            paths_out, profiler, sketches, trace_paths, cache)
+    return num_valid, num_invalid, sketches, trace_paths, \
+        profiler.to_dict() if profile else None
+
+
+def analyze_batch(lines, span_tree=False, detail='summary', path_cache=False):
+    """Analyzes a batch of trace lines in a worker process of the AwsTraceAnalysisPipeline.
+    Returns a tuple with the breakdown rows, the invalid rows, the critical path lines,
+    the number of valid and invalid traces, the BreakdownSketches, and the TracePaths."""
+    rows = []
+    invalid_rows = []
+    paths_out = StringIO()
+    sketches = BreakdownSketches()
+    trace_paths = TracePaths()
+    cache = CriticalPathCache() if path_cache else None
+    num_valid, num_invalid = analyze_trace_lines(
+        lines, ListWriter(rows), ListWriter(invalid_rows), BREAKDOWN_FIELDS, span_tree,
+        detail, paths_out, None, sketches, trace_paths, cache)
+    return rows, invalid_rows, paths_out.getvalue(), num_valid, num_invalid, sketches, \
+        trace_paths
+
+
+class ListWriter:
+    """Collects rows with the writerow interface of csv.writer."""
+
+    def __init__(self, rows) -> None:
+        self.rows = rows
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+def update_hash(hasher, file, start, end, chunk_size=1 << 20):
+    """Updates the hasher with the content within the byte range [start, end) of a file."""
+    with open(file, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    return hasher
+
+
+def load_manifest(manifest_file) -> dict:
+    """Returns the manifest of a previous analysis or None if missing or corrupt."""
+    try:
+        with open(manifest_file, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def analysis_manifest(input_size, hasher, output_format, detail, num_valid_traces,
+                      num_invalid_traces, output_files) -> dict:
+    return {
+        'analyzer_version': ANALYZER_VERSION,
+        'input_size': input_size,
+        'input_hash': hasher.hexdigest(),
+        'last_offset': input_size,
+        'output_format': output_format,
+        'detail': detail,
+        'num_valid_traces': num_valid_traces,
+        'num_invalid_traces': num_invalid_traces,
+        'output_sizes': {name: path.stat().st_size for name, path in output_files.items()}
+    }
+
+
+def save_manifest(manifest_file, manifest):
+    """Atomically replaces the manifest such that it never refers to partial results."""
+    tmp_file = Path(str(manifest_file) + '.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, manifest_file)
+
+
 class AwsTraceAnalyzer:
     """Parses traces.json files downloaded by the AwsTraceDownloader:
     1) Saves a trace summary into trace_breakdown.csv
     2) Saves a log of invalid trace into invalid_traces.csv
+    3) Saves quantile sketches of the duration and time categories per url and
+       cold/warm status into breakdown_sketches.json (see sb.breakdown_sketches)
+    4) Saves the span names of the longest path per path_id of the trace summary
+       into the path dictionary trace_paths.json (see sb.trace_paths)
+    5) Saves a manifest of the analyzed input into trace_breakdown_manifest.json
+    Setting workers > 1 splits the traces.json file into byte-range shards
+    that are analyzed in a process pool. The shard results are merged in file order
+    and hence produce the same output as the serial analysis.
+    Setting span_tree=True builds a compact SpanTree instead of a Networkx graph
+    per trace, which produces the same output with less overhead.
+    Re-running the analysis is a no-op if the manifest matches the input,
+    the outputs, and the ANALYZER_VERSION. If traces have been appended to the
+    traces.json file, only the new traces are analyzed and appended to the outputs.
+    A partial last line (e.g., during a download) is only analyzed once it is complete.
+    Setting force=True always re-analyzes all traces.
+    Setting output_format='parquet' saves the trace summary into trace_breakdown.parquet
+    with typed columns (see sb.parquet_writer) instead of trace_breakdown.csv.
+    Setting detail='full' additionally saves the longest path and critical path of
+    every valid trace as JSON lines into critical_paths.jsonl for drill-down analysis.
+    Setting profile=True saves the time per analysis stage and the invalid traces
+    per exception site into analysis_profile.json (see sb.analysis_profile).
+    Setting path_cache=True reuses the critical path of traces with the same topology
+    and timestamp order (see CriticalPathCache), which produces the same output
+    and speeds up the analysis of apps with a few recurring trace topologies.
     """
 
-    def __init__(self, log_path) -> None:
+    def __init__(self, log_path, workers=1, span_tree=False, force=False,
+                 output_format='csv', detail='summary', profile=False,
+                 path_cache=False) -> None:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format {output_format}. Choose one of {OUTPUT_FORMATS}.")  # noqa: E501
+        if detail not in DETAIL_LEVELS:
+            raise ValueError(f"Unsupported detail level {detail}. Choose one of {DETAIL_LEVELS}.")  # noqa: E501
         self.log_path = log_path
+        self.workers = workers
+        self.span_tree = span_tree
+        self.force = force
+        self.output_format = output_format
+        self.detail = detail
+        self.profile = profile
+        self.path_cache = path_cache
 
     def analyze_traces(self):
         file = Path(self.log_path)
-        breakdown_file = file.parent / 'trace_breakdown.csv'
+        breakdown_file = file.parent / f"trace_breakdown.{self.output_format}"
         invalid_file = file.parent / 'invalid_traces.csv'
-
+        paths_file = file.parent / CRITICAL_PATHS_FILE
+        sketches_file = file.parent / SKETCHES_FILE
+        path_dictionary_file = file.parent / PATHS_FILE
+        manifest_file = file.parent / MANIFEST_FILE
+        input_size = complete_lines_end(file)
+        if input_size < file.stat().st_size:
+            logging.warning(f"Skip partial last line of {file}.")
+        output_files = {'breakdown': breakdown_file, 'invalid': invalid_file,
+                        'sketches': sketches_file, 'path_dictionary': path_dictionary_file}
+        if self.detail == 'full':
+            output_files['paths'] = paths_file
+
+        manifest = None if self.force else load_manifest(manifest_file)
+        start, hasher = self.resume_offset(manifest, file, input_size, output_files)
+        if start == input_size:
+            logging.info(f"Skip analysis of unchanged {file} (see {manifest_file}).")
+            return
         num_valid_traces = 0
         num_invalid_traces = 0
-        with open(file, 'r') as traces_json, \
-             open(breakdown_file, 'w') as traces_csv, \
-             open(invalid_file, 'w') as invalid_csv:
-            trace_writer = csv.writer(traces_csv, quoting=csv.QUOTE_MINIMAL)
-            trace_headers = CSV_FIELDS
-            trace_writer.writerow(trace_headers)
+        sketches = BreakdownSketches()
+        trace_paths = TracePaths()
+        mode = 'w'
+        if start > 0:
+            # Append new traces to the previous results
+            num_valid_traces = manifest['num_valid_traces']
+            num_invalid_traces = manifest['num_invalid_traces']
+            sketches = BreakdownSketches.load(sketches_file)
+            trace_paths = TracePaths.load(path_dictionary_file)
+            mode = 'a'
+            logging.info(f"Analyze {input_size - start} new bytes of {file} from offset {start}.")  # noqa: E501
+
+        profiler = StageProfiler() if self.profile else None
+        start_time = time.perf_counter()
+        with open_breakdown(breakdown_file, self.output_format, start > 0) as breakdown_out, \
+             open(invalid_file, mode) as invalid_csv, \
+             open_paths(paths_file, self.detail, mode) as paths_out:
+            trace_writer = breakdown_writer(breakdown_out, self.output_format)
+            trace_headers = BREAKDOWN_FIELDS
             invalid_writer = csv.writer(invalid_csv, quoting=csv.QUOTE_MINIMAL)
             invalid_headers = ['trace_id', 'message']
-            invalid_writer.writerow(invalid_headers)
-            for line in traces_json:
-                try:
-                    trace = json.loads(line)
-                    trace_breakdown = extract_trace_breakdown(trace, trace_headers)
-                    trace_writer.writerow(trace_breakdown)
-                    num_valid_traces += 1
-                except Exception as e:
-                    trace_id = trace.get('Id')
-                    message = str(e)
-                    invalid_writer.writerow([trace_id, message])
-                    logging.debug(f"Skip invalid trace {trace_id}. {message}")
-                    num_invalid_traces += 1
+            if start == 0:
+                if self.output_format == 'csv':
+                    trace_writer.writerow(trace_headers)
+                invalid_writer.writerow(invalid_headers)
+            if self.workers > 1:
+                num_valid, num_invalid = self.analyze_shards(
+                    file, breakdown_out, invalid_csv, paths_out, start, input_size,
+                    profiler, sketches, trace_paths)
+            else:
+                lines = read_lines(file, start, input_size)
+                cache = CriticalPathCache() if self.path_cache else None
+                with profiling(profiler, __name__, PROFILED_STAGES):
+                    num_valid, num_invalid = analyze_trace_lines(
+                        lines, trace_writer, invalid_writer, trace_headers,
+                        self.span_tree, self.detail, paths_out, profiler, sketches,
+                        trace_paths, cache)
+            num_valid_traces += num_valid
+            num_invalid_traces += num_invalid
+        sketches.save(sketches_file)
+        trace_paths.save(path_dictionary_file)
+        if profiler is not None:
+            profile_file = file.parent / PROFILE_FILE
+            profiler.save(profile_file, type(self).__name__, time.perf_counter() - start_time,
+                          num_valid, num_invalid)
+            logging.info(f"Saved analysis profile to {profile_file}.")
+
+        update_hash(hasher, file, start, input_size)
+        save_manifest(manifest_file, analysis_manifest(
+            input_size, hasher, self.output_format, self.detail, num_valid_traces,
+            num_invalid_traces, output_files))
 
         logging.info(f"Analyzed {num_valid_traces} valid traces. Written to {breakdown_file}.")
         if num_invalid_traces > 0:
             invalid_rate = round(num_invalid_traces / (num_valid_traces + num_invalid_traces) * 100, 2)  # noqa: E501
             logging.warning(f"Detected {num_invalid_traces} ({invalid_rate}%) invalid traces. Written to {invalid_file}.")  # noqa: E501
+
+    def resume_offset(self, manifest, file, input_size, output_files):
+        """Returns a tuple with the byte offset where the analysis continues and
+        the sha256 hasher over the input up to this offset.
+        Returns offset 0 if the previous results cannot be reused because
+        the analyzer version, output format, or detail level changed,
+        the output files do not match the manifest (e.g., partially written),
+        or the previously analyzed input changed."""
+        hasher = hashlib.sha256()
+        if manifest is None or manifest.get('analyzer_version') != ANALYZER_VERSION or \
+                manifest.get('output_format') != self.output_format or \
+                manifest.get('detail') != self.detail:
+            return 0, hasher
+        last_offset = manifest['last_offset']
+        output_sizes = manifest.get('output_sizes', {})
+        if input_size < last_offset or output_sizes.keys() != output_files.keys():
+            return 0, hasher
+        for name, path in output_files.items():
+            if not path.is_file() or path.stat().st_size != output_sizes[name]:
+                return 0, hasher
+        update_hash(hasher, file, 0, last_offset)
+        if hasher.hexdigest() != manifest['input_hash']:
+            return 0, hashlib.sha256()
+        return last_offset, hasher
+
+    def analyze_shards(self, file, breakdown_out, invalid_csv, paths_out=None,
+                       start=0, end=None, profiler=None, sketches=None, trace_paths=None):
+        """Analyzes byte-range shards of the file in a process pool and
+        appends the shard results in file order to the open output files.
+        Merges the shard profiles, sketches, and paths into the given
+        profiler, sketches, and trace_paths if provided.
+        Returns a tuple with the number of valid and invalid traces."""
+        num_valid_traces = 0
+        num_invalid_traces = 0
+        offsets = shard_offsets(file, self.workers, start, end)
+        with TemporaryDirectory(dir=file.parent) as tmp_dir, \
+             ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = []
+            for index, (start, end) in enumerate(offsets):
+                shard_breakdown = Path(tmp_dir) / f"trace_breakdown_{index}.{self.output_format}"
+                shard_invalid = Path(tmp_dir) / f"invalid_traces_{index}.csv"
+                shard_paths = Path(tmp_dir) / f"critical_paths_{index}.jsonl"
+                future = executor.submit(analyze_shard, file, start, end,
+                                         shard_breakdown, shard_invalid, self.span_tree,
+                                         self.output_format, self.detail, shard_paths,
+                                         profiler is not None, self.path_cache)
+                futures.append((future, shard_breakdown, shard_invalid, shard_paths))
+            # Merge in shard order to keep the output deterministic
+            breakdown_out.flush()
+            invalid_csv.flush()
+            for future, shard_breakdown, shard_invalid, shard_paths in futures:
+                num_valid, num_invalid, shard_sketches, shard_trace_paths, shard_profile = \
+                    future.result()
+                if sketches is not None:
+                    sketches.merge(shard_sketches)
+                if trace_paths is not None:
+                    trace_paths.merge(shard_trace_paths)
+                if profiler is not None:
+                    profiler.merge(shard_profile)
+                num_valid_traces += num_valid
+                num_invalid_traces += num_invalid
+                if self.output_format == 'parquet':
+                    breakdown_out.write_file(shard_breakdown)
+                else:
+                    # Keep the csv line terminator (i.e., \r\n) of the shard files
+                    with open(shard_breakdown, 'r', newline='') as f:
+                        shutil.copyfileobj(f, breakdown_out)
+                with open(shard_invalid, 'r', newline='') as f:
+                    shutil.copyfileobj(f, invalid_csv)
+                if paths_out is not None:
+                    with open(shard_paths, 'r') as f:
+                        shutil.copyfileobj(f, paths_out)
+        logging.debug(f"Merged {len(offsets)} trace shards analyzed by {self.workers} workers.")
+        return num_valid_traces, num_invalid_traces
+
+
+class AwsTraceAnalysisPipeline:
+    """Analyzes traces while the AwsTraceDownloader is still downloading them
+    into traces.json (see `sb get_traces --analyze`):
+        with AwsTraceAnalysisPipeline(log_path) as pipeline:
+            AwsTraceDownloader(spec, trace_sink=pipeline.put).get_traces()
+    The downloader puts every batch of written trace lines into a bounded queue,
+    which blocks the download if the analysis falls behind. A consumer thread
+    analyzes the traces in file order and writes the same outputs as the
+    AwsTraceAnalyzer, including the manifest if the analyzed lines match
+    the complete traces.json file. Re-running analyze_traces is hence a no-op.
+    Setting workers > 1 analyzes batches of traces in a process pool
+    and writes the results in file order.
+    """
+
+    def __init__(self, log_path, workers=1, span_tree=False, output_format='csv',
+                 detail='summary', path_cache=False) -> None:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format {output_format}. Choose one of {OUTPUT_FORMATS}.")  # noqa: E501
+        if detail not in DETAIL_LEVELS:
+            raise ValueError(f"Unsupported detail level {detail}. Choose one of {DETAIL_LEVELS}.")  # noqa: E501
+        self.log_path = log_path
+        self.workers = workers
+        self.span_tree = span_tree
+        self.output_format = output_format
+        self.detail = detail
+        self.path_cache = path_cache
+        self.queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.thread = None
+        self.error = None
+        self.hasher = hashlib.sha256()
+        self.input_size = 0
+        self.num_valid_traces = 0
+        self.num_invalid_traces = 0
+        self.sketches = BreakdownSketches()
+        self.trace_paths = TracePaths()
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.consume, name='trace-analysis', daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Signal the end of the traces unless the consumer already failed
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+                break
+            except queue.Full:
+                continue
+        self.thread.join()
+        if exc_type is None:
+            self.raise_error()
+            self.save()
+
+    def put(self, lines):
+        """Enqueues a list of trace lines in the order written to traces.json.
+        Blocks while the queue is full and raises the error of a failed analysis."""
+        while True:
+            self.raise_error()
+            try:
+                self.queue.put(lines, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def raise_error(self):
+        if self.error is not None:
+            raise RuntimeError('Trace analysis pipeline failed.') from self.error
+
+    def batches(self):
+        """Yields the queued trace lines in batches of up to TRACE_BATCH_SIZE lines
+        without waiting for a full batch."""
+        while True:
+            lines = self.queue.get()
+            if lines is None:
+                return
+            batch = list(lines)
+            while len(batch) < TRACE_BATCH_SIZE:
+                try:
+                    lines = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if lines is None:
+                    self.track_input(batch)
+                    yield batch
+                    return
+                batch.extend(lines)
+            self.track_input(batch)
+            yield batch
+
+    def track_input(self, lines):
+        for line in lines:
+            data = line.encode()
+            self.hasher.update(data)
+            self.input_size += len(data)
+
+    def output_files(self) -> dict:
+        directory = Path(self.log_path).parent
+        output_files = {'breakdown': directory / f"trace_breakdown.{self.output_format}",
+                        'invalid': directory / 'invalid_traces.csv',
+                        'sketches': directory / SKETCHES_FILE,
+                        'path_dictionary': directory / PATHS_FILE}
+        if self.detail == 'full':
+            output_files['paths'] = directory / CRITICAL_PATHS_FILE
+        return output_files
+
+    def consume(self):
+        output_files = self.output_files()
+        paths_file = Path(self.log_path).parent / CRITICAL_PATHS_FILE
+        try:
+            with open_breakdown(output_files['breakdown'], self.output_format) as breakdown_out, \
+                 open(output_files['invalid'], 'w') as invalid_csv, \
+                 open_paths(paths_file, self.detail) as paths_out:
+                trace_writer = breakdown_writer(breakdown_out, self.output_format)
+                invalid_writer = csv.writer(invalid_csv, quoting=csv.QUOTE_MINIMAL)
+                if self.output_format == 'csv':
+                    trace_writer.writerow(BREAKDOWN_FIELDS)
+                invalid_writer.writerow(['trace_id', 'message'])
+                if self.workers > 1:
+                    self.analyze_batches(trace_writer, invalid_writer, paths_out)
+                else:
+                    cache = CriticalPathCache() if self.path_cache else None
+                    for batch in self.batches():
+                        num_valid, num_invalid = analyze_trace_lines(
+                            batch, trace_writer, invalid_writer, BREAKDOWN_FIELDS,
+                            self.span_tree, self.detail, paths_out, None, self.sketches,
+                            self.trace_paths, cache)
+                        self.num_valid_traces += num_valid
+                        self.num_invalid_traces += num_invalid
+        except BaseException as e:
+            logging.error(f"Trace analysis pipeline failed: {e}")
+            self.error = e
+
+    def analyze_batches(self, trace_writer, invalid_writer, paths_out):
+        """Analyzes the batches in a process pool with bounded pending batches
+        and writes their results in file order."""
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for batch in self.batches():
+                pending.append(executor.submit(analyze_batch, batch, self.span_tree,
+                                               self.detail, self.path_cache))
+                if len(pending) >= 2 * self.workers:
+                    self.write_batch(pending.popleft().result(), trace_writer,
+                                     invalid_writer, paths_out)
+            while pending:
+                self.write_batch(pending.popleft().result(), trace_writer,
+                                 invalid_writer, paths_out)
+
+    def write_batch(self, result, trace_writer, invalid_writer, paths_out):
+        rows, invalid_rows, paths, num_valid, num_invalid, sketches, trace_paths = result
+        for row in rows:
+            trace_writer.writerow(row)
+        for row in invalid_rows:
+            invalid_writer.writerow(row)
+        if paths_out is not None:
+            paths_out.write(paths)
+        self.sketches.merge(sketches)
+        self.trace_paths.merge(trace_paths)
+        self.num_valid_traces += num_valid
+        self.num_invalid_traces += num_invalid
+
+    def save(self):
+        file = Path(self.log_path)
+        output_files = self.output_files()
+        self.sketches.save(output_files['sketches'])
+        self.trace_paths.save(output_files['path_dictionary'])
+        if file.is_file() and file.stat().st_size == self.input_size:
+            save_manifest(file.parent / MANIFEST_FILE, analysis_manifest(
+                self.input_size, self.hasher, self.output_format, self.detail,
+                self.num_valid_traces, self.num_invalid_traces, output_files))
+        else:
+            logging.warning(f"Analyzed traces do not match {file}. Re-run analyze_traces.")
+        logging.info(f"Analyzed {self.num_valid_traces} valid traces. Written to {output_files['breakdown']}.")  # noqa: E501
+        if self.num_invalid_traces > 0:
+            logging.warning(f"Detected {self.num_invalid_traces} invalid traces. Written to {output_files['invalid']}.")  # noqa: E501
@@ -1,7 +1,101 @@
 import logging
 import json
+import os
+import queue
+import re
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 import boto3
 from botocore.config import Config
+from botocore.exceptions import ClientError
+from sb.trace_decoder import loads
+
+# Maximum number of trace ids per BatchGetTraces request
+BATCH_GET_TRACES_SIZE = 5
+# Error codes of throttled AWS API requests
+THROTTLING_CODES = {'ThrottlingException', 'TooManyRequestsException', 'RequestLimitExceeded'}
+# Number of retries of a throttled request before its trace ids count as unprocessed
+MAX_THROTTLING_RETRIES = 8
+# Exponential backoff with full jitter after throttling in seconds
+BACKOFF_BASE = 0.1
+MAX_BACKOFF = 10
+# Maximum number of GetTraceSummaries pages buffered between listing and downloading
+TRACE_ID_QUEUE_SIZE = 100
+# Trace id at the beginning of a trace line written by json.dumps
+TRACE_ID_PATTERN = re.compile(rb'\{"Id": "([^"]+)"')
+
+
+def is_throttling(e) -> bool:
+    return isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in THROTTLING_CODES  # noqa: E501
+
+
+def request_with_backoff(limiter, method, **kwargs):
+    """Returns the response of an API request within the concurrency limit and
+    retries throttled requests with exponential backoff and full jitter.
+    Raises the last throttling error after MAX_THROTTLING_RETRIES."""
+    for attempt in range(MAX_THROTTLING_RETRIES + 1):
+        limiter.acquire()
+        try:
+            response = method(**kwargs)
+        except ClientError as e:
+            limiter.release(throttled=is_throttling(e))
+            if not is_throttling(e) or attempt == MAX_THROTTLING_RETRIES:
+                raise
+            time.sleep(random.uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt)))
+        else:
+            limiter.release()
+            return response
+
+
+def partition_timespan(start, end, num_partitions) -> list:
+    """Splits the timespan [start, end) into num_partitions contiguous (start, end) tuples."""
+    step = (end - start) / num_partitions
+    bounds = [start + step * i for i in range(num_partitions)] + [end]
+    return list(zip(bounds, bounds[1:]))
+
+
+def put_unless_stopped(q, item, stop):
+    """Puts an item into a bounded queue unless the stop event is set while waiting."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+class AimdLimiter:
+    """Limits the number of concurrent requests with additive increase and
+    multiplicative decrease (AIMD) as in TCP congestion control:
+    every successful request increases the limit by 1/limit (i.e., by one per round
+    of limit requests) up to max_limit and every throttled request halves the limit."""
+
+    def __init__(self, max_limit, min_limit=1) -> None:
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.num_throttled = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.num_throttled += 1
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
 
 
 class AwsTraceDownloader:
@@ -9,94 +103,302 @@ class AwsTraceDownloader:
     https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/xray.html
     More documentation on getting data from X-Ray including example trace:
     https://docs.aws.amazon.com/xray/latest/devguide/xray-api-gettingdata.html
+    Setting workers > 1 lists the trace ids of `workers` time partitions in parallel and
+    retrieves the traces with concurrent BatchGetTraces requests while the trace ids are
+    still being listed. All requests use a shared client and adapt their concurrency
+    to throttling (see AimdLimiter).
+    An optional client (e.g., sb.local_xray.LocalXRayClient) replaces the boto3 client.
+    An optional endpoint_url replaces the X-Ray endpoint of the boto3 client
+    (e.g., sb.local_xray.XRayServer).
+    An optional trace_sink is called with the list of trace lines after every write
+    to traces.json (e.g., sb.aws_trace_analyzer.AwsTraceAnalysisPipeline.put).
     """
 
-    def __init__(self, spec) -> None:
+    def __init__(self, spec, workers=1, client=None, trace_sink=None,
+                 endpoint_url=None) -> None:
         self.spec = spec
+        self.workers = workers
+        self.trace_sink = trace_sink
+        if client is not None:
+            self.client = client
+            return
         # Configure AWS XRay client
         region = self.spec['region']
         my_config = Config(
-            region_name=region
+            region_name=region,
+            # Keep one connection per worker thread (botocore default: 10)
+            max_pool_connections=max(workers, 10)
         )
-        self.client = boto3.client('xray', config=my_config)
+        self.client = boto3.client('xray', config=my_config, endpoint_url=endpoint_url)
 
     def get_traces(self):
         """Retrieves X-Ray traces from the last invocation:
-        1. saves all trace ids in a trace_ids.txt
+        1. saves every listed trace id once in trace_ids.txt (i.e., without duplicates
+           in listing order for a single worker and in listing completion order otherwise)
         2. saves all actual trace data in traces.json
         3. saves unprocessed trace ids in unprocessed_trace_ids.txt
+        Resumes a previous download if traces.json already exists (e.g., after a crash
+        or throttling) by only retrieving the trace ids of trace_ids.txt that are missing
+        in traces.json, which includes the previously unprocessed trace ids.
+        The trace ids are listed again if trace_ids.txt is incomplete.
         """
         start, end = self.spec.event_log.get_invoke_timespan()
         log_path = self.spec.logs_directory()
         trace_ids_file = log_path.joinpath('trace_ids.txt')
         trace_file = log_path.joinpath('traces.json')
+        unprocessed_ids_file = log_path.joinpath('unprocessed_trace_ids.txt')
+        # The trace ids are listed into a partial file that is renamed once complete
+        partial_trace_ids_file = log_path.joinpath('trace_ids.txt.partial')
+        downloaded_ids = set()
+        mode = 'w'
         if trace_file.exists():
-            logging.error(f"Traces already exist under {trace_file} for this \
-invocation starting time. Aborting.")
-            return None
+            downloaded_ids = read_downloaded_trace_ids(trace_file)
+            mode = 'a'
+            logging.info(f"Resume download with {len(downloaded_ids)} traces already in {trace_file}.")  # noqa: E501
 
-        trace_ids = self.retrieve_trace_ids(start, end, trace_ids_file)
+        if trace_file.exists() and trace_ids_file.exists():
+            trace_ids = read_trace_ids(trace_ids_file)
+            unique_trace_ids = [id for id in dict.fromkeys(trace_ids) if id not in downloaded_ids]
+            num_trace_ids = len(trace_ids)
+            logging.info(f"Retrieve {len(unique_trace_ids)} missing or unprocessed traces.")
+            unprocessed_ids = self.retrieve_traces(unique_trace_ids, trace_file, mode)
+        elif self.workers > 1:
+            # Download traces while listing and deduplicating the trace ids
+            unique_trace_ids = self.stream_trace_ids(start, end, partial_trace_ids_file)
+            missing_trace_ids = (id for id in unique_trace_ids if id not in downloaded_ids)
+            unprocessed_ids = self.retrieve_traces(missing_trace_ids, trace_file, mode)
+            num_trace_ids = self.num_listed_ids
+            logging.info(f"Removed {self.num_duplicate_ids} duplicate trace ids.")
+            os.replace(partial_trace_ids_file, trace_ids_file)
+        else:
+            trace_ids = self.retrieve_trace_ids(start, end, partial_trace_ids_file)
+            os.replace(partial_trace_ids_file, trace_ids_file)
+            num_trace_ids = len(trace_ids)
 
-        # Remove potential duplicates because boto3 BatchGetTraces fails if
-        # a chunk contains duplicate trace IDs, which can be common with 10000s of trace ids.
-        unique_trace_ids = list(set(trace_ids))
-        num_duplicate_ids = len(trace_ids) - len(unique_trace_ids)
-        logging.info(f"Removed {num_duplicate_ids} duplicate trace ids.")
+            # Remove potential duplicates because boto3 BatchGetTraces fails if
+            # a chunk contains duplicate trace IDs, which can be common with 10000s of trace ids.
+            unique_trace_ids = list(dict.fromkeys(trace_ids))
+            num_duplicate_ids = len(trace_ids) - len(unique_trace_ids)
+            logging.info(f"Removed {num_duplicate_ids} duplicate trace ids.")
 
-        unprocessed_ids = self.retrieve_traces(unique_trace_ids, trace_file)
+            unique_trace_ids = [id for id in unique_trace_ids if id not in downloaded_ids]
+            unprocessed_ids = self.retrieve_traces(unique_trace_ids, trace_file, mode)
         # Check and log for potential unprocessed trace ids
         if unprocessed_ids:
-            logging.warning(f"Found {len(unprocessed_ids)} unprocessed trace ids.")
-            unprocessed_ids_file = log_path.joinpath('unprocessed_trace_ids.txt')
+            logging.warning(f"Found {len(unprocessed_ids)} unprocessed trace ids. Re-run get_traces to retry them.")  # noqa: E501
             with open(unprocessed_ids_file, 'w') as f:
                 for id in unprocessed_ids:
                     f.write("%s\n" % id)
+        elif unprocessed_ids_file.exists():
+            # Previously unprocessed trace ids have been retrieved
+            unprocessed_ids_file.unlink()
 
         # Inform user
-        logging.info(f"Downloaded {len(trace_ids)} traces for invocations between \
+        logging.info(f"Downloaded {num_trace_ids} traces for invocations between \
 {start} and {end} into {trace_file}.")
 
     def retrieve_trace_ids(self, start, end, trace_ids_file):
-        """Retrieve and save trace ids from X-Ray.
-        Returns a list of trace ids."""
+        """Retrieve trace ids from X-Ray and save every trace id once.
+        Returns the list of all listed trace ids including duplicates."""
         # Configure trace summaries (ts) iterator using pagination
         paginator = self.client.get_paginator('get_trace_summaries')
         ts_iter = paginator.paginate(StartTime=start, EndTime=end)
 
-        # Save trace ids to file
+        # Save unique trace ids to file like stream_trace_ids
         trace_ids = []
+        seen = set()
         with open(trace_ids_file, 'w') as f:
             for trace_summary in ts_iter:
                 batch_trace_ids = extract_trace_ids(trace_summary)
                 trace_ids.extend(batch_trace_ids)
                 for trace_id in batch_trace_ids:
-                    f.write(f"{trace_id}\n")
+                    if trace_id not in seen:
+                        seen.add(trace_id)
+                        f.write(f"{trace_id}\n")
         return trace_ids
 
-    def retrieve_traces(self, unique_trace_ids, trace_file):
+    def stream_trace_ids(self, start, end, trace_ids_file):
+        """Lists the trace ids of `workers` time partitions of [start, end) in parallel and
+        yields every trace id once as soon as it is listed. Saves the unique trace ids
+        into trace_ids_file and counts the listed and duplicate trace ids in
+        num_listed_ids and num_duplicate_ids. The bounded page queue pauses the listing
+        if the consumer (e.g., retrieve_traces) falls behind."""
+        self.num_listed_ids = 0
+        self.num_duplicate_ids = 0
+        pages = queue.Queue(maxsize=TRACE_ID_QUEUE_SIZE)
+        stop = threading.Event()
+        limiter = AimdLimiter(self.workers)
+        partitions = partition_timespan(start, end, self.workers)
+        seen = set()
+        with open(trace_ids_file, 'w') as f, \
+             ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.list_trace_ids, partition_start, partition_end,
+                                       pages, stop, limiter)
+                       for partition_start, partition_end in partitions]
+            try:
+                num_done = 0
+                while num_done < len(futures):
+                    batch_trace_ids = pages.get()
+                    # Every partition signals its completion with None
+                    if batch_trace_ids is None:
+                        num_done += 1
+                        continue
+                    for trace_id in batch_trace_ids:
+                        self.num_listed_ids += 1
+                        if trace_id in seen:
+                            self.num_duplicate_ids += 1
+                            continue
+                        seen.add(trace_id)
+                        f.write(f"{trace_id}\n")
+                        yield trace_id
+                # Raise exceptions from the listing
+                for future in futures:
+                    future.result()
+            finally:
+                stop.set()
+
+    def list_trace_ids(self, start, end, pages, stop, limiter):
+        """Puts the trace ids of every GetTraceSummaries page within [start, end)
+        into the pages queue followed by None."""
+        try:
+            kwargs = {'StartTime': start, 'EndTime': end}
+            while not stop.is_set():
+                trace_summary = request_with_backoff(limiter, self.client.get_trace_summaries,
+                                                     **kwargs)
+                put_unless_stopped(pages, extract_trace_ids(trace_summary), stop)
+                if 'NextToken' not in trace_summary:
+                    break
+                kwargs['NextToken'] = trace_summary['NextToken']
+        finally:
+            put_unless_stopped(pages, None, stop)
+
+    def retrieve_traces(self, unique_trace_ids, trace_file, mode='w'):
         """Retrieve and save full trace details in chunks from X-Ray.
         Returns a list of unprocessed trace ids.
+        The mode 'a' appends to an existing trace file. Every chunk is written
+        as complete lines and flushed such that an interrupted download
+        can be resumed (see read_downloaded_trace_ids).
         Output format: Every line contains a single JSON-formatted trace.
         Example output of a single trace (partial data):
         {"Id": "1-60be2454-2cb82d1221d24201751ea2e3", "Duration": 9.315, "LimitExceeded": false, "Segments": [{"Id": "050793ca38bd8ff2", "Document": "{\"id\":\"050793ca38bd8ff2\",..."}]}  # noqa: E501
         """
+        if self.workers > 1:
+            return self.retrieve_traces_concurrently(unique_trace_ids, trace_file, mode)
         unprocessed_ids = []
-        with open(trace_file, 'w') as f:
-            for trace_ids_batch in chunks(unique_trace_ids, 5):
+        with open(trace_file, mode) as f:
+            for trace_ids_batch in chunks(unique_trace_ids, BATCH_GET_TRACES_SIZE):
                 paginator = self.client.get_paginator('batch_get_traces')
                 trace_iterator = paginator.paginate(TraceIds=trace_ids_batch)
                 for trace_batch in trace_iterator:
                     unprocessed_ids.extend(trace_batch['UnprocessedTraceIds'])
-                    for trace in trace_batch['Traces']:
-                        f.write(json.dumps(trace) + '\n')
+                    write_traces(f, trace_batch['Traces'], self.trace_sink)
         return unprocessed_ids
 
+    def retrieve_traces_concurrently(self, unique_trace_ids, trace_file, mode='w'):
+        """Retrieves the same traces as retrieve_traces with concurrent BatchGetTraces
+        requests in a thread pool and writes every trace as soon as its chunk completes.
+        Hence, the traces are written in completion order rather than trace id order.
+        Trace ids of chunks that remain throttled after MAX_THROTTLING_RETRIES
+        are returned as unprocessed trace ids."""
+        unprocessed_ids = []
+        limiter = AimdLimiter(self.workers)
+        trace_ids_batches = iter_chunks(unique_trace_ids, BATCH_GET_TRACES_SIZE)
+        with open(trace_file, mode) as f, \
+             ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set()
+            while True:
+                # Limit the number of pending chunks to bound memory
+                for trace_ids_batch in trace_ids_batches:
+                    pending.add(executor.submit(self.fetch_traces, trace_ids_batch, limiter))
+                    if len(pending) >= 2 * self.workers:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    traces, batch_unprocessed_ids = future.result()
+                    unprocessed_ids.extend(batch_unprocessed_ids)
+                    write_traces(f, traces, self.trace_sink)
+        if limiter.num_throttled > 0:
+            logging.info(f"Backed off {limiter.num_throttled} throttled BatchGetTraces requests.")  # noqa: E501
+        return unprocessed_ids
+
+    def fetch_traces(self, trace_ids_batch, limiter):
+        """Returns a tuple (traces, unprocessed_ids) for a chunk of trace ids
+        and retries throttled requests with exponential backoff.
+        If a page remains throttled, returns the traces of the previous pages
+        and the trace ids without a trace as unprocessed."""
+        traces = []
+        unprocessed_ids = []
+        kwargs = {'TraceIds': trace_ids_batch}
+        while True:
+            try:
+                trace_batch = request_with_backoff(limiter, self.client.batch_get_traces,
+                                                   **kwargs)
+            except ClientError as e:
+                if not is_throttling(e):
+                    raise
+                returned_ids = {trace['Id'] for trace in traces}.union(unprocessed_ids)
+                remaining_ids = [id for id in trace_ids_batch if id not in returned_ids]
+                logging.warning(f"Giving up on throttled trace ids {remaining_ids}.")
+                return traces, unprocessed_ids + remaining_ids
+            unprocessed_ids.extend(trace_batch['UnprocessedTraceIds'])
+            traces.extend(trace_batch['Traces'])
+            if 'NextToken' not in trace_batch:
+                return traces, unprocessed_ids
+            kwargs['NextToken'] = trace_batch['NextToken']
+
 
 def extract_trace_ids(trace_summaries):
     return [trace['Id'] for trace in trace_summaries['TraceSummaries']]
 
 
+def write_traces(f, traces, sink=None):
+    """Writes traces as complete JSON lines with a single write and flushes the file.
+    Passes the written lines to an optional sink."""
+    if traces:
+        lines = [json.dumps(trace) + '\n' for trace in traces]
+        f.write(''.join(lines))
+        f.flush()
+        if sink is not None:
+            sink(lines)
+
+
+def read_trace_ids(trace_ids_file) -> list:
+    with open(trace_ids_file) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def read_downloaded_trace_ids(trace_file) -> set:
+    """Returns the ids of all complete traces in a traces.json file.
+    Truncates a partial last line (e.g., from an interrupted download) such that
+    appending to the file continues with a complete line."""
+    trace_ids = set()
+    complete_size = 0
+    with open(trace_file, 'rb+') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            match = TRACE_ID_PATTERN.match(line)
+            trace_ids.add(match.group(1).decode() if match else loads(line)['Id'])
+            complete_size += len(line)
+        if complete_size < f.seek(0, os.SEEK_END):
+            logging.warning(f"Truncate partial trace at the end of {trace_file}.")
+            f.truncate(complete_size)
+    return trace_ids
+
+
 # Source: https://stackoverflow.com/a/312464/6875981
 def chunks(lst, n):
     """Yield successive n-sized chunks from lst."""
     return [lst[i:i + n] for i in range(0, len(lst), n)]
+
+
+def iter_chunks(iterable, n):
+    """Yields successive n-sized chunks from any iterable (e.g., a generator)."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, n))
+        if not chunk:
+            return
+        yield chunk
@@ -1,9 +1,16 @@
-import json
 from pathlib import Path
 from datetime import datetime
+from tempfile import TemporaryDirectory
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import csv
 import re
+import time
 from sb.aws_trace_analyzer import parse_trace_segments
+from sb.trace_decoder import loads
+from sb.analysis_profile import PROFILE_FILE, StageProfiler, profiling
+from sb.trace_correlator import CHILD, MAX_PENDING_TRACES, PARENT, TraceCorrelator, read_line
 import logging
 
 
@@ -14,6 +21,25 @@ SEARCH_ROOT_TRACE_ID = r'\\"root_trace_id\\":\\"(\d-[a-z0-9]{8}-[a-z0-9]{24})'
 SEARCH_ROOT_TRACE_ID_COMPILED = re.compile(SEARCH_ROOT_TRACE_ID)
 SEARCH_TRACE_ID = r'^{"Id":\s?"(\d-[a-z0-9]{8}-[a-z0-9]{24})"'
 SEARCH_TRACE_ID_COMPILED = re.compile(SEARCH_TRACE_ID)
+# Module-level functions timed as stages when profiling is enabled
+PROFILED_STAGES = [
+    'loads',
+    'parse_trace_segments',
+    'extract_root_trace_id',
+    'extract_trace_id',
+    'merge_and_analyze_traces',
+    'analyze_trace',
+    'search_subsegments_rec',
+    'extract_result'
+]
+# Every trigger job consists of JOB_FIELDS integers in the job array:
+# parent offset, parent length, child offset (-1 if no child), child length, and
+# the trace (REPORT_PARENT or REPORT_CHILD) whose trace id is reported if invalid.
+JOB_FIELDS = 5
+REPORT_PARENT = 0
+REPORT_CHILD = 1
+# Number of trigger jobs analyzed per task in the process pool
+JOB_BATCH_SIZE = 1000
 
 
 def extract_root_trace_id(trace_line) -> str:
@@ -53,9 +79,9 @@ def merge_and_analyze_traces(parent_line, child_line) -> dict():
     """Merges two disconnected traces into a single parsed trace document.
     Notice that the subsegments are already parsed unlike the traces from the API.
     """
-    parent_trace = json.loads(parent_line)
+    parent_trace = loads(parent_line)
     parent_segments = parse_trace_segments(parent_trace)
-    child_trace = json.loads(child_line)
+    child_trace = loads(child_line)
     child_segments = parse_trace_segments(child_trace)
 
     acc = dict()
@@ -74,7 +100,7 @@ def merge_and_analyze_traces(parent_line, child_line) -> dict():
 
 def analyze_trace(line) -> dict():
     """Analyzes a single trace line."""
-    trace = json.loads(line)
+    trace = loads(line)
     segments = parse_trace_segments(trace)
 
     acc = dict()
@@ -154,6 +180,72 @@ def is_coldstart(segment) -> bool:
     return False
 
 
+def index_trigger_traces(file, correlator) -> array:
+    """Correlates the parent and child traces of the file by their trace ids and
+    returns an array of trigger jobs (see JOB_FIELDS) in the order of analysis:
+    matched pairs in the order their match completes followed by
+    the parents without child (i.e., fully connected traces) in file order.
+    Only scans the trace ids and keeps byte offsets instead of raw lines."""
+    jobs = array('q')
+    offset = 0
+    with open(file, 'rb') as traces_json:
+        # Pending PARENT traces are indexed by their trace id and typically refer to
+        # the upstream trace of Function1. Pending CHILD traces are indexed by their
+        # parent trace id and typically refer to the downstream trace of Function2.
+        for raw_line in traces_json:
+            line_offset = offset
+            offset += len(raw_line)
+            line = raw_line.decode('utf-8')
+            root_trace_id = extract_root_trace_id(line)
+            if root_trace_id:  # child trace
+                parent = correlator.pop(PARENT, root_trace_id)
+                if parent is not None:
+                    jobs.extend((*parent, line_offset, len(raw_line), REPORT_CHILD))
+                else:
+                    correlator.add(CHILD, root_trace_id, line_offset, len(raw_line))
+            else:  # parent trace
+                trace_id = extract_trace_id(line)
+                child = correlator.pop(CHILD, trace_id)
+                if child is not None:
+                    jobs.extend((line_offset, len(raw_line), *child, REPORT_PARENT))
+                else:
+                    correlator.add(PARENT, trace_id, line_offset, len(raw_line))
+    # Analyze fully connected traces (i.e., no children found)
+    for parent in correlator.remaining(PARENT):
+        jobs.extend((*parent, -1, 0, REPORT_PARENT))
+    return jobs
+
+
+def analyze_trigger_jobs(file, jobs, profile=False):
+    """Analyzes an array of trigger jobs (see index_trigger_traces) by re-reading
+    the raw trace lines by offset from the file.
+    A matched parent and child are consumed even if the merge fails.
+    Runs in a separate worker process for parallel trigger analysis.
+    Returns a tuple with the list of triggers, the list of invalid [trace_id, message] rows,
+    and the profile (see StageProfiler.to_dict) or None if profile=False."""
+    profiler = StageProfiler() if profile else None
+    triggers = []
+    invalid_rows = []
+    with open(file, 'rb') as traces, profiling(profiler, __name__, PROFILED_STAGES):
+        for i in range(0, len(jobs), JOB_FIELDS):
+            parent_offset, parent_length, child_offset, child_length, report = jobs[i:i + JOB_FIELDS]  # noqa: E501
+            parent_line = read_line(traces, parent_offset, parent_length)
+            child_line = None
+            if child_offset >= 0:
+                child_line = read_line(traces, child_offset, child_length)
+            try:
+                if child_line is None:
+                    triggers.append(analyze_trace(parent_line))
+                else:
+                    triggers.append(merge_and_analyze_traces(parent_line, child_line))
+            except Exception as e:
+                line = child_line if report == REPORT_CHILD else parent_line
+                invalid_rows.append([extract_trace_id(line), str(e)])
+                if profiler is not None:
+                    profiler.count_invalid(e)
+    return triggers, invalid_rows, profiler.to_dict() if profile else None
+
+
 # TODO: Add unit tests. Suggested execution: 2022-04-01_01-11-31
 class AwsTraceTriggerAnalyzer:
     """Parses traces.json files downloaded by the AwsTraceDownloader:
@@ -166,30 +258,48 @@ class AwsTraceTriggerAnalyzer:
     asynchronously (e.g., S3). It further expects custom trace logs with
     timestamps following a specific trace model and custom trace annotations
     for correlating disconnected traces through a common `root_trace_id`.
+    Setting profile=True saves the time per analysis stage and the invalid traces
+    per exception site into analysis_profile.json (see sb.analysis_profile).
+    The analysis runs in two phases. First, a single pass over traces.json correlates
+    parent and child traces by their trace ids (see index_trigger_traces).
+    Unmatched parent and child traces are kept as byte offsets into traces.json and
+    spilled into a temporary on-disk index if more than max_pending traces of a kind
+    are pending (see sb.trace_correlator). Hence, traces.json can be larger than memory.
+    Second, the correlated traces are parsed and analyzed in batches
+    (see analyze_trigger_jobs). Setting workers > 1 analyzes the batches in a process pool.
+    The batch results are written in order and hence produce the same output as
+    the serial analysis.
     """
 
-    def __init__(self, log_path) -> None:
+    def __init__(self, log_path, profile=False, max_pending=MAX_PENDING_TRACES,
+                 workers=1) -> None:
         self.log_path = log_path
+        self.profile = profile
+        self.max_pending = max_pending
+        self.workers = workers
 
     def analyze_traces(self):
         file = Path(self.log_path)
         trigger_file = file.parent / 'trigger.csv'
         invalid_file = file.parent / 'trigger_invalid_traces.csv'
 
-        # Dictionary: trace_id (str) => parent trace payload (str)
-        # for caching unmatched parent traces. This typically refers to
-        # the upstream trace of Function1.
-        parents = dict()
-        # Dictionary: parent_trace_id (str) => child trace payload (str)
-        # for caching unmatched child traces index by the parent trace id.
-        # This typically refers to the downstream trace of Function2.
-        children = dict()
         num_valid_traces = 0
         num_invalid_traces = 0
-        with open(file, 'r') as traces_json, \
-             open(trigger_file, 'w') as traces_csv, \
+        profiler = StageProfiler() if self.profile else None
+        start_time = time.perf_counter()
+        # Phase 1: correlate traces by their trace ids
+        with TemporaryDirectory(dir=file.parent) as tmp_dir, \
+             TraceCorrelator(Path(tmp_dir) / 'pending.sqlite', self.max_pending) as correlator, \
+             profiling(profiler, __name__, PROFILED_STAGES):
+            jobs = index_trigger_traces(file, correlator)
+            num_unmatched = correlator.num_pending(CHILD)
+            if num_unmatched > 0:
+                logging.debug(f"Skip {num_unmatched} child traces without parent trace.")
+            if correlator.num_spilled > 0:
+                logging.debug(f"Spilled {correlator.num_spilled} pending traces to disk.")
+        # Phase 2: analyze the correlated traces in batches
+        with open(trigger_file, 'w') as traces_csv, \
              open(invalid_file, 'w') as invalid_csv:
-
             receiver_timestamps = [f"t{n+4}" for n in range(1, NUM_RECEIVER_TIMESTAMPS + 1)]
             trace_headers = ['root_trace_id', 'child_trace_id', 't1', 't2', 't3', 't4',
                              *receiver_timestamps,
@@ -197,51 +307,44 @@ class AwsTraceTriggerAnalyzer:
             trace_writer = csv.DictWriter(traces_csv, quoting=csv.QUOTE_MINIMAL,
                                           fieldnames=trace_headers)
             trace_writer.writeheader()
+            if profiler is not None:
+                trace_writer = profiler.writer(trace_writer)
             invalid_writer = csv.writer(invalid_csv, quoting=csv.QUOTE_MINIMAL)
             invalid_headers = ['trace_id', 'message']
             invalid_writer.writerow(invalid_headers)
-            for line in traces_json:
-                try:
-                    root_trace_id = extract_root_trace_id(line)
-                    if root_trace_id:  # child trace
-                        if root_trace_id in parents:
-                            # logging.debug('Found matching parent for this child trace.')
-                            trigger = merge_and_analyze_traces(parents[root_trace_id], line)
-                            trace_writer.writerow(trigger)
-                            num_valid_traces += 1
-                            del parents[root_trace_id]
-                        else:
-                            children[root_trace_id] = line
-                    else:  # parent trace
-                        trace_id = extract_trace_id(line)
-                        if trace_id in children:
-                            # logging.debug('Found matching child for this parent trace.')
-                            trigger = merge_and_analyze_traces(line, children[trace_id])
-                            trace_writer.writerow(trigger)
-                            num_valid_traces += 1
-                            del children[trace_id]
-                        else:
-                            parents[trace_id] = line
-                except Exception as e:
-                    trace_id = extract_trace_id(line)
-                    message = str(e)
-                    invalid_writer.writerow([trace_id, message])
-                    num_invalid_traces += 1
-
-            # Analyze fully connected traces (i.e., no children found)
-            if len(parents) > 0:
-                for trace_line in parents.values():
-                    try:
-                        trigger = analyze_trace(trace_line)
-                        trace_writer.writerow(trigger)
-                        num_valid_traces += 1
-                    except Exception as e:
-                        trace_id = extract_trace_id(line)
-                        message = str(e)
-                        invalid_writer.writerow([trace_id, message])
-                        num_invalid_traces += 1
+            batch_length = JOB_BATCH_SIZE * JOB_FIELDS
+            batches = (jobs[i:i + batch_length] for i in range(0, len(jobs), batch_length))
+            if self.workers > 1:
+                results = self.analyze_batches(file, batches)
+            else:
+                results = (analyze_trigger_jobs(file, batch, self.profile) for batch in batches)
+            for triggers, invalid_rows, batch_profile in results:
+                for trigger in triggers:
+                    trace_writer.writerow(trigger)
+                invalid_writer.writerows(invalid_rows)
+                num_valid_traces += len(triggers)
+                num_invalid_traces += len(invalid_rows)
+                if profiler is not None:
+                    profiler.merge(batch_profile)
+        if profiler is not None:
+            profile_file = file.parent / PROFILE_FILE
+            profiler.save(profile_file, type(self).__name__, time.perf_counter() - start_time,
+                          num_valid_traces, num_invalid_traces)
+            logging.info(f"Saved analysis profile to {profile_file}.")
 
         logging.info(f"Analyzed {num_valid_traces} valid trigger traces. Written to {trigger_file}.")  # noqa: E501
         if num_invalid_traces > 0:
             invalid_rate = round(num_invalid_traces / (num_valid_traces + num_invalid_traces) * 100, 2)  # noqa: E501
             logging.warning(f"Detected {num_invalid_traces} ({invalid_rate}%) invalid traces. Written to {invalid_file}.")  # noqa: E501
+
+    def analyze_batches(self, file, batches):
+        """Analyzes batches of trigger jobs in a process pool and yields
+        the results in batch order while limiting the number of pending batches."""
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = deque()
+            for batch in batches:
+                futures.append(executor.submit(analyze_trigger_jobs, file, batch, self.profile))
+                if len(futures) >= 2 * self.workers:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
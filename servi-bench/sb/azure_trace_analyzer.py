@@ -1,13 +1,40 @@
+from datetime import datetime, timezone
+from itertools import islice
 import logging
-import json
 from pathlib import Path
 import csv
+import time
+import numpy as np
 import pandas as pd
+from sb.aws_trace_analyzer import BREAKDOWN_FIELDS, TIME_CATEGORIES, TIMESTAMP_MARGIN_US, td
 from sb.azure_trace_downloader import convert_insights_json_to_df
+from sb.breakdown_sketches import SKETCHES_FILE, BreakdownSketches
+from sb.critical_path_algorithm_async import Span, critical_path_iterative
+from sb.trace_decoder import loads
+from sb.trace_paths import PATHS_FILE, TracePaths, path_signature
+from sb.analysis_profile import PROFILE_FILE, StageProfiler, profiling
 
 
 # Number of additional timestamps in Function2
 NUM_RECEIVER_TIMESTAMPS = 5
+# Number of traces concatenated into one data frame in batch mode
+TRACE_BATCH_SIZE = 1000
+# Module-level functions timed as stages when profiling is enabled
+PROFILED_STAGES = [
+    'loads',
+    'convert_insights_json_to_df',
+    'extract_trigger_results',
+    'concat_insights_traces',
+    'extract_trigger_results_batch',
+    'parse_insights_spans',
+    'critical_path_iterative',
+    'critical_path_categories'
+]
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Span types (i.e., itemType) of Azure Insights rows forming the span tree
+SPAN_ITEM_TYPES = {'request', 'dependency'}
+# Dependency types executed within the function process
+IN_PROCESS_TYPES = {'InProc'}
 
 
 def extract_trigger_results(trace) -> dict:
@@ -61,15 +88,163 @@ def extract_trigger_results(trace) -> dict:
     return result
 
 
+def is_batchable(trace, columns) -> bool:
+    """Returns True if the vectorized batch extraction is equivalent to
+    extract_trigger_results for a decoded trace with the given table columns."""
+    if not isinstance(trace, dict) or 'error' in trace:
+        return False
+    attrs = trace.get('attrs', dict())
+    return isinstance(attrs.get('rootTraceId'), str) and isinstance(attrs.get('traceId'), str) \
+        and [x['name'] for x in trace['tables'][0]['columns']] == columns
+
+
+def concat_insights_traces(traces, columns) -> pd.DataFrame:
+    """Concatenates the rows of many Azure Insights JSON responses into one data frame.
+    Every row is tagged with the position of its trace within the list of traces
+    ('trace_index') and the trace attributes 'rootTraceId' and 'traceId'.
+    Skips traces that are None."""
+    rows = []
+    trace_index = []
+    root_trace_ids = []
+    trace_ids = []
+    for index, trace in enumerate(traces):
+        if trace is None:
+            continue
+        trace_rows = trace['tables'][0]['rows']
+        rows.extend(trace_rows)
+        trace_index.extend([index] * len(trace_rows))
+        root_trace_ids.extend([trace['attrs']['rootTraceId']] * len(trace_rows))
+        trace_ids.extend([trace['attrs']['traceId']] * len(trace_rows))
+    batch = pd.DataFrame(rows, columns=columns)
+    batch['trace_index'] = np.array(trace_index, dtype=np.int64)
+    batch['rootTraceId'] = root_trace_ids
+    batch['traceId'] = trace_ids
+    return batch
+
+
+def count_per_trace(trace_index, mask, num_traces) -> np.ndarray:
+    """Returns the number of rows per trace that match a boolean row mask."""
+    return np.bincount(trace_index[mask], minlength=num_traces)
+
+
+def non_string_values(column) -> np.ndarray:
+    """Returns a boolean row mask of values that are neither strings nor missing."""
+    if column.dtype != object:
+        return np.zeros(len(column), dtype=bool)
+    return column.map(lambda x: not (isinstance(x, str) or pd.isna(x))).to_numpy(dtype=bool)
+
+
+def parse_insights_timestamps(timestamps) -> pd.DatetimeIndex:
+    """Parses Azure Insights timestamps with a variable sub-second precision
+    (e.g., 2022-02-03T10:11:12Z or 2022-02-03T10:11:12.1234567Z) into UTC datetimes
+    identical to pd.to_datetime of every single timestamp.
+    Splits the fraction because format='ISO8601' requires pandas 2."""
+    values = pd.Series(timestamps, dtype=object).str.rstrip('Z')
+    if len(values) == 0:
+        return pd.DatetimeIndex([], tz='UTC')
+    parts = values.str.split('.', n=1, expand=True)
+    seconds = pd.to_datetime(parts[0], format='%Y-%m-%dT%H:%M:%S', utc=True)
+    fraction = parts[1].fillna('') if 1 in parts.columns else pd.Series('', index=parts.index)
+    nanoseconds = fraction.str.ljust(9, '0').str[:9].astype(np.int64)
+    return pd.DatetimeIndex(seconds + pd.to_timedelta(nanoseconds.to_numpy(), unit='ns'))
+
+
+def extract_trigger_results_batch(batch, num_traces) -> list:
+    """Returns a list with the trigger results dictionary of every trace in a batch
+    as computed by extract_trigger_results or None for traces that the batch cannot
+    represent identically (e.g., invalid traces with missing or duplicate receivers).
+    Parameters:
+    * batch: Pandas data frame with the rows of many Azure Insight tables
+          tagged with 'trace_index', 'rootTraceId', and 'traceId'
+          (see concat_insights_traces)
+    * num_traces: number of traces in the batch
+    Process:
+    1) Count the rows matching the filters of extract_trigger_results per trace
+       to flag traces where .item() would fail
+    2) Compute the timestamps and coldstarts of all remaining traces at once
+    """
+    trace_index = batch['trace_index'].to_numpy()
+    item_type = batch['itemType']
+    name = batch['name']
+    custom_dimensions = batch['customDimensions']
+    valid = np.ones(num_traces, dtype=bool)
+    # The .str accessor of a single trace fails for columns without any string values
+    for column in [name, custom_dimensions]:
+        valid &= count_per_trace(trace_index, column.notna().to_numpy(), num_traces) > 0
+        valid &= count_per_trace(trace_index, non_string_values(column), num_traces) == 0
+    is_dependency = (item_type == 'dependency').to_numpy(dtype=bool)
+    is_request = (item_type == 'request').to_numpy(dtype=bool)
+    selections = {
+        't2': is_dependency & name.str.endswith('_trigger', na=False).to_numpy(dtype=bool),
+        't3': is_request & name.str.endswith('Trigger', na=False).to_numpy(dtype=bool),
+    }
+    for n in range(0, NUM_RECEIVER_TIMESTAMPS + 1):
+        selections[f"t{n+4}"] = is_dependency & (name == f"receiver{n}").to_numpy(dtype=bool)
+    for selection in selections.values():
+        valid &= count_per_trace(trace_index, selection, num_traces) == 1
+    duration = batch['duration']
+    if not pd.api.types.is_numeric_dtype(duration):
+        return [None] * num_traces
+    # Missing durations yield NaT rather than an exception in extract_trigger_results
+    valid &= count_per_trace(trace_index, selections['t2'] & duration.isna().to_numpy(), num_traces) == 0  # noqa: E501
+
+    # Every valid trace has exactly one selected row in trace order
+    valid_rows = valid[trace_index]
+    timestamp = batch['timestamp'].to_numpy()
+    result_columns = dict()
+    for column, selection in selections.items():
+        result_columns[column] = parse_insights_timestamps(timestamp[selection & valid_rows])
+    # duration is in milliseconds (ms), truncated to nanoseconds like pd.Timedelta(microseconds=...)
+    service_call = selections['t2'] & valid_rows
+    duration_ns = (duration.to_numpy()[service_call] * 1000 * 1000).astype(np.int64)
+    result_columns['t1'] = result_columns['t2'] - pd.to_timedelta(duration_ns, unit='ns')
+    result_columns['t3'] = result_columns['t3'].floor('ms')
+
+    # Identify cold starts
+    is_trace = (item_type == 'trace').to_numpy(dtype=bool)
+    coldstart = is_trace & custom_dimensions.str.contains('ColdStart', na=False).to_numpy(dtype=bool)  # noqa: E501
+    operation_id = batch['operation_Id']
+    coldstart_f1 = count_per_trace(trace_index, coldstart & (operation_id == batch['rootTraceId']).to_numpy(dtype=bool), num_traces) > 0  # noqa: E501
+    coldstart_f2 = count_per_trace(trace_index, coldstart & (operation_id == batch['traceId']).to_numpy(dtype=bool), num_traces) > 0  # noqa: E501
+
+    root_trace_ids = batch['rootTraceId'].to_numpy()[service_call]
+    trace_ids = batch['traceId'].to_numpy()[service_call]
+    timestamps = {column: result_columns[column].tolist()
+                  for column in ['t1', 't2', 't3', 't4',
+                                 *[f"t{n+4}" for n in range(1, NUM_RECEIVER_TIMESTAMPS + 1)]]}
+    results = [None] * num_traces
+    for i, index in enumerate(np.flatnonzero(valid)):
+        result = {
+            'root_trace_id': root_trace_ids[i],
+            'child_trace_id': trace_ids[i],
+        }
+        for column, values in timestamps.items():
+            result[column] = values[i]
+        result['coldstart_f1'] = bool(coldstart_f1[index])
+        result['coldstart_f2'] = bool(coldstart_f2[index])
+        results[index] = result
+    return results
+
+
 # TODO: Unify naming with AWS trigger => clarify that for TriggerBench
 class AzureTraceTriggerAnalyzer:
     """Parses traces.json files downloaded by the AzureTraceDownloader:
     1) Saves a trigger results summary into `trigger.csv`
-    Limitation: A generic breakdown analyzer is currently not implemented.
+    Setting profile=True saves the time per analysis stage and the invalid traces
+    per exception site into analysis_profile.json (see sb.analysis_profile).
+    Setting batch=True concatenates the rows of TRACE_BATCH_SIZE traces into one data frame
+    and extracts their trigger results with vectorized operations instead of building a
+    data frame per trace. Traces that the batch cannot represent identically (e.g., invalid
+    traces) fall back to the per-trace extraction such that `trigger.csv` is identical.
+    See AzureTraceAnalyzer for the generic latency breakdown.
     """
 
-    def __init__(self, log_path) -> None:
+    def __init__(self, log_path, profile=False, batch=False) -> None:
         self.log_path = log_path
+        self.profile = profile
+        self.batch = batch
+        # Number of traces extracted one by one because their batch failed
+        self.num_fallback_traces = 0
 
     def analyze_traces(self):
         file = Path(self.log_path)
@@ -79,9 +254,12 @@ class AzureTraceTriggerAnalyzer:
 
         num_valid_traces = 0
         num_invalid_traces = 0
+        profiler = StageProfiler() if self.profile else None
+        start_time = time.perf_counter()
         with open(file, 'r') as traces_json, \
              open(trigger_file, 'w') as trigger_csv, \
-             open(invalid_file, 'w') as invalid_csv:
+             open(invalid_file, 'w') as invalid_csv, \
+             profiling(profiler, __name__, PROFILED_STAGES):
             receiver_timestamps = [f"t{n+4}" for n in range(1, NUM_RECEIVER_TIMESTAMPS + 1)]
             trace_headers = ['root_trace_id', 'child_trace_id', 't1', 't2', 't3', 't4',
                              *receiver_timestamps,
@@ -89,27 +267,399 @@ class AzureTraceTriggerAnalyzer:
             trace_writer = csv.DictWriter(trigger_csv, quoting=csv.QUOTE_MINIMAL,
                                           fieldnames=trace_headers)
             trace_writer.writeheader()
+            if profiler is not None:
+                trace_writer = profiler.writer(trace_writer)
             invalid_writer = csv.writer(invalid_csv, quoting=csv.QUOTE_MINIMAL)
             invalid_headers = ['root_trace_id', 'receiver_trace_id', 'message']
             invalid_writer.writerow(invalid_headers)
-            for index, line in enumerate(traces_json):
-                try:
-                    trace = json.loads(line)
-                    df = convert_insights_json_to_df(trace)
-                    # Export csv version of df (without attrs) for debugging
-                    # DEBUG: Write to CSV for easier inspection
-                    # trace_raw_file = file.parent / f"trace_{index}.csv"
-                    # df.to_csv(trace_raw_file, index=False)
-                    # Export trigger results
-                    trigger_results = extract_trigger_results(df)
+            extract_lines = self.extract_batches if self.batch else self.extract_traces
+            for trace, trigger_results, e in extract_lines(traces_json):
+                if e is None:
                     trace_writer.writerow(trigger_results)
                     num_valid_traces += 1
-                except Exception as e:
+                else:
                     invalid_row = [trace['attrs'].get('rootTraceId'), trace['attrs'].get('traceId'), str(e)]  # noqa: E501
                     invalid_writer.writerow(invalid_row)
                     num_invalid_traces += 1
+                    if profiler is not None:
+                        profiler.count_invalid(e)
+        if profiler is not None:
+            profile_file = file.parent / PROFILE_FILE
+            profiler.save(profile_file, type(self).__name__, time.perf_counter() - start_time,
+                          num_valid_traces, num_invalid_traces)
+            logging.info(f"Saved analysis profile to {profile_file}.")
 
         logging.info(f"Analyzed {num_valid_traces} valid trigger traces. Written to {trigger_file}.")  # noqa: E501
+        if self.num_fallback_traces > 0:
+            logging.warning(f"Extracted {self.num_fallback_traces} traces one by one because their batch failed.")  # noqa: E501
+        if num_invalid_traces > 0:
+            invalid_rate = round(num_invalid_traces / (num_valid_traces + num_invalid_traces) * 100, 2)  # noqa: E501
+            logging.warning(f"Detected {num_invalid_traces} ({invalid_rate}%) invalid traces. Written to {invalid_file}.")  # noqa: E501
+
+    def extract_traces(self, lines):
+        """Yields a tuple (trace, trigger_results, exception) for every trace line
+        where either the trigger results or the exception are None."""
+        trace = None
+        for index, line in enumerate(lines):
+            try:
+                trace = loads(line)
+                df = convert_insights_json_to_df(trace)
+                # Export csv version of df (without attrs) for debugging
+                # DEBUG: Write to CSV for easier inspection
+                # trace_raw_file = file.parent / f"trace_{index}.csv"
+                # df.to_csv(trace_raw_file, index=False)
+                # Export trigger results
+                yield trace, extract_trigger_results(df), None
+            except Exception as e:
+                yield trace, None, e
+
+    def extract_batches(self, lines):
+        """Yields the same tuples as extract_traces but extracts the
+        trigger results of TRACE_BATCH_SIZE traces at once."""
+        trace = None
+        while True:
+            batch_lines = list(islice(lines, TRACE_BATCH_SIZE))
+            if not batch_lines:
+                return
+            # List of (trace, exception) tuples in line order
+            entries = []
+            for line in batch_lines:
+                try:
+                    trace = loads(line)
+                    entries.append((trace, None))
+                except Exception as e:
+                    entries.append((trace, e))
+            # The batch uses the columns of the first trace
+            columns = next(([x['name'] for x in t['tables'][0]['columns']]
+                            for t, e in entries
+                            if e is None and isinstance(t, dict) and 'tables' in t), None)
+            try:
+                traces = [t if e is None and is_batchable(t, columns) else None
+                          for t, e in entries]
+                batch = concat_insights_traces(traces, columns)
+                results = extract_trigger_results_batch(batch, len(traces))
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                # Unexpected data (e.g., malformed rows): extract all traces one by one
+                logging.debug(f"Extract batch of {len(entries)} traces one by one. {e}")
+                self.num_fallback_traces += len(entries)
+                results = [None] * len(entries)
+            for (trace, e), trigger_results in zip(entries, results):
+                if e is not None:
+                    yield trace, None, e
+                elif trigger_results is not None:
+                    yield trace, trigger_results, None
+                else:
+                    try:
+                        df = convert_insights_json_to_df(trace)
+                        yield trace, extract_trigger_results(df), None
+                    except Exception as e:
+                        yield trace, None, e
+
+
+def timestamp_us(value) -> int:
+    """Returns the epoch microseconds of an Azure Insights timestamp in UTC
+    (e.g., 2022-02-03T10:11:12.1234567Z) truncated to microsecond precision."""
+    date_time, _, fraction = value.rstrip('Z').partition('.')
+    seconds = datetime.strptime(date_time, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    return (seconds - EPOCH) // td(1) + int(fraction[:6].ljust(6, '0'))
+
+
+def result_code(value):
+    """Returns the integer result code or None for empty or non-numeric codes."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class InsightsSpan(Span):
+    """Span of an Azure Insights request or dependency with timestamps in epoch µs.
+    For both requests and dependencies, the timestamp marks the start of the span
+    and the duration is in milliseconds (ms)."""
+
+    def __init__(self, row, columns) -> None:
+        start_time = timestamp_us(row[columns['timestamp']])
+        super().__init__(start_time, start_time + round(row[columns['duration']] * 1000), [])
+        self.id = row[columns['id']]
+        self.parent_id = row[columns['operation_ParentId']]
+        self.name = row[columns['name']]
+        self.item_type = row[columns['itemType']]
+        self.type = column_value(row, columns, 'type')
+        self.result_code = result_code(column_value(row, columns, 'resultCode'))
+        self.url = column_value(row, columns, 'url')
+        # Dependency type (e.g., HTTP or Azure blob) or the function app of requests
+        if self.item_type == 'dependency':
+            self.service = self.type
+        else:
+            self.service = column_value(row, columns, 'cloud_RoleName')
+        self.parent = None
+        self.depth = 0
+
+    # Identity instead of comparing timestamps and child spans because
+    # different spans can have the same timestamps in fine-grained traces
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+    def isAsync(self, next):
+        """Uses the same margin as the AWS analysis for timestamps with ms precision."""
+        return self.endTime - next.endTime + TIMESTAMP_MARGIN_US < 0
+
+
+def column_value(row, columns, name):
+    """Returns the value of an optional column or None if the column is missing."""
+    index = columns.get(name)
+    return None if index is None else row[index]
+
+
+def parse_insights_spans(trace) -> tuple:
+    """Returns a tuple (spans, coldstart_parents) for an Azure Insights JSON response
+    without building a data frame.
+    * spans: list of InsightsSpan for all requests and dependencies in row order
+    * coldstart_parents: set of span ids with a ColdStart trace (i.e., log) entry
+    """
+    if 'error' in trace:
+        raise Exception(f"Error in Azure Insights response. {trace['error'].get('message')}.")
+    table = trace['tables'][0]
+    columns = {column['name']: index for index, column in enumerate(table['columns'])}
+    item_type_index = columns['itemType']
+    spans = []
+    coldstart_parents = set()
+    for row in table['rows']:
+        item_type = row[item_type_index]
+        if item_type in SPAN_ITEM_TYPES:
+            spans.append(InsightsSpan(row, columns))
+        elif item_type == 'trace' and 'ColdStart' in (column_value(row, columns, 'customDimensions') or ''):  # noqa: E501
+            coldstart_parents.add(row[columns['operation_ParentId']])
+    return spans, coldstart_parents
+
+
+def link_spans(spans):
+    """Links the spans through their operation_ParentId and returns the root span.
+    Raises an exception unless the spans form a single tree."""
+    if not spans:
+        raise Exception('Trace contains no requests or dependencies.')
+    spans_by_id = dict()
+    for span in spans:
+        if span.id in spans_by_id:
+            raise Exception(f"Duplicate span id {span.id}.")
+        spans_by_id[span.id] = span
+    roots = []
+    for span in spans:
+        parent = spans_by_id.get(span.parent_id)
+        if parent is None or parent is span:
+            roots.append(span)
+        else:
+            span.parent = parent
+            parent.childSpans.append(span)
+    if len(roots) != 1:
+        msg = (
+            f"Found {len(roots)} root spans {[root.id for root in roots]}."
+            ' Ensure that the trace is fully connected.'
+        )
+        raise Exception(msg)
+    # Assign depths top-down and detect cycles
+    root = roots[0]
+    stack = [root]
+    num_visited = 0
+    while stack:
+        span = stack.pop()
+        num_visited += 1
+        for child in span.childSpans:
+            child.depth = span.depth + 1
+            stack.append(child)
+    if num_visited != len(spans):
+        raise Exception(f"Trace contains {len(spans) - num_visited} spans in a cycle.")
+    return root
+
+
+def span_category(span, next_span) -> str:
+    """Returns the time category of a span on the critical path given the next span."""
+    if span.item_type == 'request' or span.type in IN_PROCESS_TYPES:
+        return 'computation'
+    # Dependencies that invoke another function (e.g., HTTP or queue trigger)
+    if (next_span is not None and next_span.parent is span and next_span.item_type == 'request') \
+            or span.name.endswith('_trigger'):
+        return 'trigger'
+    return 'external_service'
+
+
+def critical_path_categories(path, start_time, end_time) -> dict:
+    """Sums up the time categories in integer microseconds by attributing every instant
+    between the trace start and end time to the deepest active span of the critical path.
+    Gaps without an active span count as trigger time if the next span is a request
+    (e.g., queuing of an asynchronous trigger) and as unclassified otherwise."""
+    categories = {'unclassified': 0}
+    next_spans = {span: next_span for span, next_span in zip(path, path[1:] + [None])}
+    boundaries = {start_time, end_time}
+    for span in path:
+        boundaries.add(min(max(span.startTime, start_time), end_time))
+        boundaries.add(min(max(span.endTime, start_time), end_time))
+    boundaries = sorted(boundaries)
+    for begin, end in zip(boundaries, boundaries[1:]):
+        active = None
+        for span in path:
+            if span.startTime <= begin and span.endTime >= end and \
+                    (active is None or span.depth >= active.depth):
+                active = span
+        if active is not None:
+            category = span_category(active, next_spans[active])
+        else:
+            next_span = next((span for span in path if span.startTime >= end), None)
+            is_trigger = next_span is not None and next_span.item_type == 'request'
+            category = 'trigger' if is_trigger else 'unclassified'
+        categories[category] = categories.get(category, 0) + end - begin
+    return categories
+
+
+def analyze_insights_trace(trace) -> dict:
+    """Returns the trace breakdown of an Azure Insights JSON response as dictionary
+    with the fields of the AWS trace breakdown (see BREAKDOWN_FIELDS) and longest_path_names.
+    Time categories are in integer microseconds."""
+    spans, coldstart_parents = parse_insights_spans(trace)
+    root = link_spans(spans)
+    start = min(spans, key=lambda span: span.startTime)
+    end = max(spans, key=lambda span: span.endTime)
+    if root.startTime - start.startTime > TIMESTAMP_MARGIN_US:
+        msg = (
+            f"Root span {root.id} does not match the earliest span {start.id}."
+            ' Ensure that the trace is fully connected and there are no clock issues.'
+        )
+        raise Exception(msg)
+    start_time = min(root.startTime, start.startTime)
+    end_time = end.endTime
+    # Stack with all parents of the span with the latest end time (root on top)
+    call_stack = []
+    span = end
+    while span is not None:
+        call_stack.append(span)
+        span = span.parent
+    path = critical_path_iterative(call_stack, root)
+    # The critical path pops every span of the call stack that it follows
+    if call_stack:
+        msg = f"Span with latest end time ({end.id}) is not on the critical path ending with {path[-1].id}."  # noqa: E501
+        raise Exception(msg)
+    breakdown = {
+        'trace_id': insights_trace_id(trace),
+        'start_time': start_time / 1e6,
+        'end_time': end_time / 1e6,
+        'duration': td(end_time - start_time),
+        'duration_us': end_time - start_time,
+        'url': root.url,
+        'num_cold_starts': sum(1 for span in path if span.id in coldstart_parents),
+        'errors': sum(1 for span in spans if span.result_code is not None and 400 <= span.result_code < 500),  # noqa: E501
+        'throttles': sum(1 for span in spans if span.result_code == 429),
+        'faults': sum(1 for span in spans if span.result_code is not None and span.result_code >= 500),  # noqa: E501
+        'services': [span.service for span in spans if span.service],
+        'longest_path_names': [span.name for span in path],
+    }
+    breakdown['path_id'] = path_signature(tuple(breakdown['longest_path_names']))
+    breakdown.update(critical_path_categories(path, start_time, end_time))
+    return breakdown
+
+
+def insights_trace_id(trace):
+    """Returns the rootTraceId attribute added by the AzureTraceDownloader or
+    the operation_Id of the first row or None if unavailable."""
+    if not isinstance(trace, dict):
+        return None
+    if 'rootTraceId' in trace.get('attrs', dict()):
+        return trace['attrs']['rootTraceId']
+    try:
+        table = trace['tables'][0]
+        names = [column['name'] for column in table['columns']]
+        return table['rows'][0][names.index('operation_Id')]
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def insights_breakdown_row(breakdown) -> list:
+    """Returns the values of the BREAKDOWN_FIELDS with time categories as timedelta."""
+    row = []
+    for field in BREAKDOWN_FIELDS:
+        value = breakdown.get(field, None)
+        if value is not None and field in TIME_CATEGORIES:
+            value = td(value)
+        row.append(value)
+    return row
+
+
+class AzureTraceAnalyzer:
+    """Parses traces.json files with one Azure Insights JSON response per line
+    (e.g., downloaded by the AzureTraceDownloader) into a latency breakdown:
+    1) Saves a trace summary with the same columns as the AwsTraceAnalyzer
+       into trace_breakdown.csv
+    2) Saves a log of invalid trace into invalid_traces.csv
+    3) Saves quantile sketches of the duration and time categories per url and
+       cold/warm status into breakdown_sketches.json (see sb.breakdown_sketches)
+    4) Saves the span names of the longest path per path_id of the trace summary
+       into the path dictionary trace_paths.json (see sb.trace_paths)
+    The requests and dependencies of a trace form a span tree through their id and
+    operation_ParentId. The critical path follows the async-aware algorithm from
+    sb.critical_path_algorithm_async. Every trace is processed from its plain JSON rows
+    without building a data frame such that large Insights exports can be streamed.
+    Setting profile=True saves the time per analysis stage and the invalid traces
+    per exception site into analysis_profile.json (see sb.analysis_profile).
+    Limitation: Azure Insights does not report initialization spans. Hence, cold starts
+    are only counted for requests with a ColdStart trace entry and the initialization
+    time categories remain empty.
+    """
+
+    def __init__(self, log_path, profile=False) -> None:
+        self.log_path = log_path
+        self.profile = profile
+
+    def analyze_traces(self):
+        file = Path(self.log_path)
+        breakdown_file = file.parent / 'trace_breakdown.csv'
+        invalid_file = file.parent / 'invalid_traces.csv'
+        sketches_file = file.parent / SKETCHES_FILE
+        path_dictionary_file = file.parent / PATHS_FILE
+
+        num_valid_traces = 0
+        num_invalid_traces = 0
+        sketches = BreakdownSketches()
+        trace_paths = TracePaths()
+        profiler = StageProfiler() if self.profile else None
+        start_time = time.perf_counter()
+        with open(file, 'r') as traces_json, \
+             open(breakdown_file, 'w') as breakdown_csv, \
+             open(invalid_file, 'w') as invalid_csv, \
+             profiling(profiler, __name__, PROFILED_STAGES):
+            trace_writer = csv.writer(breakdown_csv, quoting=csv.QUOTE_MINIMAL)
+            trace_writer.writerow(BREAKDOWN_FIELDS)
+            if profiler is not None:
+                trace_writer = profiler.writer(trace_writer)
+            invalid_writer = csv.writer(invalid_csv, quoting=csv.QUOTE_MINIMAL)
+            invalid_writer.writerow(['trace_id', 'message'])
+            for line in traces_json:
+                trace = None
+                try:
+                    trace = loads(line)
+                    breakdown = analyze_insights_trace(trace)
+                    trace_writer.writerow(insights_breakdown_row(breakdown))
+                    values = {'duration': breakdown['duration_us']}
+                    for category in TIME_CATEGORIES:
+                        values[category] = breakdown.get(category) or 0
+                    sketches.add(breakdown['url'], breakdown['num_cold_starts'] > 0, values)
+                    trace_paths.add(breakdown['path_id'], breakdown['longest_path_names'])
+                    num_valid_traces += 1
+                except Exception as e:
+                    trace_id = insights_trace_id(trace)
+                    message = str(e)
+                    invalid_writer.writerow([trace_id, message])
+                    logging.debug(f"Skip invalid trace {trace_id}. {message}")
+                    num_invalid_traces += 1
+                    if profiler is not None:
+                        profiler.count_invalid(e)
+        sketches.save(sketches_file)
+        trace_paths.save(path_dictionary_file)
+        if profiler is not None:
+            profile_file = file.parent / PROFILE_FILE
+            profiler.save(profile_file, type(self).__name__, time.perf_counter() - start_time,
+                          num_valid_traces, num_invalid_traces)
+            logging.info(f"Saved analysis profile to {profile_file}.")
+
+        logging.info(f"Analyzed {num_valid_traces} valid traces. Written to {breakdown_file}.")
         if num_invalid_traces > 0:
             invalid_rate = round(num_invalid_traces / (num_valid_traces + num_invalid_traces) * 100, 2)  # noqa: E501
             logging.warning(f"Detected {num_invalid_traces} ({invalid_rate}%) invalid traces. Written to {invalid_file}.")  # noqa: E501
@@ -1,12 +1,35 @@
 import logging
-from datetime import datetime, timezone
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import json
+import random
+import threading
+import time
 import requests
 from requests.adapters import HTTPAdapter, Retry
 import pandas as pd
 import os
 from dotenv import load_dotenv
 
+# Tables with the telemetry of a trace (see AzureTraceDownloader.get_traces)
+TRACE_TABLES = ['traces', 'requests', 'dependencies']
+# Duration of the time slices fetched per table in bulk mode
+BULK_SLICE_DURATION = timedelta(minutes=10)
+# Maximum number of rows returned by an Azure Insights query. Time slices
+# reaching this limit are split because their results might be truncated:
+# https://docs.microsoft.com/en-us/azure/azure-monitor/service-limits#log-queries-and-language
+BULK_ROW_LIMIT = 500_000
+# Error code of responses with truncated results, which are also split
+PARTIAL_ERROR_CODE = 'PartialError'
+# Base URL of the Azure Application Insights API
+API_URL = 'https://api.applicationinsights.io/v1'
+# Retries of a throttled query (HTTP 429) before returning the error response
+MAX_THROTTLING_RETRIES = 8
+# Seconds of the exponential backoff for throttled queries without Retry-After header
+BACKOFF_BASE = 0.5
+MAX_BACKOFF = 30
+
 
 def convert_insights_json_to_df(json_data) -> pd.DataFrame:
     """Converts a JSON response from Azure Insights into a Pandas data frame.
@@ -24,6 +47,108 @@ def convert_insights_json_to_df(json_data) -> pd.DataFrame:
     return df
 
 
+def create_session(pool_size) -> requests.Session:
+    """Returns a session that keeps up to pool_size connections alive for concurrent queries
+    and retries connection errors and server errors."""
+    # Configure retry strategy to mitigate errors such as
+    # ConnectionResetError > ConnectionError:
+    # https://findwork.dev/blog/advanced-usage-python-requests-timeouts-retries-hooks/#retry-on-failure
+    # See new API imports in this post:
+    # https://stackoverflow.com/questions/15431044/can-i-set-max-retries-for-requests-request
+    # Throttled queries (429) are retried with backoff in get_query_result_json.
+    retry_strategy = Retry(
+        total=3,
+        status_forcelist=[500, 502, 503, 504],
+        respect_retry_after_header=False
+    )
+    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry_strategy)
+    http = requests.Session()
+    http.mount("https://", adapter)
+    http.mount("http://", adapter)
+    return http
+
+
+def throttling_delay(response, attempt) -> float:
+    """Returns the seconds to wait before retrying a throttled query as requested
+    by the Retry-After header or based on an exponential backoff with full jitter."""
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return random.uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt))
+
+
+def kql_datetime(time) -> str:
+    """Formats a datetime as UTC timestamp for a KQL datetime() literal."""
+    # MAYBE: Could probably simplify to .isoformat() as described here:
+    # https://stackoverflow.com/questions/2150739/iso-time-iso-8601-in-python
+    return datetime.fromtimestamp(datetime.timestamp(time), tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")  # noqa: E501
+
+
+def time_slices(start, end, duration) -> list:
+    """Splits the timespan [start, end] into consecutive (start, end) slices of
+    at most the given duration. Every slice excludes its end except for the last."""
+    slices = []
+    slice_start = start
+    while True:
+        slice_end = min(slice_start + duration, end)
+        slices.append((slice_start, slice_end))
+        if slice_end >= end:
+            return slices
+        slice_start = slice_end
+
+
+def union_columns(tables) -> list:
+    """Returns the columns of a KQL union of the tables in order of their first occurrence."""
+    columns = {}
+    for table in tables:
+        for column in table['columns']:
+            columns.setdefault(column['name'], column)
+    return list(columns.values())
+
+
+def correlate_traces(trace_ids, tables) -> list:
+    """Correlates the rows of the bulk-exported tables with every
+    (rootTraceId, traceId) pair of the trace_ids data frame by operation_Id.
+    Returns a list of Azure Insights JSON responses with one trace per pair
+    like the per-trace union query of AzureTraceDownloader.get_traces."""
+    columns = union_columns(tables)
+    names = [column['name'] for column in columns]
+    # Align the rows of all tables to the union columns
+    rows = []
+    for table in tables:
+        positions = [names.index(column['name']) for column in table['columns']]
+        for row in table['rows']:
+            aligned = [None] * len(names)
+            for position, value in zip(positions, row):
+                aligned[position] = value
+            rows.append(aligned)
+    operation_index = names.index('operation_Id')
+    row_ids = pd.DataFrame({'operation_Id': [row[operation_index] for row in rows]})
+    row_ids['row'] = row_ids.index
+    # One (trace, operation_Id) pair per distinct root trace id and trace id
+    pairs = pd.concat([
+        pd.DataFrame({'trace': trace_ids.index, 'operation_Id': trace_ids['rootTraceId']}),
+        pd.DataFrame({'trace': trace_ids.index, 'operation_Id': trace_ids['traceId']}),
+    ]).drop_duplicates()
+    # Hash join on the operation id
+    joined = pairs.merge(row_ids, on='operation_Id').sort_values(['trace', 'row'])
+    trace_rows = joined.groupby('trace')['row'].apply(list).to_dict()
+    traces = []
+    for index, (root_trace_id, trace_id) in enumerate(zip(trace_ids['rootTraceId'], trace_ids['traceId'])):  # noqa: E501
+        traces.append({
+            'tables': [{
+                'name': 'PrimaryResult',
+                'columns': columns,
+                'rows': [rows[row] for row in trace_rows.get(index, [])],
+            }],
+            'attrs': {
+                'rootTraceId': root_trace_id,
+                'traceId': trace_id
+            }
+        })
+    return traces
+
+
 class AzureTraceDownloader:
     """Implements get_traces(self) to download Microsoft Azure Insights traces using
     * Azure Application Insights API Reference: https://docs.microsoft.com/en-us/rest/api/application-insights/query/get    # noqa: E501
@@ -33,10 +158,21 @@ class AzureTraceDownloader:
     The instrumentation SDKs might be relevant for investigating where the logs are produced:
     * Node.js Insights SDK: https://github.com/microsoft/ApplicationInsights-node.js#readme
     * Dotnet Insights SDK: https://github.com/microsoft/ApplicationInsights-dotnet
+    Setting bulk=True downloads the tables of the experiment timespan in time slices and
+    correlates the traces locally (see correlate_traces) instead of querying every trace.
+    Setting workers > 1 runs up to `workers` queries concurrently. All queries share
+    a session with keep-alive connections and back off if they are throttled.
+    An optional endpoint_url replaces the API_URL (e.g., sb.local_insights.InsightsReplayServer).
     """
 
-    def __init__(self, spec) -> None:
+    def __init__(self, spec, bulk=False, workers=1, endpoint_url=None) -> None:
         self.spec = spec
+        self.bulk = bulk
+        self.workers = workers
+        self.endpoint_url = endpoint_url or API_URL
+        self.session = create_session(max(workers, 10))
+        self.num_throttled = 0
+        self.lock = threading.Lock()
         self.load_credentials()
 
     def load_credentials(self):
@@ -56,10 +192,8 @@ class AzureTraceDownloader:
         trace_ids_file = log_path.joinpath('trace_ids.txt')
         trace_file = log_path.joinpath('traces.json')
 
-        # MAYBE: Could probably simplify to .isoformat() as described here:
-        # https://stackoverflow.com/questions/2150739/iso-time-iso-8601-in-python
-        start_time = datetime.fromtimestamp(datetime.timestamp(start), tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")  # noqa: E501
-        end_time = datetime.fromtimestamp(datetime.timestamp(end), tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")  # noqa: E501
+        start_time = kql_datetime(start)
+        end_time = kql_datetime(end)
         experiment_time = f"timestamp between(datetime({start_time}) .. datetime({end_time}))"
 
         # > Retrieve trace ids
@@ -87,35 +221,102 @@ class AzureTraceDownloader:
         df = convert_insights_json_to_df(data)
         df.to_csv(trace_ids_file, index=False)
 
+        if self.bulk:
+            tables = list(self.map_queries(self.retrieve_table, TRACE_TABLES,
+                                           [start] * len(TRACE_TABLES), [end] * len(TRACE_TABLES)))
+            with open(trace_file, 'w') as f:
+                for trace in correlate_traces(df, tables):
+                    f.write(json.dumps(trace) + '\n')
+            logging.info(f"Downloaded {len(df)} traces for invocations between \
+{start} and {end} into {trace_file}.")
+            return
+
         # Retrieve details for each trace
         with open(trace_file, 'w') as f:
-            for rootTraceId, traceId in zip(df['rootTraceId'], df['traceId']):
-                # WARNING: This query is computationally very expensive and slow.
-                # It would be faster to download everything, potentially for each
-                # database separately, and then correlate the traces using pandas.
-                # This requires more memory and might require client-side pagination
-                # for large datasets.
-                # NOTE: This query misses more detailed coldstart traces that are
-                # not linked to the operation_Id and would need to be correlated
-                # separately through `HostInstanceId` and `ProcessId`.
-                trace_query = f"""
-                union traces,requests,dependencies
-                | where {experiment_time} and
-                  (operation_Id == "{rootTraceId}" or operation_Id == "{traceId}" )
-                """
-                # Potential projection for large subset of fields:
-                # | project timestamp,message,itemType,customDimensions,operation_Name,operation_Id,operation_ParentId,client_OS,sdkVersion,itemId,id,name,success,resultCode,duration,performanceBucket,target,type,data  # noqa: E501
-                trace = self.get_query_result_json(trace_query)
-                trace['attrs'] = {
-                    'rootTraceId': rootTraceId,
-                    'traceId': traceId
-                }
+            traces = self.map_queries(self.retrieve_trace, [experiment_time] * len(df),
+                                      df['rootTraceId'], df['traceId'])
+            for trace in traces:
                 f.write(json.dumps(trace) + '\n')
+        if self.num_throttled > 0:
+            logging.info(f"Backed off {self.num_throttled} throttled queries.")
 
         # Inform user
         logging.info(f"Downloaded {len(df)} traces for invocations between \
 {start} and {end} into {trace_file}.")
 
+    def retrieve_trace(self, experiment_time, rootTraceId, traceId) -> dict:
+        """Retrieves the Azure Insights JSON response of a trace."""
+        # WARNING: This query is computationally very expensive and slow.
+        # It would be faster to download everything, potentially for each
+        # database separately, and then correlate the traces using pandas.
+        # This requires more memory and might require client-side pagination
+        # for large datasets (see bulk=True).
+        # NOTE: This query misses more detailed coldstart traces that are
+        # not linked to the operation_Id and would need to be correlated
+        # separately through `HostInstanceId` and `ProcessId`.
+        trace_query = f"""
+        union traces,requests,dependencies
+        | where {experiment_time} and
+          (operation_Id == "{rootTraceId}" or operation_Id == "{traceId}" )
+        """
+        # Potential projection for large subset of fields:
+        # | project timestamp,message,itemType,customDimensions,operation_Name,operation_Id,operation_ParentId,client_OS,sdkVersion,itemId,id,name,success,resultCode,duration,performanceBucket,target,type,data  # noqa: E501
+        trace = self.get_query_result_json(trace_query)
+        trace['attrs'] = {
+            'rootTraceId': rootTraceId,
+            'traceId': traceId
+        }
+        return trace
+
+    def map_queries(self, func, *iterables):
+        """Yields func(*args) for the arguments of the iterables in order.
+        Setting workers > 1 runs up to `workers` calls concurrently while
+        bounding the number of pending results."""
+        if self.workers <= 1:
+            yield from map(func, *iterables)
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for args in zip(*iterables):
+                pending.append(executor.submit(func, *args))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def retrieve_table(self, table, start, end) -> dict:
+        """Retrieves all rows of a table within the timespan [start, end]
+        in time slices of BULK_SLICE_DURATION.
+        Returns a dictionary with the columns of the table and the rows of all slices."""
+        columns = None
+        rows = []
+        slices = time_slices(start, end, BULK_SLICE_DURATION)
+        while slices:
+            slice_start, slice_end = slices.pop(0)
+            end_operator = '<=' if slice_end == end else '<'
+            table_query = f"""
+                {table}
+                | where timestamp >= datetime({kql_datetime(slice_start)}) and
+                  timestamp {end_operator} datetime({kql_datetime(slice_end)})
+                """
+            data = self.get_query_result_json(table_query)
+            error = data.get('error', {})
+            is_partial = error.get('code') == PARTIAL_ERROR_CODE and 'tables' in data
+            if error and not is_partial:
+                raise Exception(f"Error in Azure Insights response. {error.get('message')}.")
+            result = data['tables'][0]
+            if is_partial or len(result['rows']) >= BULK_ROW_LIMIT:
+                if slice_end - slice_start > timedelta(seconds=1):
+                    # Retry potentially truncated results in two halves
+                    middle = slice_start + (slice_end - slice_start) / 2
+                    slices[0:0] = [(slice_start, middle), (middle, slice_end)]
+                    continue
+                logging.warning(f"Potentially truncated {table} between {slice_start} and {slice_end}.")  # noqa: E501
+            columns = columns or result['columns']
+            rows.extend(result['rows'])
+        logging.info(f"Retrieved {len(rows)} rows from {table}.")
+        return {'columns': columns, 'rows': rows}
+
     def retrieve_all_details(self, experiment_time):
         """Retrieves json of all detailed traces available during experiment time without correlation.
         Available dimensions:
@@ -138,26 +339,18 @@ class AzureTraceDownloader:
 
     def get_query_result_json(self, api_query):
         """Runs an Azure Insights (ai) query and returns the result in json.
+        Retries throttled queries up to MAX_THROTTLING_RETRIES times.
         Requires `insights_application_id` and `insights_api_key` in spec."""
         # DEBUG:
         # logging.info(api_query)
-        api_version = 'v1'
-        api_url = f"https://api.applicationinsights.io/{api_version}/apps/{self.api_app_id}/query?query={api_query}"  # noqa: E501
+        api_url = f"{self.endpoint_url}/apps/{self.api_app_id}/query"
         headers = {"x-api-key": self.api_key}
-        # Configure retry strategy to mitigate errors such as
-        # ConnectionResetError > ConnectionError:
-        # https://findwork.dev/blog/advanced-usage-python-requests-timeouts-retries-hooks/#retry-on-failure
-        # See new API imports in this post:
-        # https://stackoverflow.com/questions/15431044/can-i-set-max-retries-for-requests-request
-        retry_strategy = Retry(
-            total=3,
-            status_forcelist=[429, 500, 502, 503, 504],
-            method_whitelist=["HEAD", "GET", "PUT", "DELETE", "OPTIONS", "TRACE"]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        http = requests.Session()
-        http.mount("https://", adapter)
-        http.mount("http://", adapter)
-        response = http.get(api_url, headers=headers)
+        for attempt in range(MAX_THROTTLING_RETRIES + 1):
+            response = self.session.get(api_url, params={'query': api_query}, headers=headers)
+            if response.status_code != 429 or attempt == MAX_THROTTLING_RETRIES:
+                break
+            with self.lock:
+                self.num_throttled += 1
+            time.sleep(throttling_delay(response, attempt))
         data = response.json()
         return data
@@ -0,0 +1,185 @@
+"""Mergeable quantile sketches of the trace breakdown.
+
+The AwsTraceAnalyzer keeps a DDSketch per url, cold/warm status, and metric
+(i.e., end-to-end duration and every time category) while it streams through the traces.
+Merging the sketches of many executions yields percentiles (e.g., p50, p99) without
+re-reading millions of trace breakdown rows.
+
+DDSketch (Masson et al., VLDB 2019) maps every value into logarithmically sized buckets
+such that any quantile is accurate up to a relative error of relative_accuracy
+(i.e., 1% by default) and sketches can be merged by adding up their bucket counts.
+Paper: https://www.vldb.org/pvldb/vol12/p2195-masson.pdf
+"""
+from pathlib import Path
+import json
+import math
+import os
+
+SKETCHES_FILE = 'breakdown_sketches.json'
+SKETCHES_VERSION = 1
+RELATIVE_ACCURACY = 0.01
+
+
+class DDSketch:
+    """Quantile sketch for non-negative values (e.g., durations in microseconds).
+    Values <= 0 are counted as zero."""
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # Dictionary: bucket index (int) => number of values (int)
+        self.bins = dict()
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value > 0:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(f"Cannot merge sketches with relative accuracy {other.relative_accuracy} and {self.relative_accuracy}.")  # noqa: E501
+        if other.count == 0:
+            return self
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        if self.count == 0:
+            self.min, self.max = other.min, other.max
+        else:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        self.count += other.count
+        self.sum += other.sum
+        return self
+
+    def quantile(self, q):
+        """Returns the approximate q-quantile (0 <= q <= 1) or None if the sketch is empty."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        cumulative = self.zero_count
+        if rank < cumulative:
+            return min(max(0, self.min), self.max)
+        for index in sorted(self.bins):
+            cumulative += self.bins[index]
+            if rank < cumulative:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.sum / self.count
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'zero_count': self.zero_count,
+            'bins': sorted(self.bins.items())
+        }
+
+    @classmethod
+    def from_dict(cls, data, relative_accuracy=RELATIVE_ACCURACY):
+        sketch = cls(relative_accuracy)
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        sketch.zero_count = data['zero_count']
+        sketch.bins = {index: count for index, count in data['bins']}
+        return sketch
+
+
+class BreakdownSketches:
+    """Collection of DDSketches keyed by url, cold/warm status, and metric."""
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY) -> None:
+        self.relative_accuracy = relative_accuracy
+        # Dictionary: (url, coldstart, metric) => DDSketch
+        self.sketches = dict()
+
+    def add(self, url, coldstart, values):
+        """Adds a dictionary of metric => value for a single trace."""
+        for metric, value in values.items():
+            key = (url, coldstart, metric)
+            sketch = self.sketches.get(key)
+            if sketch is None:
+                sketch = self.sketches[key] = DDSketch(self.relative_accuracy)
+            sketch.add(value)
+
+    def merge(self, other):
+        for key, other_sketch in other.sketches.items():
+            sketch = self.sketches.get(key)
+            if sketch is None:
+                sketch = self.sketches[key] = DDSketch(self.relative_accuracy)
+            sketch.merge(other_sketch)
+        return self
+
+    def sketch(self, metric='duration', url=None, coldstart=None) -> DDSketch:
+        """Returns the merged sketch of a metric over all urls and cold/warm statuses
+        unless filtered by url or coldstart."""
+        merged = DDSketch(self.relative_accuracy)
+        for (sketch_url, sketch_coldstart, sketch_metric), sketch in self.sketches.items():
+            if sketch_metric == metric and \
+                    (url is None or sketch_url == url) and \
+                    (coldstart is None or sketch_coldstart == coldstart):
+                merged.merge(sketch)
+        return merged
+
+    def quantile(self, q, metric='duration', url=None, coldstart=None):
+        return self.sketch(metric, url, coldstart).quantile(q)
+
+    def keys(self) -> list:
+        """Returns a sorted list of (url, coldstart) tuples."""
+        return sorted({(url, coldstart) for url, coldstart, _ in self.sketches},
+                      key=lambda key: (key[0] or '', key[1]))
+
+    def to_dict(self) -> dict:
+        return {
+            'version': SKETCHES_VERSION,
+            'relative_accuracy': self.relative_accuracy,
+            'sketches': [
+                {'url': url, 'coldstart': coldstart, 'metric': metric, **sketch.to_dict()}
+                for (url, coldstart, metric), sketch in self.sketches.items()
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != SKETCHES_VERSION:
+            raise ValueError(f"Unsupported sketches version {data.get('version')}.")
+        sketches = cls(data['relative_accuracy'])
+        for entry in data['sketches']:
+            key = (entry['url'], entry['coldstart'], entry['metric'])
+            sketches.sketches[key] = DDSketch.from_dict(entry, sketches.relative_accuracy)
+        return sketches
+
+    def save(self, sketches_file):
+        """Atomically replaces the sketches file."""
+        tmp_file = Path(str(sketches_file) + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_file, sketches_file)
+
+    @classmethod
+    def load(cls, sketches_file):
+        with open(sketches_file, 'r') as f:
+            return cls.from_dict(json.load(f))
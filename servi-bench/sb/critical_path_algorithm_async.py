@@ -188,3 +188,45 @@ def critical_path(S, currentSpan):
     #         path.extend(critical_path(S, lastChild))
     # 14: Return path
     return path
+
+
+def critical_path_iterative(S, startSpan):
+    """Non-recursive version of Algorithm 1 with identical semantics.
+    Each recursive call of `critical_path` is represented by a frame
+    [currentSpan, sortedChildSpans, nextChildIndex] on an explicit stack.
+    This avoids Python's recursion limit for deeply nested traces.
+    The path of a recursive call is always a suffix of the overall path.
+    Hence, `path[-1]` refers to the same span as in the recursive version.
+    """
+    path = []
+    frames = []
+    span = startSpan
+    while span is not None:
+        # Enter span (Lines 2-4 and 7)
+        path.append(span)
+        if S and S[-1] == span:
+            S.pop()
+        if span.childSpans:
+            sortedChildSpans = sorted(span.childSpans, key=lambda x: (x.endTime, x.startTime))
+            frames.append([span, sortedChildSpans, 0])
+        # Find the next span to descend into (Lines 9-13) or return from completed frames
+        span = None
+        while frames and span is None:
+            frame = frames[-1]
+            currentSpan, sortedChildSpans, index = frame
+            frame[2] += 1
+            lastChild = sortedChildSpans[-1]
+            if index < len(sortedChildSpans):
+                # Line 10
+                child = sortedChildSpans[index]
+                if (currentSpan.isAsync(child) and S and S[-1] == child) or \
+                   (not currentSpan.isAsync(child) and child.happensBefore(lastChild) and not currentSpan.isAsync(path[-1])):  # noqa: E501
+                    span = child
+            elif index == len(sortedChildSpans):
+                # Line 12
+                if (currentSpan.isAsync(lastChild) and S and S[-1] == lastChild) or \
+                   (not currentSpan.isAsync(lastChild) and not currentSpan.isAsync(path[-1])):  # noqa: E501
+                    span = lastChild
+            else:
+                frames.pop()
+    return path
@@ -0,0 +1,274 @@
+"""Local stand-in for the Azure Application Insights query API used by the AzureTraceDownloader.
+
+The InsightsReplayServer replays the Insights responses of a traces.json file downloaded
+by the AzureTraceDownloader (i.e., one JSON response per line with the `attrs` rootTraceId
+and traceId) over HTTP. It answers the trace ids query, the per-trace union query, and
+the time-sliced table queries of the bulk mode of AzureTraceDownloader.get_traces.
+Configurable latency, row limits, and throttling with HTTP 429 allow benchmarking
+the query concurrency and connection reuse offline with recorded or synthetic traces
+(see write_synthetic_traces and tests/performance/download_perf.py):
+python -m sb.local_insights traces.json --port 4001
+sb get_traces --endpoint_url=http://127.0.0.1:4001/v1
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import random
+import re
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+
+from sb.azure_trace_analyzer import timestamp_us
+from sb.azure_trace_downloader import PARTIAL_ERROR_CODE
+
+# Operation ids of the per-trace union query of the AzureTraceDownloader
+OPERATION_ID_PATTERN = re.compile(r'operation_Id == "([^"]*)"')
+# Table and timespan of the table queries of the AzureTraceDownloader bulk mode
+TABLE_QUERY_PATTERN = re.compile(
+    r'^\s*(\w+)\s*\|\s*where timestamp >= datetime\((\S+)\) and\s+timestamp (<=?) datetime\((\S+)\)')  # noqa: E501
+# Tables of the telemetry item types
+ITEM_TYPE_TABLES = {'trace': 'traces', 'request': 'requests', 'dependency': 'dependencies'}
+# Columns of the synthetic Insights responses
+SYNTHETIC_COLUMNS = ['timestamp', 'id', 'operation_ParentId', 'operation_Id', 'name',
+                     'itemType', 'duration', 'customDimensions']
+
+
+def synthetic_trace(i, start) -> dict:
+    """Returns an Azure Insights response of a trigger trace with a few spans."""
+    root_trace_id = f"root{i}"
+    trace_id = f"child{i}"
+    rows = []
+    for n, (operation_id, item_type) in enumerate([(root_trace_id, 'request'),
+                                                   (root_trace_id, 'dependency'),
+                                                   (trace_id, 'request'),
+                                                   (trace_id, 'dependency'),
+                                                   (trace_id, 'trace')]):
+        timestamp = (start + timedelta(milliseconds=10 * n)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        rows.append([timestamp, f"{i}-{n}", operation_id, operation_id, f"span{n}", item_type,
+                     10.5, '{"Category": "Host"}'])
+    return {
+        'tables': [{'name': 'PrimaryResult',
+                    'columns': [{'name': c, 'type': 'string'} for c in SYNTHETIC_COLUMNS],
+                    'rows': rows}],
+        'attrs': {'rootTraceId': root_trace_id, 'traceId': trace_id},
+    }
+
+
+def write_synthetic_traces(traces_file, num_traces, start):
+    """Writes num_traces synthetic responses one second apart from the start datetime
+    in the format of the traces.json file of the AzureTraceDownloader."""
+    with open(traces_file, 'w') as f:
+        for i in range(num_traces):
+            f.write(json.dumps(synthetic_trace(i, start + timedelta(seconds=i))) + '\n')
+
+
+def error_response(message) -> dict:
+    return {'error': {'message': message}}
+
+
+class InsightsRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    # Send the body without waiting for the acknowledgment of the headers
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.replay.count_connection()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query).get('query', [''])[0]
+        status, data, headers = self.server.replay.respond(query)
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class InsightsReplayServer:
+    """Serves recorded Azure Insights responses over HTTP on a local port:
+        with InsightsReplayServer.from_file('traces.json') as server:
+            AzureTraceDownloader(spec, endpoint_url=server.url).get_traces()
+    * latency: seconds per query
+    * max_concurrency: number of concurrent queries before throttling (None for unlimited)
+    * throttle_rate: probability of throttling a query
+    * retry_after: seconds of the Retry-After header of throttled queries (None to omit)
+    * row_limit: maximum number of rows per table query result (None for unlimited),
+      which truncates larger results with a partial error
+    Counts the number of queries, throttled queries, and HTTP connections.
+    """
+
+    def __init__(self, traces, latency=0.0, max_concurrency=None, throttle_rate=0.0,
+                 retry_after=1, row_limit=None, seed=11, host='127.0.0.1', port=0) -> None:
+        # Dictionary: (rootTraceId, traceId) => recorded response without attrs
+        self.traces = {}
+        for trace in traces:
+            attrs = trace.get('attrs', {})
+            response = {key: value for key, value in trace.items() if key != 'attrs'}
+            self.traces[(attrs.get('rootTraceId'), attrs.get('traceId'))] = response
+        # Dictionary: table name => {'columns': [...], 'rows': [(timestamp_us, row)]}
+        self.tables = self.index_tables()
+        self.latency = latency
+        self.row_limit = row_limit
+        self.max_concurrency = max_concurrency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.num_requests = 0
+        self.num_throttled = 0
+        self.num_connections = 0
+        self.httpd = ThreadingHTTPServer((host, port), InsightsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.replay = self
+        self.thread = None
+
+    @classmethod
+    def from_file(cls, traces_file, **kwargs):
+        """Loads the responses from a traces.json file with one response per line."""
+        with open(traces_file) as f:
+            return cls((json.loads(line) for line in f), **kwargs)
+
+    @property
+    def url(self) -> str:
+        """Returns the endpoint url replacing the API_URL of the AzureTraceDownloader."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def count_connection(self):
+        with self.lock:
+            self.num_connections += 1
+
+    def respond(self, query):
+        """Returns a tuple with the HTTP status, the JSON response, and additional headers
+        after simulating the latency and throttling of the query."""
+        with self.lock:
+            self.num_requests += 1
+            self.in_flight += 1
+            overloaded = self.max_concurrency is not None and self.in_flight > self.max_concurrency
+            throttled = overloaded or self.rng.random() < self.throttle_rate
+            if throttled:
+                self.num_throttled += 1
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        if throttled:
+            headers = {} if self.retry_after is None else {'Retry-After': str(self.retry_after)}
+            return 429, error_response('Too many requests'), headers
+        return 200, self.query_result(query), {}
+
+    def index_tables(self) -> dict:
+        """Splits the distinct rows of all recorded responses into tables by item type
+        ordered by timestamp."""
+        tables = {table: {'columns': None, 'rows': []} for table in ITEM_TYPE_TABLES.values()}
+        seen = set()
+        for response in self.traces.values():
+            if 'tables' not in response:
+                continue
+            result = response['tables'][0]
+            names = [column['name'] for column in result['columns']]
+            item_type_index = names.index('itemType')
+            timestamp_index = names.index('timestamp')
+            for row in result['rows']:
+                table = tables.get(ITEM_TYPE_TABLES.get(row[item_type_index]))
+                key = json.dumps(row)
+                if table is None or key in seen:
+                    continue
+                seen.add(key)
+                table['columns'] = table['columns'] or result['columns']
+                table['rows'].append((timestamp_us(row[timestamp_index]), row))
+        for table in tables.values():
+            table['rows'].sort(key=lambda item: item[0])
+        return tables
+
+    def table_result(self, table_name, start, operator, end) -> dict:
+        table = self.tables[table_name]
+        start_us = timestamp_us(start)
+        end_us = timestamp_us(end) + (1 if operator == '<=' else 0)
+        rows = [row for time, row in table['rows'] if start_us <= time < end_us]
+        response = {'tables': [{'name': 'PrimaryResult', 'columns': table['columns'] or [],
+                                'rows': rows}]}
+        if self.row_limit is not None and len(rows) > self.row_limit:
+            # Truncated results contain a partial error like Insights
+            response['tables'][0]['rows'] = rows[:self.row_limit]
+            response['error'] = {'code': PARTIAL_ERROR_CODE,
+                                 'message': 'Query result set has exceeded the internal record count limit.'}  # noqa: E501
+        return response
+
+    def query_result(self, query) -> dict:
+        match = TABLE_QUERY_PATTERN.match(query)
+        if match and match.group(1) in self.tables:
+            return self.table_result(*match.groups())
+        if 'receiver0' in query:
+            rows = [[root_trace_id, trace_id] for root_trace_id, trace_id in self.traces]
+            return {'tables': [{'name': 'PrimaryResult',
+                                'columns': [{'name': 'rootTraceId', 'type': 'string'},
+                                            {'name': 'traceId', 'type': 'string'}],
+                                'rows': rows}]}
+        operation_ids = OPERATION_ID_PATTERN.findall(query)
+        if len(operation_ids) == 2 and tuple(operation_ids) in self.traces:
+            return self.traces[tuple(operation_ids)]
+        return error_response(f"Unsupported query: {query.strip()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves Azure Insights responses on a local port.')  # noqa: E501
+    parser.add_argument('traces', help='traces.json file downloaded by the AzureTraceDownloader.')
+    parser.add_argument('--port', type=int, default=4001)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per simulated query.')
+    parser.add_argument('--max_concurrency', type=int, default=None,
+                        help='Number of concurrent queries before throttling.')
+    parser.add_argument('--throttle_rate', type=float, default=0.0,
+                        help='Probability of throttling a query.')
+    parser.add_argument('--retry_after', type=int, default=1,
+                        help='Seconds of the Retry-After header of throttled queries.')
+    parser.add_argument('--no_retry_after', dest='retry_after', action='store_const', const=None,
+                        help='Omit the Retry-After header of throttled queries.')
+    parser.add_argument('--row_limit', type=int, default=None,
+                        help='Maximum number of rows per table query result.')
+    args = parser.parse_args()
+    server = InsightsReplayServer.from_file(args.traces, port=args.port, latency=args.latency,
+                                            max_concurrency=args.max_concurrency,
+                                            throttle_rate=args.throttle_rate,
+                                            retry_after=args.retry_after,
+                                            row_limit=args.row_limit)
+    logging.info(f"Serving {len(server.traces)} traces at {server.url}.")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,301 @@
+"""Local stand-in for the AWS X-Ray API used by the AwsTraceDownloader.
+
+The LocalXRayClient implements the subset of the boto3 X-Ray client used for downloading
+traces (i.e., paginated GetTraceSummaries and BatchGetTraces) on top of a traces.json
+file with one trace per line (e.g., generated by sb.trace_generator) or a directory
+of trace fixtures. Configurable latency, page sizes, throttling, and unprocessed trace ids
+allow benchmarking and testing the download path offline
+(see tests/performance/download_perf.py).
+Throttled requests raise the same botocore ClientError as the X-Ray API.
+
+The XRayServer serves a LocalXRayClient over HTTP with the REST API of X-Ray such that
+the boto3 client of the AwsTraceDownloader can use it as endpoint_url:
+python -m sb.local_xray tests/fixtures/aws_trace_analyzer --port 4000
+sb get_traces --endpoint_url=http://127.0.0.1:4000
+"""
+import argparse
+from bisect import bisect_left
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+from pathlib import Path
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Maximum number of trace ids per BatchGetTraces request enforced by X-Ray
+MAX_BATCH_GET_TRACES_IDS = 5
+
+
+def trace_start_time(trace) -> float:
+    """Returns the earliest start time of all segments of a trace in epoch seconds."""
+    return min(json.loads(segment['Document'])['start_time'] for segment in trace['Segments'])
+
+
+def read_trace_file(path) -> list:
+    """Returns the traces of a JSON file with either one trace or one trace per line."""
+    text = Path(path).read_text()
+    try:
+        return [json.loads(text)]
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def epoch(value) -> float:
+    """Returns the epoch seconds of a datetime (naive datetimes are local time) or number."""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+class LocalPaginator:
+    """Follows the NextToken of a client method like a boto3 paginator."""
+
+    def __init__(self, method) -> None:
+        self.method = method
+
+    def paginate(self, **kwargs):
+        next_token = None
+        while True:
+            page = self.method(**kwargs, NextToken=next_token)
+            yield page
+            next_token = page.get('NextToken')
+            if next_token is None:
+                return
+
+
+class LocalXRayClient:
+    """Serves X-Ray traces from memory with the interface of a boto3 X-Ray client.
+    * latency: seconds per API request
+    * summaries_page_size: number of trace summaries per GetTraceSummaries page
+    * traces_page_size: number of traces per BatchGetTraces page
+    * max_concurrency: number of concurrent requests before throttling (None for unlimited)
+    * throttle_rate: probability of throttling a request
+    * unprocessed_rate: probability of returning a trace id as unprocessed
+    Counts the number of requests, throttled requests, and unprocessed trace ids.
+    """
+
+    def __init__(self, traces, latency=0.0, summaries_page_size=100, traces_page_size=5,
+                 max_concurrency=None, throttle_rate=0.0, unprocessed_rate=0.0,
+                 seed=11) -> None:
+        # Dictionary: trace id (str) => trace (dict) in insertion order
+        self.traces = {trace['Id']: trace for trace in traces}
+        # List of (start_time, trace_id) tuples sorted by start time
+        self.start_times = sorted((trace_start_time(trace), trace_id)
+                                  for trace_id, trace in self.traces.items())
+        self.latency = latency
+        self.summaries_page_size = summaries_page_size
+        self.traces_page_size = traces_page_size
+        self.max_concurrency = max_concurrency
+        self.throttle_rate = throttle_rate
+        self.unprocessed_rate = unprocessed_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.num_requests = 0
+        self.num_throttled = 0
+        self.num_unprocessed = 0
+
+    @classmethod
+    def from_file(cls, traces_file, **kwargs):
+        """Loads the traces from a traces.json file with one trace per line."""
+        with open(traces_file) as f:
+            return cls((json.loads(line) for line in f), **kwargs)
+
+    @classmethod
+    def from_directory(cls, directory, pattern='**/traces.json', **kwargs):
+        """Loads the traces of all files matching the pattern within a directory
+        (e.g., tests/fixtures/aws_trace_analyzer). Skips traces without segments."""
+        traces = []
+        for path in sorted(Path(directory).glob(pattern)):
+            traces.extend(trace for trace in read_trace_file(path) if trace.get('Segments'))
+        return cls(traces, **kwargs)
+
+    def get_paginator(self, operation_name) -> LocalPaginator:
+        return LocalPaginator(getattr(self, operation_name))
+
+    def request(self, operation_name):
+        """Simulates the latency and throttling of an API request."""
+        with self.lock:
+            self.num_requests += 1
+            self.in_flight += 1
+            overloaded = self.max_concurrency is not None and self.in_flight > self.max_concurrency
+            throttled = overloaded or self.rng.random() < self.throttle_rate
+            if throttled:
+                self.num_throttled += 1
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        if throttled:
+            error = {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}
+            raise ClientError(error, operation_name)
+
+    def get_trace_summaries(self, StartTime, EndTime, NextToken=None, **kwargs):
+        """Returns the summaries of traces starting within [StartTime, EndTime)."""
+        self.request('GetTraceSummaries')
+        start = epoch(StartTime)
+        end = epoch(EndTime)
+        offset = int(NextToken or 0)
+        first = bisect_left(self.start_times, (start,))
+        last = bisect_left(self.start_times, (end,))
+        page = self.start_times[first + offset:min(first + offset + self.summaries_page_size, last)]  # noqa: E501
+        response = {
+            'TraceSummaries': [
+                {'Id': trace_id,
+                 'Duration': self.traces[trace_id]['Duration'],
+                 'StartTime': datetime.fromtimestamp(start_time, tz=timezone.utc)}
+                for start_time, trace_id in page
+            ],
+            'ApproximateTime': datetime.now(tz=timezone.utc),
+        }
+        if first + offset + self.summaries_page_size < last:
+            response['NextToken'] = str(offset + self.summaries_page_size)
+        return response
+
+    def batch_get_traces(self, TraceIds, NextToken=None):
+        """Returns the traces of up to MAX_BATCH_GET_TRACES_IDS trace ids.
+        Unknown trace ids are omitted like in X-Ray."""
+        if len(TraceIds) > MAX_BATCH_GET_TRACES_IDS or len(set(TraceIds)) != len(TraceIds):
+            error = {'Error': {'Code': 'InvalidRequestException', 'Message': 'Invalid TraceIds'}}
+            raise ClientError(error, 'BatchGetTraces')
+        self.request('BatchGetTraces')
+        offset = int(NextToken or 0)
+        page_ids = TraceIds[offset:offset + self.traces_page_size]
+        traces = []
+        unprocessed_ids = []
+        with self.lock:
+            for trace_id in page_ids:
+                if self.rng.random() < self.unprocessed_rate:
+                    unprocessed_ids.append(trace_id)
+                elif trace_id in self.traces:
+                    traces.append(self.traces[trace_id])
+            self.num_unprocessed += len(unprocessed_ids)
+        response = {'Traces': traces, 'UnprocessedTraceIds': unprocessed_ids}
+        if offset + self.traces_page_size < len(TraceIds):
+            response['NextToken'] = str(offset + self.traces_page_size)
+        return response
+
+
+def json_default(value):
+    """Serializes datetimes as epoch seconds like the X-Ray REST API."""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class XRayRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    # Send the body without waiting for the acknowledgment of the headers
+    disable_nagle_algorithm = True
+    # Request paths of the X-Ray REST API => LocalXRayClient method
+    OPERATIONS = {
+        '/TraceSummaries': 'get_trace_summaries',
+        '/Traces': 'batch_get_traces',
+    }
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        params = json.loads(self.rfile.read(length) or b'{}')
+        operation = self.OPERATIONS.get(self.path.split('?')[0])
+        headers = {}
+        try:
+            if operation is None:
+                raise ClientError({'Error': {'Code': 'UnknownOperationException',
+                                             'Message': f"Unsupported path {self.path}"}},
+                                  self.path)
+            status = 200
+            data = getattr(self.server.client, operation)(**params)
+        except (ClientError, TypeError) as e:
+            error = getattr(e, 'response', {}).get('Error', {})
+            code = error.get('Code', 'InvalidRequestException')
+            status = 429 if code == 'ThrottlingException' else 400
+            headers['x-amzn-ErrorType'] = code
+            data = {'message': error.get('Message', str(e))}
+        body = json.dumps(data, default=json_default).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class XRayServer:
+    """Serves a LocalXRayClient over HTTP on a local port:
+        client = LocalXRayClient.from_file('traces.json', throttle_rate=0.1)
+        with XRayServer(client) as server:
+            AwsTraceDownloader(spec, endpoint_url=server.url).get_traces()
+    The boto3 client requires credentials (e.g., AWS_ACCESS_KEY_ID), which are ignored.
+    """
+
+    def __init__(self, client, host='127.0.0.1', port=0) -> None:
+        self.client = client
+        self.httpd = ThreadingHTTPServer((host, port), XRayRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.client = client
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        """Returns the endpoint url of the X-Ray client of the AwsTraceDownloader."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves X-Ray traces on a local port.')
+    parser.add_argument('traces', help='traces.json file or directory with trace fixtures.')
+    parser.add_argument('--port', type=int, default=4000)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds per simulated API request.')
+    parser.add_argument('--summaries_page_size', type=int, default=100)
+    parser.add_argument('--traces_page_size', type=int, default=5)
+    parser.add_argument('--max_concurrency', type=int, default=None,
+                        help='Number of concurrent requests before throttling.')
+    parser.add_argument('--throttle_rate', type=float, default=0.0,
+                        help='Probability of throttling a request.')
+    parser.add_argument('--unprocessed_rate', type=float, default=0.0,
+                        help='Probability of returning a trace id as unprocessed.')
+    args = parser.parse_args()
+    options = {key: value for key, value in vars(args).items() if key not in ['traces', 'port']}
+    if Path(args.traces).is_dir():
+        client = LocalXRayClient.from_directory(args.traces, **options)
+    else:
+        client = LocalXRayClient.from_file(args.traces, **options)
+    server = XRayServer(client, port=args.port)
+    logging.info(f"Serving {len(client.traces)} traces at {server.url}.")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,93 @@
+"""Columnar Parquet output for trace breakdowns.
+
+Requires the optional pyarrow dependency (pip install --editable .[parquet]).
+Compared to trace_breakdown.csv, the Parquet file stores:
+* durations as int64 nanoseconds (Arrow duration[ns] => pandas timedelta64[ns])
+* lists (e.g., services) as native list columns
+* repetitive strings (e.g., url, path_id, service names) as dictionary-encoded strings
+Hence, pandas.read_parquet loads the trace breakdown without any parsing.
+"""
+from pathlib import Path
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sb.aws_trace_analyzer import BREAKDOWN_FIELDS, TIME_CATEGORIES
+
+# Number of buffered rows per row group
+ROW_GROUP_SIZE = 10_000
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+FIELD_TYPES = {
+    'trace_id': pa.string(),
+    'start_time': pa.float64(),
+    'end_time': pa.float64(),
+    'duration': pa.duration('ns'),
+    'url': CATEGORY,
+    'num_cold_starts': pa.int64(),
+    'errors': pa.int64(),
+    'throttles': pa.int64(),
+    'faults': pa.int64(),
+    'services': pa.list_(CATEGORY),
+    'longest_path_names': pa.list_(CATEGORY),
+    'path_id': CATEGORY,
+    **{category: pa.duration('ns') for category in TIME_CATEGORIES}
+}
+
+
+def breakdown_schema(fields=BREAKDOWN_FIELDS) -> pa.Schema:
+    return pa.schema([(field, FIELD_TYPES[field]) for field in fields])
+
+
+class ParquetTraceWriter:
+    """Writes trace breakdown rows into a Parquet file.
+    Mimics the writerow interface of csv.writer and buffers rows into row groups.
+    Writes into a temporary file that atomically replaces the Parquet file on close.
+    Setting append=True copies the rows of an existing Parquet file first
+    because Parquet files cannot be appended in place."""
+
+    def __init__(self, path, fields=BREAKDOWN_FIELDS, append=False,
+                 row_group_size=ROW_GROUP_SIZE) -> None:
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + '.tmp')
+        self.schema = breakdown_schema(fields)
+        self.row_group_size = row_group_size
+        self.rows = []
+        self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+        if append and self.path.is_file():
+            self.write_file(self.path)
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered rows as row group."""
+        if not self.rows:
+            return
+        columns = [pa.array(column, type=field_type)
+                   for column, field_type in zip(zip(*self.rows), self.schema.types)]
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+        self.rows = []
+
+    def write_file(self, path):
+        """Appends all rows from another Parquet file with the same schema."""
+        self.flush()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=self.row_group_size):
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the previous Parquet file if the analysis fails
+            self.writer.close()
+            self.tmp_path.unlink()
@@ -11,9 +11,9 @@ from sb.cli.config_cmd import ConfigCmd
 from sb.benchmark import Benchmark
 from sb.benchmark_spec import BenchmarkSpec, win_vol
 from sb.provider import Provider
-from sb.aws_trace_analyzer import AwsTraceAnalyzer
+from sb.aws_trace_analyzer import AwsTraceAnalysisPipeline, AwsTraceAnalyzer
 # from sb.aws_trace_trigger_analyzer import AwsTraceTriggerAnalyzer
-from sb.azure_trace_analyzer import AzureTraceTriggerAnalyzer
+from sb.azure_trace_analyzer import AzureTraceAnalyzer, AzureTraceTriggerAnalyzer
 from sb.aws_trace_downloader import AwsTraceDownloader
 from sb.azure_trace_downloader import AzureTraceDownloader
 import sb.aws_trace_migrator as aws_trace_migrator
@@ -235,11 +235,23 @@ Use --log_level=DEBUG to get more details.")
             self.bench.invoke(workload_type, **kwargs)
         return self
 
-    def get_traces(self):
-        """Downloads distributed request traces for the previous invocation."""
+    def get_traces(self, workers=1, analyze=False, analysis_workers=1, bulk=False,
+                   endpoint_url=None):
+        """Downloads distributed request traces for the previous invocation.
+        workers: number of concurrent BatchGetTraces requests (AWS) or queries (Azure).
+        analyze: flag to analyze the traces while downloading them into `traces.json`
+                 with the same outputs as analyze_traces. Resumed downloads and
+                 Azure traces are analyzed after the download.
+        analysis_workers: number of processes analyzing the downloaded traces (AWS only).
+        bulk: flag to download the telemetry tables in time slices and correlate the traces
+              locally instead of querying every trace (Azure only).
+        endpoint_url: URL of a local X-Ray or Insights stand-in service
+                      (see sb.local_xray and sb.local_insights)."""
         self.check_bench_init()
         if(not self.local):
-            self.run_in_docker('get_traces', local=True)
+            endpoint_option = f" --endpoint_url={endpoint_url}" if endpoint_url else ''
+            self.run_in_docker(f"get_traces --workers={workers} --analyze={analyze} \
+--analysis_workers={analysis_workers} --bulk={bulk}{endpoint_option}", local=True)
         else:
             self.bench.chdir()
             self.bench.save_config_to_logs()
@@ -247,23 +259,56 @@ Use --log_level=DEBUG to get more details.")
             trace_downloader = None
             # NOTE: support both strings and lists of providers
             provider = self.bench.spec['provider']
+            trace_file = self.bench.spec.logs_directory().joinpath('traces.json')
+            if provider and 'aws' in provider and analyze and not trace_file.exists():
+                with AwsTraceAnalysisPipeline(trace_file, workers=analysis_workers) as pipeline:
+                    AwsTraceDownloader(self.bench.spec, workers=workers,
+                                       trace_sink=pipeline.put,
+                                       endpoint_url=endpoint_url).get_traces()
+                self.bench.fix_permissions()
+                return self
             if provider and 'aws' in provider:
-                trace_downloader = AwsTraceDownloader(self.bench.spec)
+                trace_downloader = AwsTraceDownloader(self.bench.spec, workers=workers,
+                                                      endpoint_url=endpoint_url)
             elif provider and 'azure' in provider:
-                trace_downloader = AzureTraceDownloader(self.bench.spec)
+                trace_downloader = AzureTraceDownloader(self.bench.spec, bulk=bulk,
+                                                        workers=workers,
+                                                        endpoint_url=endpoint_url)
             else:
                 logging.error('Unsupported provider for trace downloader')
             trace_downloader.get_traces()
+            if analyze:
+                self.analyze_traces(workers=analysis_workers)
             self.bench.fix_permissions()
         return self
 
     # MAYBE: Expose provider option to user or auto-detect based on trace
-    def analyze_traces(self, log_path=None, provider='aws'):
+    def analyze_traces(self, log_path=None, provider='aws', workers=1, span_tree=False,
+                       force=False, output_format='csv', detail='summary', profile=False,
+                       path_cache=False, batch=False, breakdown=False):
         """Creates a trace breakdown analysis with the output files:
         * trace_breakdown.csv for valid traces
         * invalid_traces.csv for invalid traces (e.g., incomplete)
+        * breakdown_sketches.json with mergeable percentile sketches (AWS only)
+        * trace_paths.json with the span names per path_id of the longest path (AWS only)
         log_path: path to `traces.json` file with one trace per line.
-                  Defaults to last invocation if not provided."""
+                  Defaults to last invocation if not provided.
+        workers: number of processes analyzing shards of `traces.json` in parallel (AWS only).
+        span_tree: flag to use the compact span tree instead of networkx graphs (AWS only).
+        force: flag to re-analyze all traces even if trace_breakdown_manifest.json
+               indicates that the previous results are up-to-date (AWS only).
+        output_format: csv or parquet for trace_breakdown.parquet with typed columns,
+                       which requires pyarrow (AWS only).
+        detail: summary or full to additionally save the critical path of every trace
+                into critical_paths.jsonl for drill-down analysis (AWS only).
+        profile: flag to save the time per analysis stage and the invalid traces
+                 per exception site into analysis_profile.json.
+        path_cache: flag to reuse the critical path of traces with the same topology
+                    and timestamp order (AWS only).
+        batch: flag to extract the trigger results of many traces at once
+               with vectorized data frame operations (Azure only).
+        breakdown: flag to create the generic latency breakdown instead of
+                   the trigger results for TriggerBench (Azure only)."""
         # Default to last execution if no log path provided
         if log_path is None:
             self.check_bench_init()
@@ -274,14 +319,20 @@ Use --log_level=DEBUG to get more details.")
         trace_analyzer = None
         # NOTE: support both strings and lists of providers
         if provider and 'aws' in provider:
-            trace_analyzer = AwsTraceAnalyzer(log_path)
+            trace_analyzer = AwsTraceAnalyzer(log_path, workers=workers, span_tree=span_tree,
+                                              force=force, output_format=output_format,
+                                              detail=detail, profile=profile,
+                                              path_cache=path_cache)
             # NOTE: Use alternative analyzer for TriggerBench:
             # This analyzer is less generic but supports trace correlation based
             # on trace propagation conventions
             # (see AwsTraceTriggerAnalyzer#merge_and_analyze_traces).
             # trace_analyzer = AwsTraceTriggerAnalyzer(log_path)
         elif provider and 'azure' in provider:
-            trace_analyzer = AzureTraceTriggerAnalyzer(log_path)
+            if breakdown:
+                trace_analyzer = AzureTraceAnalyzer(log_path, profile=profile)
+            else:
+                trace_analyzer = AzureTraceTriggerAnalyzer(log_path, profile=profile, batch=batch)
         else:
             logging.error('Unsupported provider for trace analyzer')
         # Run trace analysis
@@ -0,0 +1,138 @@
+"""Compact span tree for the AWS trace analyzer.
+
+The SpanTree is a lightweight alternative to the networkx DiGraph used in
+`aws_trace_analyzer.create_span_graph`. It stores spans under integer indices
+in parallel arrays (id, attributes, parent, children, start_time, end_time, origin)
+and only implements the subset of the networkx API used by the trace analyzer:
+* G.graph: dictionary with graph attributes
+* G.nodes[id] and G.nodes(data=True)
+* G.predecessors(id), G.successors(id), and G.out_degree(id)
+* G.add_node(id, **attr) and G.add_edge(parent_id, child_id)
+Additionally, it provides child lists pre-sorted by (end_time, start_time)
+through G.sorted_children(id) after calling G.sort_children().
+
+The semantics follow networkx for the special cases relevant in incomplete traces:
+* add_edge creates an empty (i.e., attribute-less) parent node if the parent is missing.
+* add_node updates the attributes of an existing node and keeps its insertion order.
+* predecessors returns the first parent if a node has been added under multiple parents.
+"""
+
+ROOT = -1
+
+
+class NodeView:
+    """Mimics the networkx NodeView: `nodes[id]` returns the attribute
+    dictionary of a node and `nodes(data=True)` iterates over (id, attr) tuples."""
+    __slots__ = ('tree',)
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    def __getitem__(self, id):
+        return self.tree.attrs[self.tree.index[id]]
+
+    def __contains__(self, id):
+        return id in self.tree.index
+
+    def __iter__(self):
+        return iter(self.tree.ids)
+
+    def __len__(self):
+        return len(self.tree.ids)
+
+    def __call__(self, data=False):
+        if data:
+            return zip(self.tree.ids, self.tree.attrs)
+        return iter(self.tree.ids)
+
+
+class SpanTree:
+    """Array-backed span tree where each span is identified by an integer index."""
+    __slots__ = ('graph', 'nodes', 'index', 'ids', 'attrs', 'parent', 'children',
+                 'start_time', 'end_time', 'origin', 'sorted')
+
+    def __init__(self, **graph_attr):
+        self.graph = dict(graph_attr)
+        self.nodes = NodeView(self)
+        # Mapping: span id (str) => index (int)
+        self.index = dict()
+        # Parallel arrays indexed by the span index
+        self.ids = []
+        self.attrs = []
+        self.parent = []
+        self.children = []
+        self.start_time = []
+        self.end_time = []
+        self.origin = []
+        # Child lists sorted by (end_time, start_time), populated by sort_children()
+        self.sorted = None
+
+    def add_node(self, id, **attr) -> int:
+        """Adds a span or updates the attributes of an existing span.
+        Returns the index of the span."""
+        i = self.index.get(id)
+        if i is None:
+            i = len(self.ids)
+            self.index[id] = i
+            self.ids.append(id)
+            self.attrs.append(attr)
+            self.parent.append(ROOT)
+            self.children.append([])
+            self.start_time.append(None)
+            self.end_time.append(None)
+            self.origin.append(None)
+        else:
+            self.attrs[i].update(attr)
+        doc = attr.get('doc')
+        if doc is not None:
+            self.start_time[i] = doc['start_time']
+            self.end_time[i] = doc['end_time']
+            self.origin[i] = doc.get('origin')
+        return i
+
+    def add_edge(self, parent_id, child_id):
+        """Adds a causal relationship and creates empty spans for missing ids."""
+        p = self.index.get(parent_id)
+        if p is None:
+            p = self.add_node(parent_id)
+        c = self.index.get(child_id)
+        if c is None:
+            c = self.add_node(child_id)
+        if self.parent[c] == ROOT:
+            self.parent[c] = p
+            self.children[p].append(c)
+        elif c not in self.children[p]:
+            # Keep the first parent but list the child under every parent like networkx
+            self.children[p].append(c)
+
+    def predecessors(self, id):
+        p = self.parent[self.index[id]]
+        if p == ROOT:
+            return iter(())
+        return iter((self.ids[p],))
+
+    def successors(self, id):
+        ids = self.ids
+        return (ids[c] for c in self.children[self.index[id]])
+
+    def out_degree(self, id) -> int:
+        return len(self.children[self.index[id]])
+
+    def sort_children(self):
+        """Sorts all child lists in ascending order primarily by end_time
+        and secondarily by start_time. The stable sort keeps the insertion order
+        for identical timestamps, which matches sorting the networkx successors."""
+        start_time = self.start_time
+        end_time = self.end_time
+        self.sorted = [
+            sorted(children, key=lambda c: (end_time[c], start_time[c])) if len(children) > 1
+            else children
+            for children in self.children
+        ]
+
+    def sorted_children(self, id) -> list:
+        """Returns the list of child ids sorted by (end_time, start_time)."""
+        if self.sorted is None:
+            self.sort_children()
+        ids = self.ids
+        return [ids[c] for c in self.sorted[self.index[id]]]
@@ -0,0 +1,94 @@
+"""Memory-bounded correlation of disconnected parent and child traces.
+
+The AwsTraceTriggerAnalyzer correlates a parent trace (e.g., Function1) with its child
+trace (e.g., Function2) through a common trace id. Parents or children whose counterpart
+has not been read yet (e.g., lost child traces) remain pending until the end of the file.
+Instead of keeping the raw trace lines of pending traces in memory, the TraceCorrelator
+only keeps their ids and byte offsets within the traces.json file such that the raw
+lines can be re-read by offset once a match completes. If the number of pending traces
+exceeds max_pending, all pending entries are spilled into an on-disk sqlite index.
+Hence, the memory usage is bounded independently of the size of the traces.json file.
+"""
+import sqlite3
+
+# Maximum number of pending traces kept in memory before spilling to disk
+MAX_PENDING_TRACES = 100_000
+PARENT = 'parent'
+CHILD = 'child'
+
+
+def read_line(traces, offset, length) -> str:
+    """Returns the raw trace line at the given byte offset of a file opened in binary mode."""
+    traces.seek(offset)
+    return traces.read(length).decode('utf-8')
+
+
+class TraceCorrelator:
+    """Index of pending parent and child traces by trace id with their
+    byte offset and length within the traces file."""
+
+    def __init__(self, index_file, max_pending=MAX_PENDING_TRACES) -> None:
+        self.index_file = index_file
+        self.max_pending = max_pending
+        # Dictionary: kind (str) => {trace_id (str): (offset, length)}
+        self.pending = {PARENT: dict(), CHILD: dict()}
+        self.num_spilled = 0
+        self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.db is not None:
+            self.db.close()
+
+    def add(self, kind, trace_id, offset, length):
+        """Adds a pending trace and replaces any pending trace with the same id."""
+        pending = self.pending[kind]
+        pending[trace_id] = (offset, length)
+        if len(pending) > self.max_pending:
+            self.spill()
+
+    def pop(self, kind, trace_id):
+        """Removes a pending trace and returns its (offset, length) or None if not pending."""
+        entry = self.pending[kind].pop(trace_id, None)
+        if self.db is not None:
+            row = self.db.execute('SELECT offset, length FROM pending WHERE kind = ? AND trace_id = ?',  # noqa: E501
+                                  (kind, trace_id)).fetchone()
+            if row is not None:
+                self.db.execute('DELETE FROM pending WHERE kind = ? AND trace_id = ?',
+                                (kind, trace_id))
+                # Entries in memory are newer than spilled entries
+                if entry is None:
+                    entry = row
+        return entry
+
+    def spill(self):
+        """Moves all pending entries from memory into the on-disk index."""
+        if self.db is None:
+            self.db = sqlite3.connect(self.index_file)
+            self.db.execute('PRAGMA journal_mode = OFF')
+            self.db.execute('PRAGMA synchronous = OFF')
+            self.db.execute('CREATE TABLE pending (kind TEXT, trace_id TEXT, offset INTEGER, length INTEGER, PRIMARY KEY (kind, trace_id))')  # noqa: E501
+        for kind, pending in self.pending.items():
+            self.db.executemany('INSERT OR REPLACE INTO pending VALUES (?, ?, ?, ?)',
+                                ((kind, trace_id, offset, length)
+                                 for trace_id, (offset, length) in pending.items()))
+            self.num_spilled += len(pending)
+            pending.clear()
+
+    def num_pending(self, kind) -> int:
+        if self.db is None:
+            return len(self.pending[kind])
+        self.spill()
+        return self.db.execute('SELECT COUNT(*) FROM pending WHERE kind = ?',
+                               (kind,)).fetchone()[0]
+
+    def remaining(self, kind):
+        """Yields the (offset, length) of all pending traces of a kind in file order."""
+        if self.db is None:
+            yield from sorted(self.pending[kind].values())
+        else:
+            self.spill()
+            yield from self.db.execute('SELECT offset, length FROM pending WHERE kind = ? ORDER BY offset',  # noqa: E501
+                                       (kind,))
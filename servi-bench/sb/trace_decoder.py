@@ -0,0 +1,35 @@
+"""Pluggable JSON decoder for trace files.
+
+Trace analysis decodes JSON twice per trace: once for the trace line and once
+for every X-Ray segment document nested as string in `Segments[].Document`.
+This module selects the fastest available decoder at import time:
+* orjson: optional dependency (pip install --editable .[fast])
+* json: standard library fallback
+The environment variable SB_JSON_DECODER (e.g., SB_JSON_DECODER=json)
+overrides the automatic selection.
+"""
+import json
+import os
+
+DECODERS = ['orjson', 'json']
+
+
+def get_decoder(name=None):
+    """Returns a tuple (name, loads) for the given decoder name or
+    the first available decoder if no name is provided.
+    Raises an ImportError if the requested decoder is not installed."""
+    if name == 'orjson':
+        import orjson
+        return name, orjson.loads
+    if name == 'json':
+        return name, json.loads
+    if name is not None:
+        raise ValueError(f"Unsupported JSON decoder {name}. Choose one of {DECODERS}.")
+    for candidate in DECODERS:
+        try:
+            return get_decoder(candidate)
+        except ImportError:
+            pass
+
+
+DECODER, loads = get_decoder(os.getenv('SB_JSON_DECODER'))
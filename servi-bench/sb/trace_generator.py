@@ -0,0 +1,391 @@
+"""Synthetic AWS X-Ray trace generator for benchmarking the trace analyzers.
+
+Generates traces.json files with one trace per line in the same format as
+the AwsTraceDownloader (i.e., BatchGetTraces with JSON-encoded segment documents).
+The generated traces mimic the structure of the X-Ray traces from the sb apps:
+* An API Gateway stage invokes a Lambda function synchronously or
+  a Step Functions state machine asynchronously that invokes a sequence of functions.
+* Every function invocation consists of an AWS::Lambda segment and an
+  AWS::Lambda::Function segment with Initialization (cold starts only),
+  Invocation, and Overhead subsegments.
+* Functions call external services (e.g., S3, DynamoDB) and other functions
+  either synchronously or asynchronously (i.e., fan-out within Invocation).
+  Service calls have an inferred downstream segment with the origin of the service.
+* AWS::Lambda::Function segments use a separate clock with jitter close to
+  TIMESTAMP_MARGIN and µs-based timestamps whereas other segments use ms-based timestamps.
+* A configurable share of invalid traces (see INVALID_CASES).
+
+Usage: TraceGenerator(seed=11).write_traces('traces.json', 10_000)
+"""
+import json
+import random
+
+ACCOUNT_ID = '123456789012'
+REGION = 'us-east-1'
+EXTERNAL_SERVICES = [
+    ('S3', 'AWS::S3::Bucket'),
+    ('DynamoDB', 'AWS::DynamoDB::Table'),
+    ('SQS', 'AWS::SQS::Queue')
+]
+# Invalid cases supported by the generator
+# * in_progress: a segment is still in progress and has no end_time
+# * missing_root: the segment containing the root has not been received
+# * missing_parent: a segment refers to a parent that has not been received
+INVALID_CASES = ['in_progress', 'missing_root', 'missing_parent']
+# Name of the custom trace annotation to correlate disconnected trigger traces
+ROOT_TRACE_ID = 'root_trace_id'
+# Seconds between the start of two consecutive traces
+TRACE_INTERVAL = 0.1
+
+
+def ms(t) -> float:
+    """Rounds a timestamp to millisecond precision."""
+    return round(t, 3)
+
+
+def us(t) -> float:
+    """Rounds a timestamp to microsecond precision."""
+    return round(t, 6)
+
+
+def encode_document(doc) -> str:
+    """Encodes a segment document compactly like X-Ray does,
+    which the regex-based correlation in AwsTraceTriggerAnalyzer relies upon."""
+    return json.dumps(doc, separators=(',', ':'))
+
+
+class TraceGenerator:
+    """Generates synthetic X-Ray traces with configurable shape:
+    * fan_out: number of downstream calls within each function invocation
+    * depth: maximum nesting depth of function-to-function calls
+    * async_ratio: probability that a function call is asynchronous
+    * cold_start_ratio: probability of a cold start (i.e., Initialization subsegment)
+    * step_functions_ratio: probability of a Step Functions workflow
+    * num_states: number of sequential states in a Step Functions workflow
+    * jitter_us: maximum clock jitter of AWS::Lambda::Function segments in µs
+    * invalid_ratio: probability of an invalid trace (see INVALID_CASES)
+    """
+
+    def __init__(self, seed=11, fan_out=2, depth=2, async_ratio=0.2, cold_start_ratio=0.1,
+                 step_functions_ratio=0.1, num_states=3, jitter_us=500, invalid_ratio=0.05,
+                 start_time=1_650_000_000.0) -> None:
+        self.rng = random.Random(seed)
+        self.fan_out = fan_out
+        self.depth = depth
+        self.async_ratio = async_ratio
+        self.cold_start_ratio = cold_start_ratio
+        self.step_functions_ratio = step_functions_ratio
+        self.num_states = num_states
+        self.jitter_us = jitter_us
+        self.invalid_ratio = invalid_ratio
+        self.start_time = start_time
+        self.num_functions = max(fan_out, num_states) + 1
+
+    def trace_id(self, t) -> str:
+        return f"1-{int(t):08x}-{self.rng.getrandbits(96):024x}"
+
+    def segment_id(self) -> str:
+        return f"{self.rng.getrandbits(64):016x}"
+
+    def latency(self, low_ms, high_ms) -> float:
+        """Returns a random latency in seconds."""
+        return self.rng.uniform(low_ms, high_ms) / 1000
+
+    def write_traces(self, path, num_traces) -> int:
+        """Writes num_traces traces into a traces.json file and
+        returns the number of intentionally invalid traces."""
+        num_invalid = 0
+        with open(path, 'w') as f:
+            for trace, invalid_case in self.traces(num_traces):
+                f.write(json.dumps(trace) + '\n')
+                num_invalid += invalid_case is not None
+        return num_invalid
+
+    def traces(self, num_traces):
+        """Yields tuples with a trace and its invalid case or None for valid traces."""
+        for i in range(num_traces):
+            t0 = self.start_time + i * TRACE_INTERVAL
+            invalid_case = None
+            if self.rng.random() < self.invalid_ratio:
+                invalid_case = self.rng.choice(INVALID_CASES)
+            yield self.trace(t0, invalid_case), invalid_case
+
+    def trace(self, t0, invalid_case=None) -> dict:
+        """Returns a single trace starting at t0."""
+        trace_id = self.trace_id(t0)
+        if self.rng.random() < self.step_functions_ratio:
+            segments = self.step_functions_segments(trace_id, t0)
+        else:
+            segments = self.api_segments(trace_id, t0)
+        return self.to_trace(trace_id, segments, invalid_case)
+
+    def to_trace(self, trace_id, segments, invalid_case=None) -> dict:
+        start = min(s['start_time'] for s in segments)
+        end = max(s['end_time'] for s in segments)
+        if invalid_case == 'in_progress':
+            segment = self.rng.choice(segments)
+            del segment['end_time']
+            segment['in_progress'] = True
+        elif invalid_case == 'missing_root':
+            segments = [s for s in segments if 'parent_id' in s]
+        elif invalid_case == 'missing_parent':
+            segment = self.rng.choice([s for s in segments if 'parent_id' in s])
+            segment['parent_id'] = self.segment_id()
+        # X-Ray returns the segments in arbitrary order
+        self.rng.shuffle(segments)
+        return {
+            'Id': trace_id,
+            'Duration': ms(end - start),
+            'LimitExceeded': False,
+            'Segments': [{'Id': s['id'], 'Document': encode_document(s)} for s in segments]
+        }
+
+    def write_trigger_traces(self, path, num_traces, connected_ratio=0.0, window=10) -> int:
+        """Writes num_traces trigger traces (see trigger_traces) into a traces.json file
+        and returns the number of intentionally invalid trigger traces."""
+        num_invalid = 0
+        with open(path, 'w') as f:
+            for trace, invalid_case, is_child in self.trigger_traces(num_traces, connected_ratio,
+                                                                     window):
+                f.write(json.dumps(trace) + '\n')
+                # Count every trigger only once
+                num_invalid += invalid_case is not None and not is_child
+        return num_invalid
+
+    def trigger_traces(self, num_traces, connected_ratio=0.0, window=10):
+        """Yields traces following the TriggerBench trace model expected by
+        the AwsTraceTriggerAnalyzer: Function1 (InfraLambda) triggers Function2 (TriggerLambda)
+        through an external service. Asynchronous triggers result in disconnected
+        parent and child traces correlated through the root_trace_id annotation.
+        A share of connected_ratio triggers results in a single connected trace.
+        Disconnected traces are shuffled within a window of pending traces
+        such that children can appear before their parents.
+        Yields tuples with a trace, the invalid case of its trigger (i.e., in_progress or error),
+        and whether it is the child trace of a disconnected trigger."""
+        pending = []
+        for i in range(num_traces):
+            t0 = self.start_time + i * TRACE_INTERVAL
+            invalid_case = None
+            if self.rng.random() < self.invalid_ratio:
+                invalid_case = self.rng.choice(['in_progress', 'error'])
+            for index, trace in enumerate(self.trigger_trace(t0, connected_ratio, invalid_case)):
+                pending.append((trace, invalid_case, index > 0))
+            while len(pending) > window:
+                yield pending.pop(self.rng.randrange(len(pending)))
+        self.rng.shuffle(pending)
+        yield from pending
+
+    def trigger_trace(self, t0, connected_ratio=0.0, invalid_case=None) -> list:
+        """Returns a list with the parent and child trace of a trigger or
+        a list with a single trace if the trigger is connected."""
+        parent_id = self.trace_id(t0)
+        connected = self.rng.random() < connected_ratio
+        parent = self.trigger_function(parent_id, 'InfraLambda-prod', t0)
+        invoke = self.subsegment('storage_trigger', parent[1]['start_time'] + self.latency(1, 5),
+                                 namespace='aws', precision=us)
+        invoke['end_time'] = us(invoke['start_time'] + self.latency(20, 100))
+        if connected:
+            child_id = parent_id
+            child = self.trigger_function(child_id, 'TriggerLambda-prod',
+                                          invoke['start_time'] + self.latency(5, 20),
+                                          parent_id=invoke['id'])
+        else:
+            child_id = self.trace_id(t0)
+            child = self.trigger_function(child_id, 'TriggerLambda-prod',
+                                          invoke['end_time'] + self.latency(20, 200))
+        # Trace model: receiver timestamps in Function2
+        t = child[1]['start_time'] + self.latency(1, 5)
+        receivers = []
+        for n in range(6):
+            receiver = self.subsegment(f"receiver{n}", t, precision=us)
+            if n == 0 and not connected:
+                receiver['annotations'] = {ROOT_TRACE_ID: parent_id}
+            t += self.latency(0, 2)
+            receiver['end_time'] = us(t)
+            receivers.append(receiver)
+        self.finish_trigger_function(child, receivers, t)
+        t = max(invoke['end_time'], child[0]['end_time']) if connected else invoke['end_time']
+        self.finish_trigger_function(parent, [invoke], t)
+        segments = [parent, child] if not connected else [parent + child]
+        if invalid_case == 'error':
+            self.rng.choice(segments[0])['error'] = True
+        traces = []
+        for trace_id, trace_segments in zip([parent_id, child_id], segments):
+            # The last trace (i.e., the child trace if disconnected) might be in progress
+            in_progress = invalid_case == 'in_progress' and trace_segments is segments[-1]
+            traces.append(self.to_trace(trace_id, trace_segments,
+                                        'in_progress' if in_progress else None))
+        return traces
+
+    def trigger_function(self, trace_id, name, start_time, parent_id=None) -> list:
+        """Returns the AWS::Lambda and AWS::Lambda::Function segments of a function
+        without end times and subsegments (see finish_trigger_function)."""
+        lambda_segment = self.segment(trace_id, name, 'AWS::Lambda', start_time,
+                                      parent_id=parent_id)
+        lambda_segment['resource_arn'] = f"arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:{name}"
+        t = start_time + self.latency(5, 20)
+        subsegments = []
+        if self.rng.random() < self.cold_start_ratio:
+            init = self.subsegment('Initialization', t + self.latency(100, 300), precision=us)
+            t = init['start_time'] + self.latency(100, 500)
+            init['end_time'] = us(t)
+            subsegments.append(init)
+            t += self.latency(5, 15)
+        function = self.segment(trace_id, name, 'AWS::Lambda::Function', t,
+                                parent_id=lambda_segment['id'], precision=us)
+        function['subsegments'] = subsegments
+        return [lambda_segment, function]
+
+    def finish_trigger_function(self, segments, calls, t):
+        """Adds the Invocation and Overhead subsegments and the end times."""
+        lambda_segment, function = segments[:2]
+        invocation = self.subsegment('Invocation', function['start_time'], precision=us)
+        invocation['subsegments'] = calls
+        invocation['end_time'] = us(t + self.latency(1, 5))
+        overhead = self.subsegment('Overhead', invocation['end_time'], precision=us)
+        overhead['end_time'] = us(overhead['start_time'] + self.latency(0, 2))
+        function['subsegments'].extend([invocation, overhead])
+        function['end_time'] = overhead['end_time']
+        lambda_segment['end_time'] = ms(function['end_time'] + self.latency(1, 2))
+
+    def api_segments(self, trace_id, t0) -> list:
+        """API Gateway invoking a function synchronously."""
+        api = self.segment(trace_id, 'prod-app/prod', 'AWS::ApiGateway::Stage', t0)
+        api['resource_arn'] = f"arn:aws:apigateway:{REGION}::/restapis/synth/stages/prod"
+        api['http'] = {'request': {'url': 'https://synth.execute-api.us-east-1.amazonaws.com/prod/run', 'method': 'POST'}}  # noqa: E501
+        call = self.subsegment('Lambda', t0 + self.latency(2, 10), namespace='aws')
+        segments = self.function_segments(trace_id, call, 'app-prod-entry', self.depth)
+        call['end_time'] = ms(segments[0]['end_time'] + self.latency(1, 3))
+        api['subsegments'] = [call]
+        api['end_time'] = ms(call['end_time'] + self.latency(1, 3))
+        return [api] + segments
+
+    def step_functions_segments(self, trace_id, t0) -> list:
+        """API Gateway starting a Step Functions workflow asynchronously
+        that invokes a sequence of functions synchronously."""
+        api = self.segment(trace_id, 'prod-workflow/prod', 'AWS::ApiGateway::Stage', t0)
+        api['resource_arn'] = f"arn:aws:apigateway:{REGION}::/restapis/synth/stages/prod"
+        api['http'] = {'request': {'url': 'https://synth.execute-api.us-east-1.amazonaws.com/prod/execute', 'method': 'POST'}}  # noqa: E501
+        start_call = self.subsegment('STEPFUNCTIONS', t0 + self.latency(20, 40), namespace='aws')
+        start_call['end_time'] = ms(start_call['start_time'] + self.latency(40, 80))
+        api['subsegments'] = [start_call]
+        api['end_time'] = ms(start_call['end_time'] + self.latency(1, 3))
+        workflow = self.segment(trace_id, 'Workflow', 'AWS::StepFunctions::StateMachine',
+                                start_call['start_time'] + self.latency(10, 20),
+                                parent_id=start_call['id'])
+        workflow['resource_arn'] = f"arn:aws:states:{REGION}:{ACCOUNT_ID}:stateMachine:Workflow"
+        segments = [api, workflow]
+        states = []
+        t = workflow['start_time']
+        for n in range(self.num_states):
+            state = self.subsegment(f"State{n}", t + self.latency(1, 5))
+            call = self.subsegment('Lambda', state['start_time'] + self.latency(1, 3),
+                                   namespace='aws')
+            function_segments = self.function_segments(trace_id, call, f"workflow-prod-state{n}",
+                                                       self.depth - 1, async_calls=False)
+            call['end_time'] = ms(function_segments[0]['end_time'] + self.latency(1, 3))
+            state['end_time'] = ms(call['end_time'] + self.latency(0, 1))
+            state['subsegments'] = [call]
+            states.append(state)
+            segments.extend(function_segments)
+            t = state['end_time']
+        workflow['subsegments'] = states
+        workflow['end_time'] = ms(t + self.latency(1, 3))
+        return segments
+
+    def function_segments(self, trace_id, call, name, depth, async_calls=True,
+                          start_time=None) -> list:
+        """Returns the segments of a function invoked by the given call subsegment
+        with the AWS::Lambda segment first. The function starts shortly after
+        the start_time, which defaults to the start_time of the call."""
+        if start_time is None:
+            start_time = call['start_time']
+        lambda_segment = self.segment(trace_id, name, 'AWS::Lambda',
+                                      start_time + self.latency(1, 5),
+                                      parent_id=call['id'])
+        lambda_segment['resource_arn'] = f"arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:{name}"
+        # AWS::Lambda::Function segments use a separate clock with jitter
+        jitter = self.rng.uniform(-self.jitter_us, self.jitter_us) / 1_000_000
+        t = lambda_segment['start_time'] + self.latency(5, 20)
+        subsegments = []
+        if self.rng.random() < self.cold_start_ratio:
+            # Implicit container initialization followed by runtime initialization
+            t += self.latency(100, 300)
+            init = self.subsegment('Initialization', t + jitter, precision=us)
+            t += self.latency(100, 500)
+            init['end_time'] = us(t + jitter)
+            subsegments.append(init)
+            t += self.latency(5, 15)
+        function = self.segment(trace_id, name, 'AWS::Lambda::Function', t + jitter,
+                                parent_id=lambda_segment['id'], precision=us)
+        invocation = self.subsegment('Invocation', t + jitter, precision=us)
+        segments = []
+        invocation_calls = []
+        for _ in range(self.fan_out):
+            t += self.latency(1, 20)
+            if depth > 0 and self.rng.random() < 0.5:
+                # Call another function
+                is_async = async_calls and self.rng.random() < self.async_ratio
+                child_call = self.subsegment('Lambda', t + jitter, namespace='aws', precision=us)
+                child_name = f"{name}-{self.rng.randrange(self.num_functions)}"
+                if is_async:
+                    # The caller only waits for the event to be accepted and
+                    # the function starts after queuing
+                    t += self.latency(10, 30)
+                    child_segments = self.function_segments(
+                        trace_id, child_call, child_name, depth - 1, async_calls,
+                        start_time=t + self.latency(10, 50))
+                else:
+                    child_segments = self.function_segments(trace_id, child_call, child_name,
+                                                            depth - 1, async_calls)
+                    t = child_segments[0]['end_time'] - jitter + self.latency(1, 3)
+                child_call['end_time'] = us(t + jitter)
+                invocation_calls.append(child_call)
+                segments.extend(child_segments)
+            else:
+                # Call an external service
+                service, origin = self.rng.choice(EXTERNAL_SERVICES)
+                service_call = self.subsegment(service, t + jitter, namespace='aws',
+                                               precision=us)
+                t += self.latency(5, 50)
+                service_call['end_time'] = us(t + jitter)
+                invocation_calls.append(service_call)
+                # X-Ray infers a downstream segment of the service from the call
+                inferred = self.segment(trace_id, service, origin, service_call['start_time'],
+                                        parent_id=service_call['id'])
+                inferred['end_time'] = ms(service_call['end_time'])
+                inferred['inferred'] = True
+                segments.append(inferred)
+        t += self.latency(1, 50)
+        invocation['end_time'] = us(t + jitter)
+        invocation['subsegments'] = invocation_calls
+        overhead = self.subsegment('Overhead', t + jitter, precision=us)
+        t += self.latency(0, 2)
+        overhead['end_time'] = us(t + jitter)
+        function['end_time'] = us(t + jitter)
+        function['subsegments'] = subsegments + [invocation, overhead]
+        # The AWS::Lambda segment ends after the function using ms-based timestamps
+        lambda_segment['end_time'] = ms(t + self.latency(1, 2))
+        return [lambda_segment, function] + segments
+
+    def segment(self, trace_id, name, origin, start_time, parent_id=None, precision=ms) -> dict:
+        segment = {
+            'id': self.segment_id(),
+            'name': name,
+            'start_time': precision(start_time),
+            'trace_id': trace_id
+        }
+        if parent_id is not None:
+            segment['parent_id'] = parent_id
+        segment['origin'] = origin
+        return segment
+
+    def subsegment(self, name, start_time, namespace=None, precision=ms) -> dict:
+        subsegment = {
+            'id': self.segment_id(),
+            'name': name,
+            'start_time': precision(start_time)
+        }
+        if namespace is not None:
+            subsegment['namespace'] = namespace
+        return subsegment
@@ -0,0 +1,83 @@
+"""Interned critical-path signatures of the trace breakdown.
+
+Traces of the same app mostly follow a few unique longest paths. Instead of repeating
+the span names of the longest path in every trace breakdown row, the AwsTraceAnalyzer
+writes a stable path_id per trace and saves the span names of every unique path once
+into the path dictionary trace_paths.json. Thus, classifying traces by their path
+(e.g., request types) only needs to process every unique path once.
+
+The path_id is a hash of the span names without Initialization subsegments,
+such that cold and warm invocations of the same path share the same path_id
+(the number of cold starts is available as num_cold_starts).
+Being stable across runs, the path_id can be compared across executions.
+"""
+from functools import lru_cache
+from pathlib import Path
+import hashlib
+import json
+import os
+
+PATHS_FILE = 'trace_paths.json'
+PATHS_VERSION = 1
+
+
+def normalize_path(names) -> list:
+    """Removes Initialization subsegments from a list of span names."""
+    return [name for name in names if name != 'Initialization']
+
+
+@lru_cache(maxsize=4096)
+def path_signature(names: tuple) -> str:
+    """Returns the stable path_id of a tuple of span names.
+    Caches the ids of recent paths because most traces share a few unique paths."""
+    normalized = json.dumps(normalize_path(names))
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+
+
+class TracePaths:
+    """Path dictionary with the normalized span names and number of traces per path_id.
+    Keeps the paths in order of their first occurrence."""
+
+    def __init__(self) -> None:
+        # Dictionary: path_id (str) => {'names': list of span names, 'num_traces': int}
+        self.paths = dict()
+
+    def add(self, path_id, names):
+        path = self.paths.get(path_id)
+        if path is None:
+            path = self.paths[path_id] = {'names': normalize_path(names), 'num_traces': 0}
+        path['num_traces'] += 1
+
+    def merge(self, other):
+        for path_id, other_path in other.paths.items():
+            path = self.paths.get(path_id)
+            if path is None:
+                path = self.paths[path_id] = {'names': other_path['names'], 'num_traces': 0}
+            path['num_traces'] += other_path['num_traces']
+        return self
+
+    def names(self, path_id) -> list:
+        return self.paths[path_id]['names']
+
+    def to_dict(self) -> dict:
+        return {'version': PATHS_VERSION, 'paths': self.paths}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != PATHS_VERSION:
+            raise ValueError(f"Unsupported paths version {data.get('version')}.")
+        trace_paths = cls()
+        trace_paths.paths = data['paths']
+        return trace_paths
+
+    def save(self, paths_file):
+        """Atomically replaces the path dictionary file."""
+        tmp_file = Path(str(paths_file) + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp_file, paths_file)
+
+    @classmethod
+    def load(cls, paths_file):
+        with open(paths_file, 'r') as f:
+            return cls.from_dict(json.load(f))
@@ -38,6 +38,14 @@ setup(
         'dev': [
             'pytest>=6.2.5,<7',
             'flake8>=4.0.1,<5'
+        ],
+        # Faster JSON decoding for trace analysis
+        'fast': [
+            'orjson>=3.6.1,<4'
+        ],
+        # Columnar trace breakdown output
+        'parquet': [
+            'pyarrow>=6.0.1'
         ]
     },
     entry_points='''
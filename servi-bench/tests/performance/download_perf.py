@@ -0,0 +1,156 @@
+"""Offline benchmark suite of the X-Ray and Azure Insights trace downloads over HTTP.
+
+Serves synthetic traces through the local stand-in services (see sb.local_xray.XRayServer
+and sb.local_insights.InsightsReplayServer) and downloads them with the endpoint_url of
+the AwsTraceDownloader and AzureTraceDownloader. Reports the traces per second,
+the number of requests, throttled requests, unprocessed trace ids, HTTP connections,
+and optionally the peak memory of the download per scenario and number of workers:
+* xray: GetTraceSummaries and BatchGetTraces through the boto3 client
+* xray_client: GetTraceSummaries and BatchGetTraces on the LocalXRayClient without HTTP
+* insights: the trace ids query and one union query per trace
+* insights_bulk: time-sliced table queries correlated locally
+
+Usage:
+python tests/performance/download_perf.py --size 1000 --workers 1 8
+python tests/performance/download_perf.py --scenarios xray --throttle_rate 0.05 --memory
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+
+from sb.aws_trace_downloader import AwsTraceDownloader
+from sb.azure_trace_downloader import AzureTraceDownloader
+from sb.local_insights import InsightsReplayServer, write_synthetic_traces
+from sb.local_xray import LocalXRayClient, XRayServer
+from sb.trace_generator import TraceGenerator
+
+SCENARIOS = ['xray', 'xray_client', 'insights', 'insights_bulk']
+# Start of the synthetic Insights traces
+INSIGHTS_START = datetime(2022, 2, 1, tzinfo=timezone.utc)
+
+
+class LocalSpec(SimpleNamespace):
+    """Subset of a benchmark spec used by the trace downloaders."""
+
+    def __getitem__(self, key):
+        return {'region': 'us-east-1'}[key]
+
+
+def local_spec(start, end, log_path) -> LocalSpec:
+    return LocalSpec(event_log=SimpleNamespace(get_invoke_timespan=lambda: (start, end)),
+                     logs_directory=lambda: log_path)
+
+
+def count_lines(path) -> int:
+    return len(path.read_text().splitlines()) if path.exists() else 0
+
+
+def download_xray(tmp_dir, log_path, workers, args, http=True) -> dict:
+    client = LocalXRayClient.from_file(Path(tmp_dir) / 'xray.json', latency=args.latency,
+                                       summaries_page_size=args.summaries_page_size,
+                                       traces_page_size=args.traces_page_size,
+                                       max_concurrency=args.max_concurrency,
+                                       throttle_rate=args.throttle_rate,
+                                       unprocessed_rate=args.unprocessed_rate)
+    start = datetime.fromtimestamp(client.start_times[0][0], tz=timezone.utc)
+    end = datetime.fromtimestamp(client.start_times[-1][0] + 1, tz=timezone.utc)
+    spec = local_spec(start, end, log_path)
+    if http:
+        with XRayServer(client) as server:
+            AwsTraceDownloader(spec, workers=workers, endpoint_url=server.url).get_traces()
+    else:
+        AwsTraceDownloader(spec, workers=workers, client=client).get_traces()
+    return {'requests': client.num_requests, 'throttled': client.num_throttled,
+            'unprocessed': count_lines(log_path / 'unprocessed_trace_ids.txt'),
+            'connections': None}
+
+
+def download_insights(tmp_dir, log_path, workers, args, bulk=False) -> dict:
+    end = INSIGHTS_START + timedelta(seconds=args.size)
+    with InsightsReplayServer.from_file(Path(tmp_dir) / 'insights.json', latency=args.latency,
+                                        max_concurrency=args.max_concurrency,
+                                        throttle_rate=args.throttle_rate,
+                                        retry_after=args.retry_after,
+                                        row_limit=args.row_limit) as server:
+        AzureTraceDownloader(local_spec(INSIGHTS_START, end, log_path), bulk=bulk,
+                             workers=workers, endpoint_url=server.url).get_traces()
+    return {'requests': server.num_requests, 'throttled': server.num_throttled,
+            'unprocessed': 0, 'connections': server.num_connections}
+
+
+def measure(tmp_dir, scenario, workers, args) -> dict:
+    log_path = Path(tmp_dir) / f"{scenario}_{workers}"
+    log_path.mkdir()
+    if args.memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if scenario.startswith('xray'):
+        result = download_xray(tmp_dir, log_path, workers, args, http=scenario == 'xray')
+    else:
+        result = download_insights(tmp_dir, log_path, workers, args,
+                                   bulk=scenario == 'insights_bulk')
+    seconds = time.perf_counter() - start
+    peak_mb = None
+    if args.memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    result.update({
+        'scenario': scenario,
+        'workers': workers,
+        'seconds': seconds,
+        'traces_per_second': count_lines(log_path / 'traces.json') / seconds,
+        'peak_mb': peak_mb,
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--size', type=int, default=1000, help='Number of generated traces.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8],
+                        help='Number of concurrent requests.')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds per simulated request.')
+    parser.add_argument('--max_concurrency', type=int, default=16,
+                        help='Number of concurrent requests before throttling.')
+    parser.add_argument('--throttle_rate', type=float, default=0.0,
+                        help='Probability of throttling a request.')
+    parser.add_argument('--retry_after', type=int, default=None,
+                        help='Seconds of the Retry-After header of throttled Insights queries.')
+    parser.add_argument('--unprocessed_rate', type=float, default=0.0,
+                        help='Probability of returning an X-Ray trace id as unprocessed.')
+    parser.add_argument('--summaries_page_size', type=int, default=100,
+                        help='Number of X-Ray trace summaries per page.')
+    parser.add_argument('--traces_page_size', type=int, default=5,
+                        help='Number of X-Ray traces per BatchGetTraces page.')
+    parser.add_argument('--row_limit', type=int, default=None,
+                        help='Maximum number of rows per Insights table query.')
+    parser.add_argument('--memory', action='store_true',
+                        help='Trace the peak memory of Python allocations (slower).')
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    # Credentials are required but ignored by the local services
+    for name in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'INSIGHTS_APP_ID',
+                 'INSIGHTS_API_KEY']:
+        os.environ.setdefault(name, 'local')
+    with TemporaryDirectory() as tmp_dir:
+        TraceGenerator(seed=args.seed).write_traces(Path(tmp_dir) / 'xray.json', args.size)
+        write_synthetic_traces(Path(tmp_dir) / 'insights.json', args.size, INSIGHTS_START)
+        print(f"{'scenario':>13} {'workers':>7} {'seconds':>9} {'traces/s':>9} {'requests':>9} {'throttled':>9} {'unprocessed':>11} {'connections':>11} {'peak_mb':>8}")  # noqa: E501
+        for scenario in args.scenarios:
+            for workers in args.workers:
+                r = measure(tmp_dir, scenario, workers, args)
+                connections = '-' if r['connections'] is None else r['connections']
+                peak_mb = '-' if r['peak_mb'] is None else f"{r['peak_mb']:.1f}"
+                print(f"{r['scenario']:>13} {r['workers']:>7} {r['seconds']:>9.1f} {r['traces_per_second']:>9.0f} {r['requests']:>9} {r['throttled']:>9} {r['unprocessed']:>11} {connections:>11} {peak_mb:>8}")  # noqa: E501
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Throughput and memory benchmark suite for the AWS trace analyzers.
+
+Generates synthetic traces (see sb.trace_generator) and reports traces per second and
+peak RSS of the AwsTraceAnalyzer and AwsTraceTriggerAnalyzer for every dataset size.
+Every analysis runs in a fresh subprocess such that the peak RSS is not inflated
+by previous runs or the trace generation.
+Comparing against a previous result file detects throughput regressions.
+
+Usage:
+python tests/performance/trace_analyzer_perf.py --sizes 10000 100000 1000000 --output perf.json
+python tests/performance/trace_analyzer_perf.py --baseline perf.json --tolerance 0.2
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from sb.aws_trace_analyzer import AwsTraceAnalyzer
+from sb.aws_trace_trigger_analyzer import AwsTraceTriggerAnalyzer
+from sb.trace_generator import TraceGenerator
+
+ANALYZERS = ['aws', 'trigger']
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak RSS of this process and its terminated children in MB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + \
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return maxrss / 1e6
+    return maxrss / 1e3
+
+
+def generate(data_dir, analyzer, size, seed) -> Path:
+    """Generates a traces.json file unless it already exists and returns its path."""
+    traces_dir = Path(data_dir) / f"{analyzer}_{size}_{seed}"
+    traces_path = traces_dir / 'traces.json'
+    if not traces_path.is_file():
+        traces_dir.mkdir(parents=True, exist_ok=True)
+        generator = TraceGenerator(seed=seed)
+        if analyzer == 'trigger':
+            generator.write_trigger_traces(traces_path, size)
+        else:
+            generator.write_traces(traces_path, size)
+    return traces_path
+
+
+def run(analyzer, traces_path, workers, span_tree):
+    """Runs a single analysis and prints the elapsed time and peak RSS as JSON."""
+    start = time.perf_counter()
+    if analyzer == 'trigger':
+        AwsTraceTriggerAnalyzer(traces_path, workers=workers).analyze_traces()
+    else:
+        AwsTraceAnalyzer(traces_path, workers=workers, span_tree=span_tree,
+                         force=True).analyze_traces()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'seconds': elapsed, 'peak_rss_mb': peak_rss_mb()}))
+
+
+def measure(analyzer, traces_path, workers, span_tree) -> dict:
+    cmd = [sys.executable, __file__, '--run', analyzer, str(traces_path),
+           '--workers', str(workers)]
+    if span_tree:
+        cmd.append('--span_tree')
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def check_regressions(results, baseline_file, tolerance) -> list:
+    """Returns a list of regressions where the throughput dropped by more than the tolerance."""
+    with open(baseline_file) as f:
+        baseline = {(r['analyzer'], r['size']): r for r in json.load(f)}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['analyzer'], result['size']))
+        if previous and result['traces_per_second'] < previous['traces_per_second'] * (1 - tolerance):  # noqa: E501
+            regressions.append(f"{result['analyzer']} ({result['size']} traces): {result['traces_per_second']:.0f} < {previous['traces_per_second']:.0f} traces/s")  # noqa: E501
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000],
+                        help='Number of generated traces per dataset.')
+    parser.add_argument('--analyzers', nargs='+', default=ANALYZERS, choices=ANALYZERS)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes of the analyzers.')
+    parser.add_argument('--span_tree', action='store_true',
+                        help='Use the compact span tree in the AwsTraceAnalyzer.')
+    parser.add_argument('--seed', type=int, default=11)
+    parser.add_argument('--data_dir', help='Directory to keep generated datasets across runs.')
+    parser.add_argument('--output', help='Save results as JSON file.')
+    parser.add_argument('--baseline', help='Compare against results from a previous run.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Maximum tolerated relative throughput drop against the baseline.')
+    parser.add_argument('--run', nargs=2, metavar=('ANALYZER', 'TRACES_PATH'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        run(args.run[0], args.run[1], args.workers, args.span_tree)
+        return
+
+    with TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        results = []
+        print(f"{'analyzer':<8} {'traces':>9} {'seconds':>9} {'traces/s':>9} {'peak RSS [MB]':>14}")  # noqa: E501
+        for analyzer in args.analyzers:
+            for size in args.sizes:
+                traces_path = generate(data_dir, analyzer, size, args.seed)
+                result = measure(analyzer, traces_path, args.workers, args.span_tree)
+                result.update({
+                    'analyzer': analyzer,
+                    'size': size,
+                    'traces_per_second': size / result['seconds']
+                })
+                results.append(result)
+                print(f"{analyzer:<8} {size:>9} {result['seconds']:>9.1f} {result['traces_per_second']:>9.0f} {result['peak_rss_mb']:>14.1f}")  # noqa: E501
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Compares the trace analysis throughput of the available JSON decoders.
+
+Replicates the AWS trace analyzer fixtures into a large traces.json and reports
+traces per second for decoding only and for the full trace breakdown analysis.
+
+Usage: python tests/performance/trace_decoder_perf.py --repeat 2000
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import sb.aws_trace_analyzer as analyzer
+from sb.aws_trace_analyzer import AwsTraceAnalyzer
+from sb.trace_decoder import DECODERS, get_decoder
+
+fixtures_dir = Path(__file__).parent.parent / 'fixtures' / 'aws_trace_analyzer'
+
+
+def replicate_fixtures(traces_path, repeat) -> int:
+    """Writes all fixture traces repeat times as one trace per line
+    into traces_path and returns the number of written traces."""
+    lines = []
+    for fixture in sorted(fixtures_dir.glob('*/traces.json')):
+        with open(fixture) as f:
+            # Some fixtures are pretty-printed multi-line JSON
+            lines.append(json.dumps(json.load(f)))
+    with open(traces_path, 'w') as f:
+        for _ in range(repeat):
+            for line in lines:
+                f.write(line + '\n')
+    return len(lines) * repeat
+
+
+def decode_only(traces_path, loads):
+    with open(traces_path, 'rb') as f:
+        for line in f:
+            trace = loads(line)
+            for segment in trace['Segments']:
+                loads(segment['Document'])
+
+
+def analyze(traces_path, loads):
+    analyzer.loads = loads
+    AwsTraceAnalyzer(traces_path).analyze_traces()
+
+
+def measure(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=1000,
+                        help='Number of times to replicate all fixture traces.')
+    args = parser.parse_args()
+    with TemporaryDirectory() as tmp_dir:
+        traces_path = Path(tmp_dir) / 'traces.json'
+        num_traces = replicate_fixtures(traces_path, args.repeat)
+        size_mb = traces_path.stat().st_size / 1e6
+        print(f"{num_traces} traces ({size_mb:.1f} MB)")
+        print(f"{'decoder':<8} {'decode [traces/s]':>18} {'analyze [traces/s]':>19}")
+        for name in DECODERS:
+            try:
+                _, loads = get_decoder(name)
+            except ImportError:
+                print(f"{name:<8} not installed")
+                continue
+            decode_time = measure(decode_only, traces_path, loads)
+            analyze_time = measure(analyze, traces_path, loads)
+            print(f"{name:<8} {num_traces / decode_time:>18.0f} {num_traces / analyze_time:>19.0f}")
+
+
+if __name__ == '__main__':
+    main()
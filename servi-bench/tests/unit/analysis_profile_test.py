@@ -0,0 +1,62 @@
+import json
+import sys
+
+import pytest
+
+from sb.analysis_profile import StageProfiler, exception_site
+
+
+def outer(n):
+    return inner(n) + 1
+
+
+def inner(n):
+    if n < 0:
+        raise ValueError('negative')
+    return n
+
+
+def test_instrument_exclusive_time():
+    profiler = StageProfiler()
+    with profiler.instrument(__name__, ['outer', 'inner']):
+        assert outer(1) == 2
+        assert outer(2) == 3
+    module = sys.modules[__name__]
+    assert module.outer is outer
+    assert module.inner is inner
+    assert profiler.stages['outer'][0] == 2
+    assert profiler.stages['inner'][0] == 2
+    assert profiler.stack == []
+    assert all(seconds >= 0 for _, seconds in profiler.stages.values())
+
+
+def test_count_invalid():
+    profiler = StageProfiler()
+    for n in [-1, -2, 1]:
+        try:
+            outer(n)
+        except ValueError as e:
+            profiler.count_invalid(e)
+    site = exception_site(ValueError())
+    assert site == 'unknown'
+    profile = profiler.to_dict()
+    [(site, invalid)] = profile['invalid_sites'].items()
+    assert site.startswith('analysis_profile_test.py:') and site.endswith('(inner)')
+    assert invalid == {'count': 2, 'example': 'negative'}
+
+
+def test_merge_and_save(tmp_path):
+    profiler = StageProfiler()
+    with profiler.instrument(__name__, ['inner']):
+        with pytest.raises(ValueError):
+            outer(-1)
+    worker = StageProfiler()
+    with worker.instrument(__name__, ['inner']):
+        outer(1)
+    profiler.merge(worker.to_dict())
+    assert profiler.stages['inner'][0] == 2
+    profile_file = tmp_path / 'analysis_profile.json'
+    profiler.save(profile_file, 'TestAnalyzer', 1.0, 1, 0)
+    profile = json.loads(profile_file.read_text())
+    assert profile['analyzer'] == 'TestAnalyzer'
+    assert profile['stages']['inner']['calls'] == 2
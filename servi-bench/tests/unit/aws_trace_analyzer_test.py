@@ -3,10 +3,18 @@ import csv
 import sys
 from pathlib import Path
 import datetime
+from types import SimpleNamespace
 import pytest
 import networkx as nx
 
-from sb.aws_trace_analyzer import CSV_FIELDS, extract_trace_breakdown, longest_path, create_span_graph, duration, get_sorted_children, is_async_call, call_stack  # noqa: E501
+import sb.aws_trace_analyzer as aws_trace_analyzer
+from sb.analysis_profile import PROFILE_FILE
+from sb.aws_trace_downloader import AwsTraceDownloader
+from sb.local_xray import LocalXRayClient
+from sb.trace_generator import TraceGenerator
+from sb.breakdown_sketches import SKETCHES_FILE, BreakdownSketches
+from sb.trace_paths import PATHS_FILE, TracePaths, normalize_path
+from sb.aws_trace_analyzer import CSV_FIELDS, extract_trace_breakdown, longest_path, create_span_graph, duration, get_sorted_children, is_async_call, call_stack, shard_offsets, us_diff, timediff, read_lines, AwsTraceAnalyzer, MANIFEST_FILE, CRITICAL_PATHS_FILE, PROFILED_STAGES, analyze_trace_graph, add_subsegments, category_for_doc, add_categories, node_category, CriticalPathCache, topology_key, AwsTraceAnalysisPipeline  # noqa: E501
 
 
 def test_get_sorted_children():
@@ -69,6 +77,15 @@ def test_is_async_call_async_with_margin():
     assert is_async_call(parent, child)
 
 
+def test_us_diff_matches_timediff():
+    # Timestamps with sub-microsecond digits as reported by XRay
+    times = [1613573901.68, 1613573901.681, 1624353531.8655, 1624353532.0000005,
+             1624353532.9999995, 1619094435.546231, 1619094435.5469]
+    for start in times:
+        for end in times:
+            assert datetime.timedelta(microseconds=us_diff(start, end)) == timediff(start, end)
+
+
 def traces_path(app):
     """Returns the path to the traces.json for a given app name."""
     tests_path = Path(__file__).parent.parent
@@ -82,7 +99,8 @@ def assert_trace_breakdown(t_path, expected_breakdown):
     Caveat: Supports only a single trace"""
     with open(t_path) as json_file:
         trace = json.load(json_file)
-        trace_breakdown = extract_trace_breakdown(trace)
+    for span_tree in [False, True]:
+        trace_breakdown = extract_trace_breakdown(trace, span_tree=span_tree)
         assert trace_breakdown == expected_breakdown
 
 
@@ -406,6 +424,449 @@ def test_extract_trace_matrix_app_same_end_time():
     assert_trace_breakdown(tp, expected_breakdown)
 
 
+def write_traces(t_path, repeat=1):
+    """Writes all fixture traces with one trace per line into
+    a traces.json file and returns the number of traces written."""
+    fixtures_path = Path(__file__).parent.parent / 'fixtures/aws_trace_analyzer'
+    num_traces = 0
+    with open(t_path, 'w') as traces_file:
+        for _ in range(repeat):
+            for fixture in sorted(fixtures_path.glob('*/traces.json')):
+                with open(fixture) as json_file:
+                    trace = json.load(json_file)
+                traces_file.write(json.dumps(trace) + '\n')
+                num_traces += 1
+    return num_traces
+
+
+def test_shard_offsets(tmp_path):
+    tp = tmp_path / 'traces.json'
+    num_traces = write_traces(tp, repeat=3)
+    offsets = shard_offsets(tp, 4)
+    assert len(offsets) <= 4
+    assert offsets[0][0] == 0
+    assert offsets[-1][1] == tp.stat().st_size
+    lines = [line for (start, end) in offsets for line in read_lines(tp, start, end)]
+    assert len(lines) == num_traces
+    with open(tp, 'rb') as f:
+        assert lines == f.readlines()
+
+
+def test_analyze_traces_workers(tmp_path):
+    """Parallel analysis produces the same output files as the serial analysis."""
+    outputs = dict()
+    for workers in [1, 3]:
+        log_dir = tmp_path / f"workers_{workers}"
+        log_dir.mkdir()
+        write_traces(log_dir / 'traces.json', repeat=3)
+        AwsTraceAnalyzer(log_dir / 'traces.json', workers=workers).analyze_traces()
+        outputs[workers] = [(log_dir / f).read_bytes() for f in ['trace_breakdown.csv', 'invalid_traces.csv']]  # noqa: E501
+    assert outputs[1] == outputs[3]
+    breakdown, invalid = outputs[3]
+    assert len(breakdown.splitlines()) == 1 + 3 * 14
+    assert len(invalid.splitlines()) == 1 + 3 * 4
+
+
+def test_analyze_traces_span_tree(tmp_path):
+    """The span tree produces byte-identical output files to the networkx graph."""
+    outputs = dict()
+    for span_tree in [False, True]:
+        log_dir = tmp_path / f"span_tree_{span_tree}"
+        log_dir.mkdir()
+        write_traces(log_dir / 'traces.json')
+        AwsTraceAnalyzer(log_dir / 'traces.json', span_tree=span_tree).analyze_traces()
+        outputs[span_tree] = [(log_dir / f).read_bytes() for f in ['trace_breakdown.csv', 'invalid_traces.csv']]  # noqa: E501
+    assert outputs[False] == outputs[True]
+
+
+def read_outputs(log_dir):
+    return [(log_dir / f).read_bytes() for f in ['trace_breakdown.csv', 'invalid_traces.csv']]
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_analyze_traces_incremental(tmp_path, workers):
+    """Appended traces are analyzed incrementally with the same result as a full analysis."""
+    full_dir = tmp_path / 'full'
+    full_dir.mkdir()
+    write_traces(full_dir / 'traces.json', repeat=2)
+    AwsTraceAnalyzer(full_dir / 'traces.json').analyze_traces()
+
+    log_dir = tmp_path / 'incremental'
+    log_dir.mkdir()
+    tp = log_dir / 'traces.json'
+    write_traces(tp)
+    AwsTraceAnalyzer(tp, workers=workers).analyze_traces()
+    manifest = json.loads((log_dir / MANIFEST_FILE).read_text())
+    assert manifest['last_offset'] == tp.stat().st_size
+    assert manifest['num_valid_traces'] == 14
+    assert manifest['num_invalid_traces'] == 4
+    # Unchanged input is a no-op
+    mtime = (log_dir / 'trace_breakdown.csv').stat().st_mtime_ns
+    AwsTraceAnalyzer(tp, workers=workers).analyze_traces()
+    assert (log_dir / 'trace_breakdown.csv').stat().st_mtime_ns == mtime
+    # Grown input only appends the new traces
+    with open(tp, 'a') as f:
+        f.write((full_dir / 'traces.json').read_text()[tp.stat().st_size:])
+    AwsTraceAnalyzer(tp, workers=workers).analyze_traces()
+    assert read_outputs(log_dir) == read_outputs(full_dir)
+    manifest = json.loads((log_dir / MANIFEST_FILE).read_text())
+    assert manifest['num_valid_traces'] == 2 * 14
+    assert manifest['num_invalid_traces'] == 2 * 4
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_analyze_traces_partial_line(tmp_path, workers):
+    """A partial last line is analyzed once complete instead of as invalid trace."""
+    full_dir = tmp_path / 'full'
+    full_dir.mkdir()
+    generated = full_dir / 'traces.json'
+    TraceGenerator(seed=3, invalid_ratio=0).write_traces(generated, 30)
+    AwsTraceAnalyzer(generated).analyze_traces()
+
+    log_dir = tmp_path / 'partial'
+    log_dir.mkdir()
+    tp = log_dir / 'traces.json'
+    content = generated.read_bytes()
+    lines = content.splitlines(keepends=True)
+    prefix_size = sum(len(line) for line in lines[:10])
+    # Interrupted while writing the 11th trace
+    tp.write_bytes(content[:prefix_size + 100])
+    AwsTraceAnalyzer(tp, workers=workers).analyze_traces()
+    manifest = json.loads((log_dir / MANIFEST_FILE).read_text())
+    assert manifest['last_offset'] == prefix_size
+    assert manifest['num_valid_traces'] == 10
+    # Completed line and appended traces
+    tp.write_bytes(content)
+    AwsTraceAnalyzer(tp, workers=workers).analyze_traces()
+    assert read_outputs(log_dir) == read_outputs(full_dir)
+    assert len(read_outputs(log_dir)[1].splitlines()) == 1
+
+
+def test_analyze_trace_lines_unparsable_line():
+    rows = []
+    invalid_rows = []
+    num_valid, num_invalid = aws_trace_analyzer.analyze_trace_lines(
+        [b'{"Id": "1-partial'], aws_trace_analyzer.ListWriter(rows),
+        aws_trace_analyzer.ListWriter(invalid_rows))
+    assert (num_valid, num_invalid) == (0, 1)
+    assert invalid_rows[0][0] is None
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_analysis_pipeline(tmp_path, monkeypatch, workers):
+    """Analyzing traces while downloading them produces the same outputs as analyze_traces."""
+    monkeypatch.setattr(aws_trace_analyzer, 'TRACE_BATCH_SIZE', 7)
+    generated = tmp_path / 'generated.json'
+    TraceGenerator(seed=3).write_traces(generated, 40)
+    client = LocalXRayClient.from_file(generated, summaries_page_size=9)
+    start = datetime.datetime.fromtimestamp(client.start_times[0][0], tz=datetime.timezone.utc)
+    end = datetime.datetime.fromtimestamp(client.start_times[-1][0] + 1, tz=datetime.timezone.utc)
+    spec = SimpleNamespace(event_log=SimpleNamespace(get_invoke_timespan=lambda: (start, end)),
+                           logs_directory=lambda: tmp_path)
+    tp = tmp_path / 'traces.json'
+    with AwsTraceAnalysisPipeline(tp, workers=workers) as pipeline:
+        AwsTraceDownloader(spec, workers=2, client=client, trace_sink=pipeline.put).get_traces()
+    outputs = read_outputs(tmp_path)
+    assert len(outputs[0].splitlines()) + len(outputs[1].splitlines()) == 2 + 40
+    # The manifest covers the downloaded traces
+    mtime = (tmp_path / 'trace_breakdown.csv').stat().st_mtime_ns
+    AwsTraceAnalyzer(tp).analyze_traces()
+    assert (tmp_path / 'trace_breakdown.csv').stat().st_mtime_ns == mtime
+    AwsTraceAnalyzer(tp, force=True).analyze_traces()
+    assert read_outputs(tmp_path) == outputs
+    assert BreakdownSketches.load(tmp_path / SKETCHES_FILE).to_dict()
+
+
+def test_analysis_pipeline_failure(tmp_path, monkeypatch):
+    """A failed analysis stops the download instead of blocking on the full queue."""
+    monkeypatch.setattr(aws_trace_analyzer, 'PIPELINE_QUEUE_SIZE', 1)
+
+    def fail(*args, **kwargs):
+        raise OSError('Disk full')
+    monkeypatch.setattr(aws_trace_analyzer, 'analyze_trace_lines', fail)
+    with pytest.raises(RuntimeError):
+        with AwsTraceAnalysisPipeline(tmp_path / 'traces.json') as pipeline:
+            for _ in range(10):
+                pipeline.put(['{}\n'])
+    assert not (tmp_path / MANIFEST_FILE).exists()
+
+
+def test_analyze_traces_reanalyze(tmp_path):
+    """Changed inputs or outputs trigger a full re-analysis."""
+    tp = tmp_path / 'traces.json'
+    write_traces(tp)
+    AwsTraceAnalyzer(tp).analyze_traces()
+    expected = read_outputs(tmp_path)
+    # Partially written output
+    breakdown_file = tmp_path / 'trace_breakdown.csv'
+    breakdown_file.write_bytes(expected[0][:100])
+    AwsTraceAnalyzer(tp).analyze_traces()
+    assert read_outputs(tmp_path) == expected
+    # Changed input with the same size (i.e., reversed trace order)
+    lines = tp.read_text().splitlines(keepends=True)
+    tp.write_text(''.join(reversed(lines)))
+    AwsTraceAnalyzer(tp).analyze_traces()
+    breakdown = read_outputs(tmp_path)[0].splitlines()
+    assert breakdown != expected[0].splitlines()
+    assert sorted(breakdown) == sorted(expected[0].splitlines())
+    # Forced re-analysis
+    mtime = breakdown_file.stat().st_mtime_ns
+    AwsTraceAnalyzer(tp, force=True).analyze_traces()
+    assert breakdown_file.stat().st_mtime_ns != mtime
+
+
+def test_analyze_trace_graph_detail():
+    with open(traces_path('thumbnail_app')) as json_file:
+        trace = json.load(json_file)
+    G = analyze_trace_graph(trace, detail='summary')
+    assert 'critical_path_details' not in G.graph
+    assert 'longest_path_details' not in G.graph
+    G = analyze_trace_graph(trace, detail='paths')
+    assert len(G.graph['critical_path_details']) == len(G.graph['critical_path'])
+    assert len(G.graph['longest_path_details']) == len(G.graph['longest_path_names'])
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_analyze_traces_detail_full(tmp_path, workers):
+    tp = tmp_path / 'traces.json'
+    write_traces(tp, repeat=2)
+    AwsTraceAnalyzer(tp, workers=workers, detail='full').analyze_traces()
+    with open(tmp_path / 'trace_breakdown.csv') as f:
+        breakdown = list(csv.DictReader(f))
+    with open(tmp_path / CRITICAL_PATHS_FILE) as f:
+        records = [json.loads(line) for line in f]
+    trace_paths = TracePaths.load(tmp_path / PATHS_FILE)
+    assert [r['trace_id'] for r in records] == [row['trace_id'] for row in breakdown]
+    for record, row in zip(records, breakdown):
+        computation = sum(e['duration'] for e in record['critical_path'] if e['category'] == 'computation')  # noqa: E501
+        if row['computation']:
+            assert str(datetime.timedelta(microseconds=computation)) == row['computation']
+        else:
+            assert computation == 0
+        names = [d['name'] for d in record['longest_path']]
+        assert trace_paths.names(row['path_id']) == normalize_path(names)
+    # Changing the detail level requires a re-analysis
+    (tmp_path / CRITICAL_PATHS_FILE).unlink()
+    AwsTraceAnalyzer(tp, workers=workers).analyze_traces()
+    assert not (tmp_path / CRITICAL_PATHS_FILE).exists()
+    AwsTraceAnalyzer(tp, workers=workers, detail='full').analyze_traces()
+    assert len((tmp_path / CRITICAL_PATHS_FILE).read_text().splitlines()) == 2 * 14
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_analyze_traces_profile(tmp_path, workers):
+    tp = tmp_path / 'traces.json'
+    write_traces(tp, repeat=2)
+    functions = [getattr(aws_trace_analyzer, name) for name in PROFILED_STAGES]
+    AwsTraceAnalyzer(tp, workers=workers).analyze_traces()
+    assert not (tmp_path / PROFILE_FILE).exists()
+    AwsTraceAnalyzer(tp, workers=workers, profile=True, force=True).analyze_traces()
+    profile = json.loads((tmp_path / PROFILE_FILE).read_text())
+    assert profile['analyzer'] == 'AwsTraceAnalyzer'
+    assert profile['num_valid_traces'] == 2 * 14
+    assert profile['num_invalid_traces'] == 2 * 4
+    assert profile['stages']['create_span_graph']['calls'] == 2 * 18
+    assert profile['stages']['writerow']['calls'] == 2 * 14
+    assert profile['stages']['longest_path']['seconds'] > 0
+    assert sum(site['count'] for site in profile['invalid_sites'].values()) == 2 * 4
+    assert all(site.startswith('aws_trace_analyzer.py:') for site in profile['invalid_sites'])
+    # Profiling restores the original functions
+    assert [getattr(aws_trace_analyzer, name) for name in PROFILED_STAGES] == functions
+
+
+def test_analyze_traces_sketches(tmp_path):
+    """Sketches are independent of workers and incremental analysis and
+    approximate the percentiles of the trace breakdown."""
+    sketches = dict()
+    for workers in [1, 3]:
+        log_dir = tmp_path / f"workers_{workers}"
+        log_dir.mkdir()
+        write_traces(log_dir / 'traces.json', repeat=3)
+        AwsTraceAnalyzer(log_dir / 'traces.json', workers=workers).analyze_traces()
+        sketches[workers] = BreakdownSketches.load(log_dir / SKETCHES_FILE)
+    assert sketches[1].to_dict() == sketches[3].to_dict()
+    incremental_dir = tmp_path / 'incremental'
+    incremental_dir.mkdir()
+    tp = incremental_dir / 'traces.json'
+    write_traces(tp, repeat=1)
+    AwsTraceAnalyzer(tp).analyze_traces()
+    assert BreakdownSketches.load(incremental_dir / SKETCHES_FILE).sketch().count == 14
+    write_traces(tp, repeat=3)
+    AwsTraceAnalyzer(tp).analyze_traces()
+    assert BreakdownSketches.load(incremental_dir / SKETCHES_FILE).to_dict() == sketches[1].to_dict()  # noqa: E501
+
+    with open(tmp_path / 'workers_1' / 'trace_breakdown.csv') as f:
+        rows = list(csv.DictReader(f))
+    durations = sorted(timedelta_str_us(row['duration']) for row in rows)
+    for q in [0.5, 0.99]:
+        expected = durations[int(q * (len(durations) - 1))]
+        assert abs(sketches[1].quantile(q) - expected) <= 0.01 * expected
+    computation = sketches[1].sketch('computation')
+    assert computation.count == 3 * 14
+    assert computation.sum == sum(timedelta_str_us(row['computation'] or '0:00:00') for row in rows)  # noqa: E501
+
+
+def timedelta_str_us(value) -> int:
+    """Parses the str() of a timedelta (e.g., 0:00:01.000120) into microseconds."""
+    hours, minutes, seconds = value.split(':')
+    return round((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1_000_000)
+
+
+def deep_trace(depth):
+    """Returns a synthetic trace with a chain of synchronously nested segments
+    where each segment starts 1ms after and ends 1ms before its parent."""
+    start_time = 1619760991.0
+    segments = []
+    for i in range(depth):
+        doc = {
+            'id': f"{i:016x}",
+            'name': f"segment{i}",
+            'origin': 'AWS::Lambda',
+            'start_time': round(start_time + i * 0.001, 3),
+            'end_time': round(start_time + (2 * depth - i) * 0.001, 3)
+        }
+        if i > 0:
+            doc['parent_id'] = f"{i - 1:016x}"
+        segments.append({'Id': doc['id'], 'Document': json.dumps(doc)})
+    return {
+        'Id': '1-608b975f-82c9cf3915cf8d7c1093ada7',
+        'Duration': round(2 * depth * 0.001, 3),
+        'LimitExceeded': False,
+        'Segments': segments
+    }
+
+
+def test_extract_trace_breakdown_deep_trace():
+    """Stress test for traces nested deeper than the default recursion limit."""
+    depth = 5000
+    trace = deep_trace(depth)
+    for span_tree in [False, True]:
+        trace_breakdown = dict(zip(CSV_FIELDS, extract_trace_breakdown(trace, span_tree=span_tree)))  # noqa: E501
+        assert len(trace_breakdown['longest_path_names']) == depth
+        assert trace_breakdown['orchestration'] == datetime.timedelta(seconds=2 * depth * 0.001)
+
+
+def test_add_subsegments_deep():
+    """Deeply nested subsegments without origin below the Invocation subsegment."""
+    depth = 5000
+    root = {'id': 'root', 'origin': 'AWS::Lambda::Function', 'start_time': 0, 'end_time': 1}
+    parent = root
+    for i in range(depth):
+        name = 'Invocation' if i == 0 else f"sub{i}"
+        subsegment = {'id': f"sub{i}", 'name': name, 'start_time': 0, 'end_time': 1}
+        parent['subsegments'] = [subsegment]
+        parent = subsegment
+    G = nx.DiGraph()
+    G.add_node('root', doc=root)
+    add_subsegments(G, root)
+    assert list(G.nodes) == ['root'] + [f"sub{i}" for i in range(depth)]
+    assert next(G.predecessors(f"sub{depth - 1}")) == f"sub{depth - 2}"
+    assert category_for_doc(G, parent) == 'computation'
+    G.graph['start'] = 'root'
+    add_categories(G)
+    assert G.nodes[f"sub{depth - 1}"]['category'] == 'computation'
+
+
+@pytest.mark.parametrize('span_tree', [False, True])
+def test_add_categories(span_tree):
+    """The top-down categories match walking up the parents for every node."""
+    fixtures_path = Path(__file__).parent.parent / 'fixtures/aws_trace_analyzer'
+    for fixture in sorted(fixtures_path.glob('*/traces.json')):
+        with open(fixture) as json_file:
+            trace = json.load(json_file)
+        try:
+            G = create_span_graph(trace, span_tree)
+        except Exception:
+            continue
+        for id, attr in G.nodes(data=True):
+            assert attr['category'] == category_for_doc(G, attr['doc'])
+            assert node_category(G, attr['doc']) == attr['category']
+
+
+def fixture_traces() -> list:
+    fixtures_path = Path(__file__).parent.parent / 'fixtures/aws_trace_analyzer'
+    traces = []
+    for fixture in sorted(fixtures_path.glob('*/traces.json')):
+        with open(fixture) as json_file:
+            traces.append(json.load(json_file))
+    return traces
+
+
+def analyze_or_message(trace, span_tree=False, cache=None):
+    """Returns the trace breakdown and critical path record or the exception message."""
+    try:
+        G = analyze_trace_graph(trace, span_tree, 'full', cache)
+    except Exception as e:
+        return str(e)
+    return aws_trace_analyzer.trace_breakdown_row(G), aws_trace_analyzer.critical_path_record(G)
+
+
+def shift_trace(trace, seconds):
+    """Returns a copy of the trace with all timestamps shifted by the given seconds."""
+    def shift(doc):
+        for field in ['start_time', 'end_time']:
+            if field in doc:
+                doc[field] += seconds
+        for subsegment in doc.get('subsegments', []):
+            shift(subsegment)
+        return doc
+    segments = [{**s, 'Document': json.dumps(shift(json.loads(s['Document'])))}
+                for s in trace['Segments']]
+    return {**trace, 'Segments': segments}
+
+
+@pytest.mark.parametrize('span_tree', [False, True])
+def test_critical_path_cache(span_tree):
+    """Cache hits replay the same critical path as the full analysis."""
+    cache = CriticalPathCache()
+    traces = fixture_traces()
+    expected = [analyze_or_message(trace, span_tree) for trace in traces]
+    assert [analyze_or_message(trace, span_tree, cache) for trace in traces] == expected
+    assert cache.hits == 0
+    num_valid = sum(1 for e in expected if not isinstance(e, str))
+    # Traces with the same topology and timestamp order hit the cache
+    # once their topology has been seen twice
+    for i in range(1, 4):
+        shifted = [shift_trace(trace, i) for trace in traces]
+        expected = [analyze_or_message(trace, span_tree) for trace in shifted]
+        assert [analyze_or_message(trace, span_tree, cache) for trace in shifted] == expected
+    assert cache.hits == 2 * num_valid
+
+
+def test_topology_key():
+    with open(traces_path('thumbnail_app')) as json_file:
+        trace = json.load(json_file)
+    G = create_span_graph(trace, critical_path=False)
+    key, ids, timestamps = topology_key(G)
+    assert sorted(ids) == sorted(G.nodes)
+    assert timestamps[0] == G.graph['start_time']
+    assert topology_key(create_span_graph(shift_trace(trace, 1), critical_path=False))[0] == key
+    # Changing the order of any timestamps changes the key
+    docs = [json.loads(s['Document']) for s in trace['Segments']]
+    doc = next(d for d in docs if d.get('origin') == 'AWS::Lambda::Function')
+    doc['end_time'] = doc['start_time']
+    segments = [{**s, 'Document': json.dumps(d)} for s, d in zip(trace['Segments'], docs)]
+    G = create_span_graph({**trace, 'Segments': segments}, critical_path=False)
+    assert topology_key(G)[0] != key
+    # Nodes with multiple parents are not cached
+    G.add_edge(G.graph['start'], ids[-1])
+    assert topology_key(G) is None
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_analyze_traces_path_cache(tmp_path, workers):
+    """The critical path cache produces byte-identical output files."""
+    outputs = dict()
+    for path_cache in [False, True]:
+        log_dir = tmp_path / f"path_cache_{path_cache}"
+        log_dir.mkdir()
+        write_traces(log_dir / 'traces.json', repeat=3)
+        AwsTraceAnalyzer(log_dir / 'traces.json', workers=workers, detail='full',
+                         path_cache=path_cache).analyze_traces()
+        outputs[path_cache] = read_outputs(log_dir) + [(log_dir / CRITICAL_PATHS_FILE).read_bytes()]  # noqa: E501
+    assert outputs[False] == outputs[True]
+
+
 @pytest.mark.skip(reason="Just used for creating visualizer data.")
 def test_extract_tmp_visualizer():
     """Just a tmp case for creating visualizer data
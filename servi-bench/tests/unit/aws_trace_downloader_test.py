@@ -0,0 +1,220 @@
+import json
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+import sb.aws_trace_downloader as aws_trace_downloader
+from sb.aws_trace_downloader import AimdLimiter, AwsTraceDownloader
+from sb.local_xray import LocalXRayClient, XRayServer
+from sb.trace_generator import TraceGenerator
+
+
+@pytest.fixture
+def traces_file(tmp_path):
+    path = tmp_path / 'generated.json'
+    TraceGenerator(seed=5, invalid_ratio=0).write_traces(path, 60)
+    return path
+
+
+def read_ids(trace_file) -> list:
+    with open(trace_file) as f:
+        return [json.loads(line)['Id'] for line in f]
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_retrieve_traces(tmp_path, traces_file, workers):
+    client = LocalXRayClient.from_file(traces_file, traces_page_size=2, unprocessed_rate=0.1)
+    trace_ids = list(client.traces)
+    downloader = AwsTraceDownloader(None, workers=workers, client=client)
+    unprocessed_ids = downloader.retrieve_traces(trace_ids, tmp_path / 'traces.json')
+    downloaded_ids = read_ids(tmp_path / 'traces.json')
+    assert len(unprocessed_ids) == client.num_unprocessed > 0
+    assert sorted(downloaded_ids + unprocessed_ids) == sorted(trace_ids)
+
+
+def test_retrieve_traces_throttled(tmp_path, traces_file, monkeypatch):
+    monkeypatch.setattr(aws_trace_downloader, 'BACKOFF_BASE', 0.001)
+    client = LocalXRayClient.from_file(traces_file, latency=0.002, max_concurrency=2,
+                                       throttle_rate=0.05)
+    trace_ids = list(client.traces)
+    downloader = AwsTraceDownloader(None, workers=8, client=client)
+    unprocessed_ids = downloader.retrieve_traces(trace_ids, tmp_path / 'traces.json')
+    assert client.num_throttled > 0
+    assert unprocessed_ids == []
+    assert sorted(read_ids(tmp_path / 'traces.json')) == sorted(trace_ids)
+
+
+def test_retrieve_traces_gives_up(tmp_path, traces_file, monkeypatch):
+    monkeypatch.setattr(aws_trace_downloader, 'BACKOFF_BASE', 0)
+    client = LocalXRayClient.from_file(traces_file, throttle_rate=1)
+    trace_ids = list(client.traces)[:7]
+    downloader = AwsTraceDownloader(None, workers=2, client=client)
+    unprocessed_ids = downloader.retrieve_traces(trace_ids, tmp_path / 'traces.json')
+    assert sorted(unprocessed_ids) == sorted(trace_ids)
+    assert client.num_requests == 2 * (aws_trace_downloader.MAX_THROTTLING_RETRIES + 1)
+
+
+def test_retrieve_traces_gives_up_later_page(tmp_path, traces_file, monkeypatch):
+    """Traces of earlier pages are kept if a later page remains throttled."""
+    monkeypatch.setattr(aws_trace_downloader, 'BACKOFF_BASE', 0)
+    client = LocalXRayClient.from_file(traces_file, traces_page_size=2, unprocessed_rate=0.3)
+    batch_get_traces = client.batch_get_traces
+
+    def throttle_later_pages(TraceIds, NextToken=None):
+        if NextToken is not None:
+            error = {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}
+            raise ClientError(error, 'BatchGetTraces')
+        return batch_get_traces(TraceIds)
+    monkeypatch.setattr(client, 'batch_get_traces', throttle_later_pages)
+    trace_ids = list(client.traces)[:10]
+    downloader = AwsTraceDownloader(None, workers=2, client=client)
+    unprocessed_ids = downloader.retrieve_traces(trace_ids, tmp_path / 'traces.json')
+    downloaded_ids = read_ids(tmp_path / 'traces.json')
+    assert len(downloaded_ids) > 0
+    assert sorted(downloaded_ids + unprocessed_ids) == sorted(trace_ids)
+
+
+def test_aimd_limiter():
+    limiter = AimdLimiter(8)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 2
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release()
+    assert 3 < limiter.limit < 4
+    assert limiter.num_throttled == 2
+
+
+class DuplicatingXRayClient(LocalXRayClient):
+    """Repeats the first trace summary of every page like X-Ray occasionally does."""
+
+    def get_trace_summaries(self, **kwargs):
+        response = super().get_trace_summaries(**kwargs)
+        response['TraceSummaries'] = response['TraceSummaries'][:1] + response['TraceSummaries']
+        return response
+
+
+class FakeSpec(SimpleNamespace):
+    def __getitem__(self, key):
+        return {'region': 'us-east-1'}[key]
+
+
+def fake_spec(client, log_path):
+    start = datetime.fromtimestamp(client.start_times[0][0] - 1, tz=timezone.utc)
+    end = datetime.fromtimestamp(client.start_times[-1][0] + 1, tz=timezone.utc)
+    return FakeSpec(event_log=SimpleNamespace(get_invoke_timespan=lambda: (start, end)),
+                    logs_directory=lambda: log_path)
+
+
+def test_partition_timespan():
+    start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    partitions = aws_trace_downloader.partition_timespan(start, start + timedelta(hours=1), 4)
+    assert partitions[0] == (start, start + timedelta(minutes=15))
+    assert partitions[-1][1] == start + timedelta(hours=1)
+    assert all(a[1] == b[0] for a, b in zip(partitions, partitions[1:]))
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_get_traces(tmp_path, traces_file, monkeypatch, workers):
+    monkeypatch.setattr(aws_trace_downloader, 'BACKOFF_BASE', 0)
+    # The serial download relies on the retries of the boto3 client
+    client = DuplicatingXRayClient.from_file(traces_file, summaries_page_size=7,
+                                             throttle_rate=0.1 if workers > 1 else 0)
+    log_path = tmp_path / 'logs'
+    log_path.mkdir()
+    AwsTraceDownloader(fake_spec(client, log_path), workers=workers, client=client).get_traces()
+    # Deduplicated in both modes
+    trace_ids = (log_path / 'trace_ids.txt').read_text().splitlines()
+    assert sorted(trace_ids) == sorted(client.traces)
+    assert sorted(read_ids(log_path / 'traces.json')) == sorted(client.traces)
+
+
+def test_stream_trace_ids_stops_listing(tmp_path, traces_file, monkeypatch):
+    """Abandoning the stream stops the listing threads even if the page queue is full."""
+    monkeypatch.setattr(aws_trace_downloader, 'TRACE_ID_QUEUE_SIZE', 1)
+    client = LocalXRayClient.from_file(traces_file, summaries_page_size=1)
+    spec = fake_spec(client, tmp_path)
+    downloader = AwsTraceDownloader(spec, workers=4, client=client)
+    stream = downloader.stream_trace_ids(*spec.event_log.get_invoke_timespan(),
+                                         tmp_path / 'trace_ids.txt')
+    first_ids = [next(stream) for _ in range(3)]
+    stream.close()
+    assert len(set(first_ids)) == 3
+    assert client.num_requests < len(client.traces)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_get_traces_resumes(tmp_path, traces_file, workers):
+    """An interrupted download with a partial last line and unprocessed trace ids
+    only retrieves the missing traces on restart."""
+    client = LocalXRayClient.from_file(traces_file, unprocessed_rate=0.2)
+    log_path = tmp_path / 'logs'
+    log_path.mkdir()
+    downloader = AwsTraceDownloader(fake_spec(client, log_path), workers=workers, client=client)
+    downloader.get_traces()
+    unprocessed_ids = (log_path / 'unprocessed_trace_ids.txt').read_text().splitlines()
+    assert len(unprocessed_ids) == client.num_unprocessed > 0
+    # Interrupt while writing the last trace
+    trace_file = log_path / 'traces.json'
+    lines = trace_file.read_text().splitlines(keepends=True)
+    trace_file.write_text(''.join(lines[:-1]) + lines[-1][:50])
+
+    client.unprocessed_rate = 0
+    client.num_requests = 0
+    downloader.get_traces()
+    assert sorted(read_ids(trace_file)) == sorted(client.traces)
+    assert not (log_path / 'unprocessed_trace_ids.txt').exists()
+    # Only the unprocessed and the partial trace are retrieved
+    assert client.num_requests <= len(unprocessed_ids) + 1
+    num_requests = client.num_requests
+    downloader.get_traces()
+    assert client.num_requests == num_requests
+    assert sorted(read_ids(trace_file)) == sorted(client.traces)
+
+
+def test_get_traces_relists_incomplete_trace_ids(tmp_path, traces_file):
+    client = LocalXRayClient.from_file(traces_file)
+    log_path = tmp_path / 'logs'
+    log_path.mkdir()
+    downloaded = read_ids(traces_file)[:10]
+    with open(traces_file) as f, open(log_path / 'traces.json', 'w') as out:
+        out.writelines(line for line in f if json.loads(line)['Id'] in downloaded)
+    AwsTraceDownloader(fake_spec(client, log_path), client=client).get_traces()
+    assert sorted((log_path / 'trace_ids.txt').read_text().splitlines()) == sorted(client.traces)
+    assert sorted(read_ids(log_path / 'traces.json')) == sorted(client.traces)
+    assert not (log_path / 'trace_ids.txt.partial').exists()
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_xray_server(tmp_path, traces_file, monkeypatch, workers):
+    """The boto3 client downloads traces from the local X-Ray server as endpoint_url."""
+    monkeypatch.setattr(aws_trace_downloader, 'BACKOFF_BASE', 0)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'local')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'local')
+    # The serial download relies on the retries of the boto3 client
+    client = LocalXRayClient.from_file(traces_file, summaries_page_size=7, unprocessed_rate=0.1,
+                                       throttle_rate=0.1 if workers > 1 else 0)
+    log_path = tmp_path / 'logs'
+    log_path.mkdir()
+    with XRayServer(client) as server:
+        downloader = AwsTraceDownloader(fake_spec(client, log_path), workers=workers,
+                                        endpoint_url=server.url)
+        downloader.get_traces()
+    unprocessed_ids = (log_path / 'unprocessed_trace_ids.txt').read_text().splitlines()
+    assert len(unprocessed_ids) == client.num_unprocessed > 0
+    assert sorted(read_ids(log_path / 'traces.json') + unprocessed_ids) == sorted(client.traces)
+    assert (log_path / 'traces.json').read_text().splitlines()[0] == \
+        json.dumps(client.traces[read_ids(log_path / 'traces.json')[0]])
+
+
+def test_local_xray_from_directory():
+    fixtures_path = Path(__file__).parent.parent / 'fixtures/aws_trace_analyzer'
+    client = LocalXRayClient.from_directory(fixtures_path)
+    assert len(client.traces) > 10
+    assert all(trace['Segments'] for trace in client.traces.values())
@@ -0,0 +1,224 @@
+import csv
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+import sb.azure_trace_analyzer as azure_trace_analyzer
+from sb.azure_trace_analyzer import AzureTraceAnalyzer, AzureTraceTriggerAnalyzer
+from sb.trace_paths import TracePaths
+
+COLUMNS = ['timestamp', 'itemType', 'name', 'duration', 'operation_Id', 'customDimensions']
+
+
+def timestamp(time, digits) -> str:
+    """Formats a timestamp like Azure Insights with a variable sub-second precision."""
+    fraction = f"{time.microsecond:06d}{random.randint(0, 9)}"[:digits]
+    return time.strftime('%Y-%m-%dT%H:%M:%S') + (f".{fraction}" if digits else '') + 'Z'
+
+
+def insights_trace(root_trace_id, trace_id, start, coldstart=(False, False)) -> dict:
+    """Returns an Azure Insights JSON response of a trigger trace."""
+    duration = round(random.uniform(1, 200), random.choice([0, 3, 4]))
+    t2 = start + timedelta(milliseconds=duration)
+    rows = [
+        [timestamp(start, 7), 'request', 'Function1', 300.5, root_trace_id, '{"a": "b"}'],
+        [timestamp(t2, 3), 'dependency', 'eventHub_trigger', duration, root_trace_id, None],
+        [timestamp(t2, 7), 'request', 'Function2EventHubTrigger', 12.0, trace_id, None],
+        [timestamp(t2, 7), 'trace', None, None, trace_id, '{"Category": "Host"}'],
+    ]
+    for n in range(0, 6):
+        time = t2 + timedelta(milliseconds=n + 1)
+        rows.append([timestamp(time, random.choice([0, 3, 6])), 'dependency', f"receiver{n}",
+                     0, trace_id, None])
+    for operation_id, is_cold in zip([root_trace_id, trace_id], coldstart):
+        if is_cold:
+            rows.append([timestamp(start, 3), 'trace', None, None, operation_id,
+                         '{"LogLevel": "ColdStart"}'])
+    return {
+        'tables': [{'name': 'PrimaryResult', 'columns': [{'name': c} for c in COLUMNS],
+                    'rows': rows}],
+        'attrs': {'rootTraceId': root_trace_id, 'traceId': trace_id},
+    }
+
+
+def generate_traces(num_traces) -> list:
+    random.seed(3)
+    start = datetime(2022, 2, 1, tzinfo=timezone.utc)
+    traces = []
+    for i in range(num_traces):
+        root_trace_id = f"root{i}"
+        # Connected traces share the trace id
+        trace_id = root_trace_id if i % 11 == 0 else f"child{i}"
+        time = start + timedelta(seconds=i, microseconds=random.randint(0, 999_999))
+        trace = insights_trace(root_trace_id, trace_id, time,
+                               coldstart=(i % 3 == 0, i % 4 == 0))
+        rows = trace['tables'][0]['rows']
+        if i % 9 == 1:  # missing receiver
+            del rows[-1 if i % 2 else 6]
+        elif i % 9 == 2:  # duplicate receiver
+            rows.append(list(rows[5]))
+        elif i % 9 == 4:  # missing duration
+            rows[1][3] = None
+        elif i % 9 == 5:  # no custom dimensions
+            for row in rows:
+                row[5] = None
+        elif i % 9 == 7:  # error response
+            trace = {'error': {'message': 'Throttled'}, 'attrs': trace['attrs']}
+        traces.append(trace)
+    return traces
+
+
+def test_batch_matches_per_trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(azure_trace_analyzer, 'TRACE_BATCH_SIZE', 7)
+    lines = [json.dumps(trace) for trace in generate_traces(60)]
+    outputs = dict()
+    for batch in [False, True]:
+        log_dir = tmp_path / f"batch_{batch}"
+        log_dir.mkdir()
+        (log_dir / 'traces.json').write_text('\n'.join(lines) + '\n')
+        AzureTraceTriggerAnalyzer(log_dir / 'traces.json', batch=batch).analyze_traces()
+        outputs[batch] = [(log_dir / f).read_text() for f in ['trigger.csv', 'invalid_traces.csv']]  # noqa: E501
+    assert outputs[True] == outputs[False]
+    rows = list(csv.DictReader(outputs[True][0].splitlines()))
+    invalid_rows = list(csv.DictReader(outputs[True][1].splitlines()))
+    assert len(rows) + len(invalid_rows) == 60
+    assert len(invalid_rows) > 0
+    assert {row['coldstart_f1'] for row in rows} == {'True', 'False'}
+
+
+def test_batch_fallback(tmp_path, monkeypatch):
+    """Traces that the batch cannot represent identically (e.g., different columns
+    or missing receivers) are extracted one by one."""
+    monkeypatch.setattr(azure_trace_analyzer, 'TRACE_BATCH_SIZE', 4)
+    traces = generate_traces(4)
+    table = traces[3]['tables'][0]
+    table['columns'].append({'name': 'message'})
+    for row in table['rows']:
+        row.append('')
+    batch = [trace if azure_trace_analyzer.is_batchable(trace, COLUMNS) else None
+             for trace in traces]
+    assert [trace is None for trace in batch] == [False, False, False, True]
+    results = azure_trace_analyzer.extract_trigger_results_batch(
+        azure_trace_analyzer.concat_insights_traces(batch, COLUMNS), len(batch))
+    # Missing and duplicate receivers
+    assert [result is None for result in results] == [False, True, True, True]
+    traces_file = tmp_path / 'traces.json'
+    traces_file.write_text('\n'.join(json.dumps(trace) for trace in traces) + '\n')
+    AzureTraceTriggerAnalyzer(traces_file, batch=True, profile=True).analyze_traces()
+    with open(tmp_path / 'trigger.csv') as f:
+        assert [row['root_trace_id'] for row in csv.DictReader(f)] == ['root0', 'root3']
+    assert (tmp_path / 'analysis_profile.json').exists()
+
+
+def test_batch_path(tmp_path, monkeypatch):
+    """Batchable traces are never extracted one by one."""
+    monkeypatch.setattr(azure_trace_analyzer, 'TRACE_BATCH_SIZE', 5)
+    # Valid traces only (see generate_traces)
+    traces = [trace for i, trace in enumerate(generate_traces(30)) if i % 9 in [0, 3, 6, 8]]
+    calls = []
+    monkeypatch.setattr(azure_trace_analyzer, 'extract_trigger_results', calls.append)
+    traces_file = tmp_path / 'traces.json'
+    traces_file.write_text('\n'.join(json.dumps(trace) for trace in traces) + '\n')
+    analyzer = AzureTraceTriggerAnalyzer(traces_file, batch=True)
+    analyzer.analyze_traces()
+    assert calls == []
+    assert analyzer.num_fallback_traces == 0
+    with open(tmp_path / 'trigger.csv') as f:
+        assert len(list(csv.DictReader(f))) == len(traces)
+
+
+def test_parse_insights_timestamps():
+    values = ['2022-02-01T10:11:12Z', '2022-02-01T10:11:12.1Z', '2022-02-01T10:11:12.123Z',
+              '2022-02-01T10:11:12.123456Z', '2022-02-01T23:59:59.9999999Z']
+    parsed = azure_trace_analyzer.parse_insights_timestamps(values)
+    assert list(parsed) == [pd.to_datetime(value) for value in values]
+    assert parsed[4].nanosecond == 900
+    assert len(azure_trace_analyzer.parse_insights_timestamps([])) == 0
+
+
+SPAN_COLUMNS = ['timestamp', 'id', 'operation_ParentId', 'operation_Id', 'name', 'itemType',
+                'duration', 'type', 'resultCode', 'url', 'cloud_RoleName', 'customDimensions']
+
+
+def span_row(start_ms, duration, id, parent_id, name, item_type='dependency', type=None,
+             result_code='200', url=None) -> list:
+    start = datetime(2022, 2, 1, tzinfo=timezone.utc) + timedelta(milliseconds=start_ms)
+    return [timestamp(start, 7), id, parent_id, 'op1', name, item_type, duration, type,
+            result_code, url, 'app1' if item_type == 'request' else None, None]
+
+
+def span_trace(rows, root_trace_id=None) -> dict:
+    trace = {'tables': [{'name': 'PrimaryResult', 'columns': [{'name': c} for c in SPAN_COLUMNS],  # noqa: E501
+                         'rows': rows}]}
+    if root_trace_id is not None:
+        trace['attrs'] = {'rootTraceId': root_trace_id, 'traceId': root_trace_id}
+    return trace
+
+
+def test_timestamp_us():
+    assert azure_trace_analyzer.timestamp_us('1970-01-01T00:00:01.1234567Z') == 1_123_456
+    assert azure_trace_analyzer.timestamp_us('1970-01-01T00:01:00Z') == 60_000_000
+    assert azure_trace_analyzer.timestamp_us('1970-01-01T00:00:00.12Z') == 120_000
+
+
+def test_azure_trace_analyzer(tmp_path):
+    coldstart = span_row(46, None, 'log1', 'r2', None, item_type='trace')
+    coldstart[-1] = '{"Category": "ColdStart"}'
+    sync_trace = span_trace([
+        span_row(0, 100, 'r1', 'op1', 'HttpTrigger1', 'request', url='https://app/api/x'),
+        span_row(10, 20, 'd1', 'r1', 'compute', type='InProc'),
+        span_row(40, 50, 'd2', 'r1', 'GET /api/y', type='HTTP'),
+        span_row(45, 40, 'r2', 'd2', 'HttpTrigger2', 'request'),
+        span_row(50, 30, 'd3', 'r2', 'upload', type='Azure blob', result_code='429'),
+        coldstart,
+    ])
+    async_trace = span_trace([
+        span_row(0, 20, 'r1', 'op1', 'HttpTrigger1', 'request', url='https://app/api/z'),
+        span_row(5, 5, 'd1', 'r1', 'send', type='Azure Service Bus'),
+        span_row(30, 30, 'r2', 'd1', 'ServiceBusTrigger', 'request', result_code='500'),
+    ], root_trace_id='root2')
+    disconnected_trace = span_trace([
+        span_row(0, 20, 'r1', 'op1', 'HttpTrigger1', 'request'),
+        span_row(30, 30, 'r2', 'x', 'ServiceBusTrigger', 'request'),
+    ])
+    error_trace = {'error': {'message': 'Throttled'}, 'attrs': {'rootTraceId': 'root4'}}
+    traces_file = tmp_path / 'traces.json'
+    traces = [sync_trace, async_trace, disconnected_trace, error_trace]
+    traces_file.write_text('\n'.join(json.dumps(trace) for trace in traces) + '\n')
+    AzureTraceAnalyzer(traces_file, profile=True).analyze_traces()
+
+    with open(tmp_path / 'trace_breakdown.csv') as f:
+        reader = csv.DictReader(f)
+        assert reader.fieldnames == azure_trace_analyzer.BREAKDOWN_FIELDS
+        rows = list(reader)
+    assert len(rows) == 2
+    sync_row, async_row = rows
+    assert sync_row['trace_id'] == 'op1'
+    assert sync_row['url'] == 'https://app/api/x'
+    assert sync_row['duration'] == '0:00:00.100000'
+    assert sync_row['computation'] == '0:00:00.060000'
+    assert sync_row['trigger'] == '0:00:00.010000'
+    assert sync_row['external_service'] == '0:00:00.030000'
+    assert sync_row['unclassified'] == '0:00:00'
+    assert sync_row['container_initialization'] == ''
+    assert sync_row['num_cold_starts'] == '1'
+    assert (sync_row['errors'], sync_row['throttles'], sync_row['faults']) == ('1', '1', '0')
+    assert async_row['trace_id'] == 'root2'
+    assert async_row['duration'] == '0:00:00.060000'
+    assert async_row['computation'] == '0:00:00.045000'
+    # Asynchronous trigger including the gap until the triggered request starts
+    assert async_row['trigger'] == '0:00:00.015000'
+    assert async_row['faults'] == '1'
+    trace_paths = TracePaths.load(tmp_path / 'trace_paths.json')
+    assert trace_paths.names(sync_row['path_id']) == \
+        ['HttpTrigger1', 'compute', 'GET /api/y', 'HttpTrigger2', 'upload']
+    assert trace_paths.names(async_row['path_id']) == ['HttpTrigger1', 'send', 'ServiceBusTrigger']  # noqa: E501
+
+    with open(tmp_path / 'invalid_traces.csv') as f:
+        invalid_rows = list(csv.DictReader(f))
+    assert [row['trace_id'] for row in invalid_rows] == ['op1', 'root4']
+    assert invalid_rows[0]['message'].startswith('Found 2 root spans')
+    assert (tmp_path / 'breakdown_sketches.json').exists()
+    assert (tmp_path / 'analysis_profile.json').exists()
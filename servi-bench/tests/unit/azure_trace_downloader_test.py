@@ -0,0 +1,179 @@
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import sb.azure_trace_downloader as azure_trace_downloader
+from sb.azure_trace_downloader import AzureTraceDownloader, time_slices
+from sb.local_insights import InsightsReplayServer
+
+START = datetime(2022, 2, 1, tzinfo=timezone.utc)
+TABLE_COLUMNS = {
+    'traces': ['timestamp', 'message', 'itemType', 'operation_Id', 'customDimensions'],
+    'requests': ['timestamp', 'id', 'name', 'itemType', 'duration', 'operation_Id'],
+    'dependencies': ['timestamp', 'id', 'name', 'itemType', 'duration', 'data', 'operation_Id'],
+}
+
+
+def parse_time(value) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+
+
+def response(columns, rows) -> dict:
+    return {'tables': [{'name': 'PrimaryResult',
+                        'columns': [{'name': c, 'type': 'string'} for c in columns],
+                        'rows': rows}]}
+
+
+class FakeInsights:
+    """Evaluates the KQL queries of the AzureTraceDownloader on in-memory tables."""
+
+    def __init__(self, num_traces) -> None:
+        self.tables = {table: [] for table in TABLE_COLUMNS}
+        self.queries = []
+        for i in range(num_traces):
+            root_trace_id = f"root{i}"
+            # Connected traces share the trace id
+            trace_id = root_trace_id if i % 3 == 0 else f"child{i}"
+            time = START + timedelta(seconds=10 * i)
+            self.add('requests', time, id=f"r{i}", name='Function1', duration=20,
+                     operation_Id=root_trace_id)
+            self.add('dependencies', time + timedelta(seconds=1), id=f"d{i}", name='receiver0',
+                     duration=0, data=root_trace_id, operation_Id=trace_id)
+            self.add('traces', time + timedelta(seconds=2), message='Executed',
+                     operation_Id=trace_id)
+        # Unrelated telemetry
+        self.add('traces', START, message='Host started', operation_Id='')
+
+    def add(self, table, time, **values):
+        item_type = {'traces': 'trace', 'requests': 'request', 'dependencies': 'dependency'}[table]
+        values.update(timestamp=time.strftime('%Y-%m-%dT%H:%M:%S.%fZ'), itemType=item_type)
+        self.tables[table].append([values.get(c) for c in TABLE_COLUMNS[table]])
+
+    def query(self, api_query) -> dict:
+        self.queries.append(api_query)
+        if 'receiver0' in api_query:
+            rows = [[row[5], row[6]] for row in self.tables['dependencies']
+                    if row[2] == 'receiver0']
+            return response(['rootTraceId', 'traceId'], rows)
+        operation_ids = re.findall(r'operation_Id == "([^"]*)"', api_query)
+        if operation_ids:
+            columns = list(dict.fromkeys(c for table in ['traces', 'requests', 'dependencies']
+                                         for c in TABLE_COLUMNS[table]))
+            rows = []
+            for table, table_rows in self.tables.items():
+                for row in table_rows:
+                    values = dict(zip(TABLE_COLUMNS[table], row))
+                    if values['operation_Id'] in operation_ids:
+                        rows.append([values.get(c) for c in columns])
+            return response(columns, rows)
+        table = api_query.split()[0]
+        start, operator, end = re.search(
+            r'timestamp >= datetime\((\S+)\) and\s+timestamp (<=?) datetime\((\S+)\)',
+            api_query).groups()
+        end_time = parse_time(end)
+        if operator == '<=':
+            end_time += timedelta(microseconds=1)
+        rows = [row for row in self.tables[table]
+                if parse_time(start) <= parse_time(row[0]) < end_time]
+        return response(TABLE_COLUMNS[table], rows)
+
+
+def downloader(tmp_path, monkeypatch, name, **kwargs) -> AzureTraceDownloader:
+    monkeypatch.setenv('INSIGHTS_APP_ID', 'app')
+    monkeypatch.setenv('INSIGHTS_API_KEY', 'key')
+    log_path = tmp_path / name
+    log_path.mkdir()
+    end = START + timedelta(hours=1)
+    spec = SimpleNamespace(event_log=SimpleNamespace(get_invoke_timespan=lambda: (START, end)),
+                           logs_directory=lambda: log_path)
+    return AzureTraceDownloader(spec, **kwargs)
+
+
+def read_traces(trace_file) -> list:
+    with open(trace_file) as f:
+        return [json.loads(line) for line in f]
+
+
+def download(tmp_path, monkeypatch, insights, bulk) -> list:
+    d = downloader(tmp_path, monkeypatch, f"bulk_{bulk}", bulk=bulk)
+    monkeypatch.setattr(d, 'get_query_result_json', insights.query)
+    d.get_traces()
+    return read_traces(d.spec.logs_directory() / 'traces.json')
+
+
+def test_time_slices():
+    slices = time_slices(START, START + timedelta(minutes=25), timedelta(minutes=10))
+    assert slices == [(START, START + timedelta(minutes=10)),
+                      (START + timedelta(minutes=10), START + timedelta(minutes=20)),
+                      (START + timedelta(minutes=20), START + timedelta(minutes=25))]
+    assert time_slices(START, START, timedelta(minutes=10)) == [(START, START)]
+
+
+def test_bulk_matches_per_trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(azure_trace_downloader, 'BULK_SLICE_DURATION', timedelta(minutes=20))
+    monkeypatch.setattr(azure_trace_downloader, 'BULK_ROW_LIMIT', 50)
+    insights = FakeInsights(300)
+    expected = download(tmp_path, monkeypatch, insights, bulk=False)
+    num_queries = len(insights.queries)
+    traces = download(tmp_path, monkeypatch, insights, bulk=True)
+    assert traces == expected
+    assert len(traces) == 300
+    assert len(traces[1]['tables'][0]['rows']) == 3
+    # Slices with 50 or more rows are split
+    bulk_queries = len(insights.queries) - num_queries
+    assert 3 * 3 < bulk_queries < num_queries / 5
+
+
+def test_bulk_error(tmp_path, monkeypatch):
+    insights = FakeInsights(3)
+    query = insights.query
+    monkeypatch.setattr(insights, 'query', lambda q: query(q) if 'receiver0' in q
+                        else {'error': {'message': 'Throttled'}})
+    with pytest.raises(Exception, match='Throttled'):
+        download(tmp_path, monkeypatch, insights, bulk=True)
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_replay_server(tmp_path, monkeypatch, workers):
+    """Concurrent queries reuse the pooled connections and back off if throttled."""
+    monkeypatch.setattr(azure_trace_downloader, 'BACKOFF_BASE', 0)
+    recorded = download(tmp_path, monkeypatch, FakeInsights(30), bulk=False)
+    traces_file = tmp_path / 'recorded.json'
+    traces_file.write_text(''.join(json.dumps(trace) + '\n' for trace in recorded))
+    with InsightsReplayServer.from_file(traces_file, throttle_rate=0.2,
+                                        retry_after=None) as server:
+        d = downloader(tmp_path, monkeypatch, f"workers_{workers}", workers=workers,
+                       endpoint_url=server.url)
+        d.get_traces()
+    assert read_traces(d.spec.logs_directory() / 'traces.json') == recorded
+    assert d.num_throttled == server.num_throttled > 0
+    assert server.num_requests == 1 + 30 + server.num_throttled
+    assert server.num_connections <= workers
+
+
+def test_replay_server_gives_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(azure_trace_downloader, 'MAX_THROTTLING_RETRIES', 2)
+    with InsightsReplayServer([], throttle_rate=1, retry_after=0) as server:
+        d = downloader(tmp_path, monkeypatch, 'logs', endpoint_url=server.url)
+        with pytest.raises(Exception, match='Too many requests'):
+            d.get_traces()
+    assert server.num_requests == 3
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_replay_server_bulk(tmp_path, monkeypatch, workers):
+    """The bulk mode correlates the same traces from the table queries of the replay server."""
+    monkeypatch.setattr(azure_trace_downloader, 'BULK_SLICE_DURATION', timedelta(minutes=20))
+    recorded = download(tmp_path, monkeypatch, FakeInsights(300), bulk=False)
+    traces_file = tmp_path / 'recorded.json'
+    traces_file.write_text(''.join(json.dumps(trace) + '\n' for trace in recorded))
+    with InsightsReplayServer.from_file(traces_file, row_limit=50) as server:
+        d = downloader(tmp_path, monkeypatch, f"workers_{workers}", bulk=True, workers=workers,
+                       endpoint_url=server.url)
+        d.get_traces()
+    assert read_traces(d.spec.logs_directory() / 'traces.json') == recorded
+    # Slices with more than 50 rows are truncated and split
+    assert server.num_requests > 1 + 3 * 3
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from sb.breakdown_sketches import BreakdownSketches, DDSketch
+
+
+def exact_quantile(values, q):
+    return sorted(values)[int(q * (len(values) - 1))]
+
+
+@pytest.mark.parametrize('q', [0, 0.5, 0.9, 0.99, 1])
+def test_quantile_relative_accuracy(q):
+    rng = random.Random(1)
+    values = [int(rng.lognormvariate(10, 1)) for _ in range(10_000)]
+    sketch = DDSketch()
+    for value in values:
+        sketch.add(value)
+    expected = exact_quantile(values, q)
+    assert abs(sketch.quantile(q) - expected) <= 0.01 * expected
+    assert sketch.count == len(values)
+    assert sketch.mean() == sum(values) / len(values)
+
+
+def test_quantile_zeros():
+    sketch = DDSketch()
+    assert sketch.quantile(0.5) is None
+    for value in [0, 0, 0, 100]:
+        sketch.add(value)
+    assert sketch.quantile(0.5) == 0
+    assert sketch.quantile(1) == 100
+
+
+def test_merge():
+    a, b, both = DDSketch(), DDSketch(), DDSketch()
+    for value in range(1, 1000):
+        (a if value % 3 else b).add(value)
+        both.add(value)
+    assert a.merge(b).to_dict() == both.to_dict()
+    with pytest.raises(ValueError):
+        a.merge(DDSketch(relative_accuracy=0.02))
+
+
+def test_breakdown_sketches(tmp_path):
+    sketches = BreakdownSketches()
+    sketches.add('/api', False, {'duration': 100, 'computation': 50})
+    sketches.add('/api', True, {'duration': 1000, 'computation': 60})
+    sketches.add(None, False, {'duration': 10, 'computation': 0})
+    assert sketches.keys() == [(None, False), ('/api', False), ('/api', True)]
+    assert sketches.sketch('duration').count == 3
+    assert sketches.sketch('duration', url='/api').count == 2
+    assert sketches.quantile(1, 'duration', coldstart=False) == 100
+    sketches_file = tmp_path / 'breakdown_sketches.json'
+    sketches.save(sketches_file)
+    loaded = BreakdownSketches.load(sketches_file)
+    assert loaded.to_dict() == sketches.to_dict()
+    assert loaded.merge(sketches).sketch('computation').count == 6
@@ -1,7 +1,13 @@
-from sb.critical_path_algorithm_async import Span, critical_path
+import pytest
 
+from sb.critical_path_algorithm_async import Span, critical_path, critical_path_iterative
 
-def test_simple():
+# Runs a test for the recursive and the iterative implementation
+implementations = pytest.mark.parametrize('critical_path', [critical_path, critical_path_iterative])
+
+
+@implementations
+def test_simple(critical_path):
     """Basic two-span trace with synchronous invocation."""
     s2 = Span(1, 3, [])
     s1 = Span(0, 6, [s2])
@@ -10,7 +16,8 @@ def test_simple():
     assert cp == [s1, s2]
 
 
-def test_longest_path_async():
+@implementations
+def test_longest_path_async(critical_path):
     """Scenario where an asynchronous invocation is the longest path.
     Adopted from aws_trace_analyzer_test#test_longest_path_async()
     """
@@ -54,7 +61,8 @@ def test_longest_path_async():
     # assert ['s1', 's2', 's3'] == longest_path(G, 's1')
 
 
-def test_longest_path_async_non_last_child():
+@implementations
+def test_longest_path_async_non_last_child(critical_path):
     """Scenario to test whether asynchronous calls of
     non-last child spans are recognized.
     """
@@ -73,7 +81,8 @@ def test_longest_path_async_non_last_child():
     assert cp == [p, a1, a11]
 
 
-def test_longest_path_async_non_last_child_overlapping():
+@implementations
+def test_longest_path_async_non_last_child_overlapping(critical_path):
     """Scenario to test whether asynchronous calls of
     non-last child spans (e.g., a1) are recognized when
     they do NOT `happensBefore` the last returning child.
@@ -96,7 +105,8 @@ def test_longest_path_async_non_last_child_overlapping():
     assert cp == [p, a1, a11]
 
 
-def test_longest_path_sync():
+@implementations
+def test_longest_path_sync(critical_path):
     """Scenario where a synchronous invocation is the longest path
     Adopted from aws_trace_analyzer_test#test_longest_path_sync().
     """
@@ -142,6 +152,16 @@ def test_longest_path_sync():
     # assert ['s1', 's2', 's3'] == longest_path(G, 's1')
 
 
+def test_deep_trace():
+    """Deeply nested synchronous spans exceeding the default recursion limit."""
+    depth = 5000
+    spans = [Span(depth - 1, depth + 1, [])]
+    for i in reversed(range(depth - 1)):
+        spans.insert(0, Span(i, 2 * depth - i, [spans[0]]))
+    cp = critical_path_iterative([spans[0]], spans[0])
+    assert cp == spans
+
+
 # Smoke testing:
 # Run as python tests/unit/async_critical_path_algorithm_test.py
 
@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+import pytest
+import pandas as pd
+
+from sb.aws_trace_analyzer import AwsTraceAnalyzer, TIME_CATEGORIES
+
+pytest.importorskip('pyarrow')
+
+fixtures_path = Path(__file__).parent.parent / 'fixtures/aws_trace_analyzer'
+
+
+def write_traces(t_path, repeat=1):
+    with open(t_path, 'w') as traces_file:
+        for _ in range(repeat):
+            for fixture in sorted(fixtures_path.glob('*/traces.json')):
+                with open(fixture) as json_file:
+                    trace = json.load(json_file)
+                traces_file.write(json.dumps(trace) + '\n')
+
+
+def analyze(log_dir, repeat=1, **kwargs) -> Path:
+    log_dir.mkdir(exist_ok=True)
+    write_traces(log_dir / 'traces.json', repeat)
+    AwsTraceAnalyzer(log_dir / 'traces.json', **kwargs).analyze_traces()
+    return log_dir
+
+
+def test_parquet_matches_csv(tmp_path):
+    csv_dir = analyze(tmp_path / 'csv')
+    parquet_dir = analyze(tmp_path / 'parquet', output_format='parquet')
+    expected = pd.read_csv(csv_dir / 'trace_breakdown.csv')
+    actual = pd.read_parquet(parquet_dir / 'trace_breakdown.parquet')
+    assert list(actual.columns) == list(expected.columns)
+    assert len(actual) == 14
+    for column in ['duration', *TIME_CATEGORIES]:
+        assert actual[column].dtype == 'timedelta64[ns]'
+        assert actual[column].equals(pd.to_timedelta(expected[column]).astype('timedelta64[ns]'))
+    assert actual['url'].dtype == 'category'
+    assert actual['trace_id'].tolist() == expected['trace_id'].tolist()
+    assert actual['start_time'].tolist() == expected['start_time'].tolist()
+    assert actual['num_cold_starts'].tolist() == expected['num_cold_starts'].tolist()
+    assert actual['path_id'].dtype == 'category'
+    assert actual['path_id'].tolist() == expected['path_id'].tolist()
+    assert (parquet_dir / 'invalid_traces.csv').read_bytes() == \
+        (csv_dir / 'invalid_traces.csv').read_bytes()
+
+
+def test_parquet_workers_and_append(tmp_path):
+    serial_dir = analyze(tmp_path / 'serial', repeat=2, output_format='parquet')
+    parallel_dir = analyze(tmp_path / 'parallel', repeat=2, output_format='parquet', workers=3)
+    expected = pd.read_parquet(serial_dir / 'trace_breakdown.parquet')
+    pd.testing.assert_frame_equal(pd.read_parquet(parallel_dir / 'trace_breakdown.parquet'),
+                                  expected)
+    # Append to an existing Parquet file
+    append_dir = analyze(tmp_path / 'append', repeat=1, output_format='parquet')
+    analyze(append_dir, repeat=2, output_format='parquet')
+    pd.testing.assert_frame_equal(pd.read_parquet(append_dir / 'trace_breakdown.parquet'),
+                                  expected)
+    assert not (append_dir / 'trace_breakdown.parquet.tmp').exists()
@@ -0,0 +1,45 @@
+import networkx as nx
+
+from sb.span_tree import SpanTree
+from sb.aws_trace_analyzer import get_sorted_children
+
+
+def build(G):
+    """Builds the same small graph including a missing parent `p` for `c`."""
+    G.add_node('root', **{'doc': {'start_time': 0, 'end_time': 10}})
+    G.add_node('b', **{'doc': {'start_time': 2, 'end_time': 5}})
+    G.add_edge('root', 'b')
+    G.add_node('a', **{'doc': {'start_time': 1, 'end_time': 5}})
+    G.add_edge('root', 'a')
+    G.add_node('c', **{'doc': {'start_time': 3, 'end_time': 4}})
+    G.add_edge('p', 'c')
+    return G
+
+
+def test_same_api_as_networkx():
+    G = build(nx.DiGraph())
+    T = build(SpanTree())
+    assert list(G.nodes(data=True)) == list(T.nodes(data=True))
+    for id in G.nodes:
+        assert list(G.predecessors(id)) == list(T.predecessors(id))
+        assert list(G.successors(id)) == list(T.successors(id))
+        assert G.out_degree(id) == T.out_degree(id)
+        assert G.nodes[id] == T.nodes[id]
+    # Missing parent is created as empty node
+    assert T.nodes['p'] == {}
+
+
+def test_sorted_children():
+    G = build(nx.DiGraph())
+    T = build(SpanTree())
+    assert get_sorted_children(T, 'root') == ['a', 'b']
+    assert get_sorted_children(T, 'root') == get_sorted_children(G, 'root')
+
+
+def test_update_existing_node():
+    T = SpanTree(trace_id='t1')
+    T.add_edge('root', 'child')
+    T.add_node('root', **{'doc': {'start_time': 0, 'end_time': 1}})
+    assert list(T.nodes) == ['root', 'child']
+    assert T.nodes['root']['doc']['end_time'] == 1
+    assert T.graph['trace_id'] == 't1'
@@ -0,0 +1,94 @@
+import csv
+import json
+
+import pytest
+
+import sb.aws_trace_trigger_analyzer as aws_trace_trigger_analyzer
+from sb.aws_trace_trigger_analyzer import AwsTraceTriggerAnalyzer, extract_root_trace_id
+from sb.trace_correlator import CHILD, PARENT, TraceCorrelator, read_line
+from sb.trace_generator import TraceGenerator
+
+
+def write_lines(path, lines) -> list:
+    """Writes the lines and returns their (offset, length) tuples."""
+    entries = []
+    offset = 0
+    with open(path, 'wb') as f:
+        for line in lines:
+            data = (line + '\n').encode('utf-8')
+            f.write(data)
+            entries.append((offset, len(data)))
+            offset += len(data)
+    return entries
+
+
+@pytest.mark.parametrize('max_pending', [1, 100])
+def test_trace_correlator(tmp_path, max_pending):
+    traces_file = tmp_path / 'traces.json'
+    lines = ['{"Id": "a"}', '{"Id": "b"}', '{"Id": "c", "µ": 1}', '{"Id": "d"}']
+    entries = write_lines(traces_file, lines)
+    with TraceCorrelator(tmp_path / 'index.sqlite', max_pending) as correlator:
+        correlator.add(PARENT, 'a', *entries[0])
+        correlator.add(CHILD, 'a', *entries[1])
+        correlator.add(PARENT, 'c', *entries[2])
+        correlator.add(PARENT, 'd', *entries[3])
+        # Replaces the pending parent with the same id
+        correlator.add(PARENT, 'd', *entries[1])
+        assert correlator.pop(PARENT, 'x') is None
+        assert correlator.pop(CHILD, 'a') == entries[1]
+        assert correlator.pop(CHILD, 'a') is None
+        assert correlator.pop(PARENT, 'a') == entries[0]
+        assert correlator.num_pending(PARENT) == 2
+        assert correlator.num_pending(CHILD) == 0
+        assert list(correlator.remaining(PARENT)) == [entries[1], entries[2]]
+        assert (correlator.num_spilled > 0) == (max_pending == 1)
+    assert (tmp_path / 'index.sqlite').exists() == (max_pending == 1)
+    with open(traces_file, 'rb') as traces:
+        assert read_line(traces, *entries[2]) == lines[2] + '\n'
+
+
+def add_child_error(line) -> str:
+    trace = json.loads(line)
+    doc = json.loads(trace['Segments'][0]['Document'])
+    doc['error'] = True
+    trace['Segments'][0]['Document'] = json.dumps(doc, separators=(',', ':'))
+    return json.dumps(trace)
+
+
+def test_analyze_traces_spilled(tmp_path, monkeypatch):
+    """Spilling pending traces to disk and analyzing batches in parallel produce
+    the same output as the serial analysis in memory.
+    Every parent trace produces exactly one valid or invalid row even if
+    its child trace is lost or the merge fails."""
+    monkeypatch.setattr(aws_trace_trigger_analyzer, 'JOB_BATCH_SIZE', 7)
+    generated = tmp_path / 'generated.json'
+    TraceGenerator(seed=2, invalid_ratio=0).write_trigger_traces(generated, 100)
+    lines = []
+    num_children = 0
+    for line in generated.read_text().splitlines():
+        if extract_root_trace_id(line):
+            num_children += 1
+            if num_children % 5 == 0:  # lost child trace
+                continue
+            if num_children % 7 == 0:  # child trace with error
+                line = add_child_error(line)
+        lines.append(line)
+    outputs = dict()
+    for max_pending, workers in [(10_000, 1), (1, 1), (1, 3)]:
+        log_dir = tmp_path / f"max_pending_{max_pending}_workers_{workers}"
+        log_dir.mkdir()
+        write_lines(log_dir / 'traces.json', lines)
+        AwsTraceTriggerAnalyzer(log_dir / 'traces.json', max_pending=max_pending,
+                                workers=workers).analyze_traces()
+        outputs[(max_pending, workers)] = [(log_dir / f).read_bytes() for f in ['trigger.csv', 'trigger_invalid_traces.csv']]  # noqa: E501
+        # The temporary index is removed
+        assert sorted(p.name for p in log_dir.iterdir()) == \
+            ['traces.json', 'trigger.csv', 'trigger_invalid_traces.csv']
+    assert outputs[(1, 1)] == outputs[(10_000, 1)]
+    assert outputs[(1, 3)] == outputs[(10_000, 1)]
+    with open(log_dir / 'trigger.csv') as f:
+        num_valid = len(list(csv.DictReader(f)))
+    with open(log_dir / 'trigger_invalid_traces.csv') as f:
+        num_invalid = len(list(csv.DictReader(f)))
+    assert num_invalid > 0
+    assert num_valid + num_invalid == 100
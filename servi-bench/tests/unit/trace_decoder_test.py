@@ -0,0 +1,32 @@
+import json
+import pytest
+
+from sb.trace_decoder import get_decoder
+
+
+DOCUMENT = '{"id":"4ad8d6d4a3bb4d87","name":"TriggerLambda","start_time":1624353531.8655,"end_time":1624353532.0000005,"subsegments":[{"id":"a","name":"Invocation"}]}'  # noqa: E501
+
+
+def test_get_decoder_json():
+    name, loads = get_decoder('json')
+    assert name == 'json'
+    assert loads(DOCUMENT) == json.loads(DOCUMENT)
+
+
+def test_get_decoder_orjson():
+    pytest.importorskip('orjson')
+    name, loads = get_decoder('orjson')
+    assert name == 'orjson'
+    # Timestamps must be parsed into exactly the same floats
+    assert loads(DOCUMENT) == json.loads(DOCUMENT)
+    assert loads(DOCUMENT.encode()) == json.loads(DOCUMENT)
+
+
+def test_get_decoder_default():
+    name, loads = get_decoder()
+    assert name in ['orjson', 'json']
+
+
+def test_get_decoder_unsupported():
+    with pytest.raises(ValueError):
+        get_decoder('unknown')
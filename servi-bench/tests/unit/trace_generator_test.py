@@ -0,0 +1,83 @@
+import csv
+import json
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+from sb.aws_trace_analyzer import AwsTraceAnalyzer, CSV_FIELDS, extract_trace_breakdown
+from sb.aws_trace_trigger_analyzer import AwsTraceTriggerAnalyzer
+from sb.trace_generator import TraceGenerator, EXTERNAL_SERVICES, INVALID_CASES
+
+
+def read_rows(path) -> list:
+    with open(path) as f:
+        return list(csv.DictReader(f))
+
+
+def test_traces_deterministic(tmp_path):
+    a = tmp_path / 'a.json'
+    b = tmp_path / 'b.json'
+    TraceGenerator(seed=3).write_traces(a, 50)
+    TraceGenerator(seed=3).write_traces(b, 50)
+    assert a.read_bytes() == b.read_bytes()
+    c = tmp_path / 'c.json'
+    TraceGenerator(seed=4).write_traces(c, 50)
+    assert a.read_bytes() != c.read_bytes()
+
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'step_functions_ratio': 1.0},
+    {'depth': 4, 'cold_start_ratio': 0.5},
+])
+def test_traces_valid(params):
+    generator = TraceGenerator(seed=1, invalid_ratio=0, **params)
+    services = set()
+    external_service = timedelta()
+    for trace, invalid_case in generator.traces(100):
+        assert invalid_case is None
+        row = extract_trace_breakdown(trace)
+        assert row[CSV_FIELDS.index('duration')].total_seconds() > 0
+        services.update(row[CSV_FIELDS.index('services')])
+        external_service += row[CSV_FIELDS.index('external_service')]
+    # Inferred segments of the external services
+    assert {origin for _, origin in EXTERNAL_SERVICES} <= services
+    assert external_service > timedelta()
+
+
+@pytest.mark.parametrize('invalid_case', INVALID_CASES)
+def test_traces_invalid(invalid_case):
+    generator = TraceGenerator(seed=1)
+    for _ in range(20):
+        trace = generator.trace(generator.start_time, invalid_case)
+        with pytest.raises(Exception):
+            extract_trace_breakdown(trace)
+
+
+def test_analyze_generated_traces(tmp_path):
+    traces_path = tmp_path / 'traces.json'
+    num_invalid = TraceGenerator(seed=1, invalid_ratio=0.1).write_traces(traces_path, 300)
+    assert num_invalid > 0
+    AwsTraceAnalyzer(traces_path).analyze_traces()
+    assert len(read_rows(tmp_path / 'trace_breakdown.csv')) == 300 - num_invalid
+    assert len(read_rows(tmp_path / 'invalid_traces.csv')) == num_invalid
+
+
+@pytest.mark.parametrize('connected_ratio', [0.0, 0.5, 1.0])
+def test_analyze_generated_trigger_traces(tmp_path, connected_ratio):
+    traces_path = tmp_path / 'traces.json'
+    generator = TraceGenerator(seed=1, invalid_ratio=0)
+    generator.write_trigger_traces(traces_path, 200, connected_ratio)
+    AwsTraceTriggerAnalyzer(traces_path).analyze_traces()
+    triggers = read_rows(tmp_path / 'trigger.csv')
+    assert len(triggers) == 200
+    assert len(read_rows(tmp_path / 'trigger_invalid_traces.csv')) == 0
+    for trigger in triggers:
+        assert trigger['t1'] <= trigger['t2']
+        assert trigger['t3'] <= trigger['t4'] <= trigger['t5']
+    # Every child trace is merged with its parent
+    if connected_ratio < 1.0:
+        assert any(trigger['child_trace_id'] for trigger in triggers)
+    parent_ids = {json.loads(line)['Id'] for line in Path(traces_path).read_text().splitlines()}
+    assert {trigger['root_trace_id'] for trigger in triggers} <= parent_ids
@@ -0,0 +1,62 @@
+import json
+from pathlib import Path
+
+from sb.aws_trace_analyzer import AwsTraceAnalyzer
+from sb.trace_paths import PATHS_FILE, TracePaths, path_signature
+
+
+def test_path_signature():
+    warm = ('API', 'fn', 'fn', 'Invocation', 'Overhead')
+    cold = ('API', 'fn', 'fn', 'Initialization', 'Invocation', 'Overhead')
+    assert path_signature(warm) == path_signature(cold)
+    assert path_signature(warm) != path_signature(('API', 'fn', 'fn', 'Invocation'))
+    # Stable across runs (i.e., not based on the randomized built-in hash)
+    assert path_signature(('API',)) == 'a4de64359d2c75f2'
+
+
+def test_trace_paths(tmp_path):
+    trace_paths = TracePaths()
+    trace_paths.add('a', ['API', 'Initialization', 'fn'])
+    trace_paths.add('a', ['API', 'fn'])
+    other = TracePaths()
+    other.add('b', ['API'])
+    other.add('a', ['API', 'fn'])
+    trace_paths.merge(other)
+    assert trace_paths.names('a') == ['API', 'fn']
+    assert trace_paths.paths['a']['num_traces'] == 3
+    assert list(trace_paths.paths) == ['a', 'b']
+    paths_file = tmp_path / PATHS_FILE
+    trace_paths.save(paths_file)
+    assert TracePaths.load(paths_file).to_dict() == trace_paths.to_dict()
+
+
+def write_traces(t_path, repeat=1):
+    fixtures_path = Path(__file__).parent.parent / 'fixtures/aws_trace_analyzer'
+    with open(t_path, 'w') as traces_file:
+        for _ in range(repeat):
+            for fixture in sorted(fixtures_path.glob('*/traces.json')):
+                with open(fixture) as json_file:
+                    traces_file.write(json.dumps(json.load(json_file)) + '\n')
+
+
+def test_analyze_traces_paths(tmp_path):
+    """The path dictionary is independent of workers and incremental analysis."""
+    outputs = dict()
+    for workers in [1, 3]:
+        log_dir = tmp_path / f"workers_{workers}"
+        log_dir.mkdir()
+        write_traces(log_dir / 'traces.json', repeat=3)
+        AwsTraceAnalyzer(log_dir / 'traces.json', workers=workers).analyze_traces()
+        outputs[workers] = (log_dir / PATHS_FILE).read_bytes()
+    assert outputs[1] == outputs[3]
+    trace_paths = TracePaths.load(tmp_path / 'workers_1' / PATHS_FILE)
+    assert sum(path['num_traces'] for path in trace_paths.paths.values()) == 3 * 14
+    assert all('Initialization' not in path['names'] for path in trace_paths.paths.values())
+
+    log_dir = tmp_path / 'incremental'
+    log_dir.mkdir()
+    write_traces(log_dir / 'traces.json', repeat=1)
+    AwsTraceAnalyzer(log_dir / 'traces.json').analyze_traces()
+    write_traces(log_dir / 'traces.json', repeat=3)
+    AwsTraceAnalyzer(log_dir / 'traces.json').analyze_traces()
+    assert (log_dir / PATHS_FILE).read_bytes() == outputs[1]